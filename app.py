@@ -1,21 +1,19 @@
 import io
-import re
 import streamlit as st
 import pandas as pd
 from io import BytesIO
 
-from extractor import extract_text_bytes
-from parser_router import select_parser
-from excel_writer import DOMINIO_COLUMNS, record_to_row
+from batch import run_batch
+from excel_writer import DOMINIO_COLUMNS, record_to_row, write_xlsx
 
 st.set_page_config(page_title="Importador NFS-e (Domínio)", layout="wide")
 
 st.title("📥 Importador NFS-e → Planilha Domínio")
-st.caption("Envie PDFs de diferentes prefeituras. O sistema detecta automaticamente o layout e gera um XLSX no padrão do Domínio.")
+st.caption("Envie PDFs de diferentes prefeituras (ou os XMLs da NFS-e Nacional/ABRASF). O sistema detecta automaticamente o layout e gera um XLSX no padrão do Domínio.")
 
 uploaded_files = st.file_uploader(
-    "Selecione um ou mais PDFs de NFS-e",
-    type=["pdf"],
+    "Selecione um ou mais PDFs/XMLs de NFS-e (ou ZIPs com eles)",
+    type=["pdf", "xml", "zip"],
     accept_multiple_files=True
 )
 
@@ -28,93 +26,40 @@ def make_dataframe(registros: list) -> pd.DataFrame:
 
 
 # ---------- Helpers específicos ----------
-def pdf_has_text_bytes(file_bytes: bytes, min_chars: int = 50) -> bool:
-    """
-    Detecta se o PDF (bytes) contém texto pesquisável usando extractor.extract_text_bytes.
-    Retorna True se acumulou ao menos `min_chars` caracteres de texto.
-    (Evita dependência em PyPDF2.)
-    """
-    try:
-        txt = extract_text_bytes(file_bytes)
-        return len(txt.strip()) >= min_chars
-    except Exception:
-        return False
-
-
-def is_valid_cnpj(cnpj: str) -> bool:
-    if not cnpj:
-        return False
-    digits = re.sub(r"\D", "", cnpj)
-    return len(digits) == 14
-
-
-def parse_result_status(res: dict, require_serie: bool = True):
-    """
-    Valida campos essenciais do parse.
-    Retorna (ok: bool, missing: list)
-    """
-    missing = []
-    if not isinstance(res, dict):
-        return False, ["PARSE_FAIL"]
-    cnpj = res.get("cnpj_cpf", "") or ""
-    numero = str(res.get("numero_documento", "") or "").strip()
-    serie = str(res.get("serie", "") or "").strip()
-    if not is_valid_cnpj(cnpj):
-        missing.append("CNPJ")
-    if not numero or not re.search(r"\d", numero):
-        missing.append("NÚMERO")
-    if require_serie and not serie:
-        missing.append("SÉRIE")
-    return len(missing) == 0, missing
+# mínimo de caracteres para considerar que o PDF tem texto pesquisável
+MIN_TEXT_CHARS = 50
+
+
+def app_log_line(out: dict) -> str:
+    # no app o ERRO/TIMEOUT leva o nome do parser, para facilitar a triagem
+    if out["status"] in ("ERRO", "TIMEOUT") and out.get("parser"):
+        return f"{out['log']} - {out['parser']}"
+    return out["log"]
 
 
 # ---------- Main UI flow ----------
 if processar:
     if not uploaded_files:
-        st.warning("Envie pelo menos um PDF.")
+        st.warning("Envie pelo menos um PDF ou XML.")
         st.stop()
 
     registros = []
     logs = []
 
     with st.spinner("Lendo e extraindo dados..."):
-        for f in uploaded_files:
-            try:
-                raw = f.read()  # bytes
-                # 1) se for PDF sem texto suficiente -> considerar IMAGEM/SCAN
-                if not pdf_has_text_bytes(raw):
-                    logs.append(f"{f.name}: IMAGEM")
-                    continue
-
-                # 2) extrai texto (sua função já usa pdfplumber internamente)
-                text = extract_text_bytes(raw)
-                parser_name, parser_fn = select_parser(text)
-
-                # 3) rodar parser
-                try:
-                    parsed = parser_fn(text)
-                except Exception as e:
-                    logs.append(f"{f.name}: ERRO (parse exception) - {parser_name}")
-                    # opcional: registrar traceback em logs detalhados
-                    continue
-
-                # marca origem
-                parsed["origem_parser"] = parser_name
-
-                # 4) validação e logs curtos
-                ok, missing = parse_result_status(parsed, require_serie=True)
-                if ok:
-                    logs.append(f"{f.name}: OK")
-                else:
-                    # inclua parser_name no log de erro para facilitar triagem
-                    logs.append(f"{f.name}: ERRO ({', '.join(missing)}) - {parser_name}")
-
-                # 5) armazenar registro (mantive o comportamento anterior)
-                registros.append(parsed)
-
-            except Exception as e:
-                # erro inesperado na leitura/fluxo
-                logs.append(f"{f.name}: ERRO - {e}")
+        # mesmo pipeline do main.run: extração sob demanda (com cache em disco),
+        # checagem de IMAGEM/OCR, separação de notas concatenadas, roteador e parser.
+        # ZIPs são abertos membro a membro dentro do run_batch; XMLs vão direto ao registro.
+        tasks = [(f.name, f.getvalue()) for f in uploaded_files]
+        for out in run_batch(tasks, min_chars=MIN_TEXT_CHARS):
+            logs.append(app_log_line(out))
+            parsed = out["registro"]
+            if parsed is None:
+                continue
+            # marca origem
+            parsed["origem_parser"] = out["parser"]
+            # armazenar registro (mantive o comportamento anterior: ERRO de validação também entra)
+            registros.append(parsed)
 
     # Cria DataFrame no layout Domínio
     df = make_dataframe(registros)
@@ -122,10 +67,9 @@ if processar:
     st.subheader("Pré-visualização (layout Domínio)")
     st.dataframe(df, use_container_width=True, hide_index=True)
 
-    # Gera Excel em memória
+    # Gera Excel em memória (mesmo writer do main: streaming, direto dos registros)
     xlsx_buf = io.BytesIO()
-    with pd.ExcelWriter(xlsx_buf, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Notas")
+    write_xlsx(registros, xlsx_buf)
     xlsx_buf.seek(0)
 
     st.download_button(
@@ -0,0 +1,71 @@
+# archive.py
+# Leitura de ZIPs de PDFs/XMLs (o que os escritórios contábeis mandam) sem
+# descompactar em disco: cada PDF é lido do arquivo só quando chega a vez dele,
+# então um ZIP de 2 GB nunca fica inteiro na memória.
+import zipfile
+from io import BytesIO
+from pathlib import PurePosixPath
+from typing import Callable, Iterator, Optional, Tuple
+
+ARCHIVE_EXTENSIONS = (".zip",)
+# membros lidos de dentro do ZIP (o resto é ignorado)
+MEMBER_EXTENSIONS = (".pdf", ".xml")
+
+
+def is_archive(name: str) -> bool:
+    return str(name).lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def _skip(member: str) -> bool:
+    p = PurePosixPath(member)
+    # lixo de compactadores do macOS / arquivos ocultos
+    return "__MACOSX" in p.parts or p.name.startswith(".")
+
+
+def _known(known, label: str, fallback) -> Tuple[str, object]:
+    prior = known(label) if known is not None else None
+    return label, (prior if prior is not None else fallback)
+
+
+def iter_archive(source, name: str = "", known: Optional[Callable[[str], object]] = None
+                 ) -> Iterator[Tuple[str, object]]:
+    """
+    Gera (nome, bytes) para cada PDF/XML dentro do ZIP `source` (caminho, bytes
+    ou arquivo aberto), na ordem do arquivo. ZIPs dentro do ZIP também são lidos.
+    Os demais membros são ignorados. Se um membro (ou o próprio ZIP) não
+    puder ser lido, vem (nome, exceção) no lugar dos bytes, para o lote registrar
+    ERRO só daquele item. Se known(nome) devolver algo (não None) — resultado
+    já conhecido do item —, vem (nome, isso), sem ler os bytes do membro.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    prefix = f"{name}/" if name else ""
+    try:
+        zf = zipfile.ZipFile(source)
+    except Exception as e:
+        yield _known(known, name or "?", e)
+        return
+    with zf:
+        for info in zf.infolist():
+            member = info.filename
+            if info.is_dir() or _skip(member):
+                continue
+            label = prefix + member
+            if is_archive(member):
+                try:
+                    inner = zf.read(info)
+                except Exception as e:
+                    yield _known(known, label, e)
+                    continue
+                yield from iter_archive(inner, label, known)
+                continue
+            if not member.lower().endswith(MEMBER_EXTENSIONS):
+                continue
+            prior = known(label) if known is not None else None
+            if prior is not None:
+                yield label, prior
+                continue
+            try:
+                yield label, zf.read(info)
+            except Exception as e:  # senha, CRC inválido, método não suportado...
+                yield label, e
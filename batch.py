@@ -0,0 +1,443 @@
+# batch.py
+# Processamento em lote dos PDFs: extrair -> rotear -> parsear, em paralelo
+# (um processo por núcleo; o trabalho é CPU-bound no pdfminer/regex).
+# XMLs de NFS-e pulam essa cadeia: viram registro direto (ver nfse_xml).
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from settings import (BATCH_WORKERS, BATCH_CHUNK_SIZE, SPLIT_MULTI_NOTES, DOC_TIMEOUT_S,
+                      PARSE_TIMEOUT_S, WATCHDOG_GRACE_S, EXTRACT_MAX_RSS_MB, OCR_TIMEOUT_S)
+from parser_router import select_parser_context, select_parser_lazy, parser_version
+from segmenter import split_notes
+from cache import open_cached_document, save_document, cached_parse
+from ocr import available as ocr_available, ocr_processes, open_ocr_document, \
+    set_worker_share
+from memstats import peak_rss_mb
+from archive import is_archive, iter_archive
+from nfse_xml import is_xml, iter_xml_records
+from record import NfseRecord
+from deadlines import DocumentTimeout, budget, can_interrupt
+
+
+# ---------- Helpers ----------
+def is_valid_cnpj(s: str) -> bool:
+    if not s:
+        return False
+    digits = re.sub(r"\D", "", s)
+    return len(digits) == 14
+
+def parse_result_status(parse_res: NfseRecord, require_serie: bool = True):
+    """
+    Retorna (is_valid: bool, missing: list)
+    """
+    missing = []
+    if not isinstance(parse_res, (NfseRecord, dict)):
+        return False, ["PARSE_FAIL"]
+    c = parse_res.get("cnpj_cpf", "") or ""
+    n = str(parse_res.get("numero_documento", "") or "").strip()
+    s = str(parse_res.get("serie", "") or "").strip()
+    if not is_valid_cnpj(c):
+        missing.append("CNPJ")
+    if not n or not re.search(r"\d", n):
+        missing.append("NÚMERO")
+    if require_serie and not s:
+        missing.append("SÉRIE")
+    return (len(missing) == 0), missing
+
+def _outcome(filename: str, status: str, log: str, registro: Optional[NfseRecord] = None,
+             parser: str = "", ocr: bool = False) -> dict:
+    return {"arquivo": filename, "status": status, "log": log,
+            "registro": registro, "parser": parser, "ocr": ocr}
+
+
+# ---------- Unidade de trabalho (roda dentro do worker) ----------
+def process_source(name: str, source, min_chars: int = 40) -> List[dict]:
+    """
+    Processa um PDF (caminho ou bytes) e devolve uma lista de resultados, um por
+    nota (PDFs com várias NFS-e concatenadas geram vários; "arquivo" vira
+    "nome.pdf#1", "nome.pdf#2"...). Cada resultado é um dict:
+        {"arquivo", "status" (OK/ERRO/IMAGEM/TIMEOUT), "log", "registro", "parser", "ocr",
+         "peak_rss_mb" (pico de memória do processo que o processou)}
+    Nunca propaga exceção: qualquer falha vira status ERRO só deste arquivo;
+    extração ou parse além do prazo (settings.DOC_TIMEOUT_S / PARSE_TIMEOUT_S)
+    vira TIMEOUT.
+    """
+    outs = _process_source(name, source, min_chars)
+    peak = peak_rss_mb()
+    for out in outs:
+        out["peak_rss_mb"] = peak
+    return outs
+
+
+def process_pdf(path: str) -> List[dict]:
+    return process_source(os.path.basename(path), path)
+
+
+def _route(doc) -> List[Tuple[str, Callable, str]]:
+    """
+    [(parser_name, parse_fn, texto)] do documento: uma entrada por nota quando o
+    PDF traz várias NFS-e concatenadas (settings.SPLIT_MULTI_NOTES), senão uma só.
+    """
+    segments = split_notes(doc) if SPLIT_MULTI_NOTES else None
+    if segments:
+        return [select_parser_context(seg) for seg in segments]
+    # só as páginas que o parser declara precisar
+    return [select_parser_lazy(doc)]
+
+
+def _process_source(filename: str, source, min_chars: int) -> List[dict]:
+    ocr = False
+    try:
+        # 1) abrir o PDF; as páginas só são extraídas quando alguém lê
+        #    (e as já extraídas em execuções anteriores vêm do cache)
+        with budget(DOC_TIMEOUT_S, "extração"), open_cached_document(source) as doc:
+            try:
+                # heurística simples: se pouco ou nada de texto, considerar imagem/scan
+                # (para no 1º trecho com min_chars caracteres; não precisa ler o resto)
+                is_image = doc.is_image(min_chars=min_chars)
+                if not is_image:
+                    # 2) selecionar parser(s)
+                    jobs = _route(doc)
+            finally:
+                save_document(doc)
+
+        # scan: tenta OCR local; sem OCR (ou sem texto mesmo após OCR) fica IMAGEM
+        if is_image:
+            with budget(OCR_TIMEOUT_S, "OCR"):
+                ocr_doc = open_ocr_document(source, doc.sha256)
+            if ocr_doc is None or ocr_doc.is_image(min_chars=min_chars):
+                return [_outcome(filename, "IMAGEM", f"{filename}: IMAGEM")]
+            ocr = True
+            jobs = _route(ocr_doc)
+    except DocumentTimeout as e:
+        return [_outcome(filename, "TIMEOUT", f"{filename}: TIMEOUT - {e}", ocr=ocr)]
+    except Exception as e:
+        return [_outcome(filename, "ERRO", f"{filename}: ERRO - {e}", ocr=ocr)]
+
+    if len(jobs) == 1:
+        return [_parse_one(filename, *jobs[0], ocr=ocr)]
+    return [_parse_one(f"{filename}#{k}", *job, ocr=ocr) for k, job in enumerate(jobs, 1)]
+
+
+def _parse_one(filename: str, parser_name: str, parse_fn, text: str, ocr: bool = False) -> dict:
+    tag = " (OCR)" if ocr else ""
+    try:
+        # parsed é um NfseRecord (mesmo texto + mesma versão do parser -> vem do cache)
+        with budget(PARSE_TIMEOUT_S, "parse", EXTRACT_MAX_RSS_MB) as b:
+            parsed = cached_parse(parser_name, parser_version(parser_name),
+                                  _checked(parse_fn, b), text)
+    except DocumentTimeout as e:
+        return _outcome(filename, "TIMEOUT", f"{filename}: TIMEOUT - {e}{tag}",
+                        parser=parser_name, ocr=ocr)
+    except Exception:
+        return _outcome(filename, "ERRO", f"{filename}: ERRO (parse exception){tag}",
+                        parser=parser_name, ocr=ocr)
+
+    # 3) validar campos essenciais
+    ok, missing = parse_result_status(parsed, require_serie=True)
+    if ok:
+        return _outcome(filename, "OK", f"{filename}: OK{tag}", parsed, parser_name, ocr)
+    # mantém o registro mesmo com ERRO (comportamento original)
+    return _outcome(filename, "ERRO", f"{filename}: ERRO ({', '.join(missing)}){tag}",
+                    parsed, parser_name, ocr)
+
+
+def _checked(parse_fn, b):
+    # parser que engole exceções (ex.: `finally: return d`) devolveria um registro
+    # parcial depois do prazo: relança o estouro antes de o cache gravar o resultado
+    def run(text):
+        rec = parse_fn(text)
+        b.check()
+        return rec
+    return run
+
+
+def process_xml(name: str, source) -> List[dict]:
+    """
+    XML de NFS-e (Nacional/ABRASF): mapeado direto para o registro, sem
+    extração de PDF. Um resultado por nota ("nome.xml#1"... se houver várias);
+    XML malformado vira ERRO depois das notas que deu para ler.
+    """
+    notes, error = [], None
+    try:
+        with budget(DOC_TIMEOUT_S, "XML"):
+            notes.extend(iter_xml_records(source))
+    except DocumentTimeout as e:
+        return [_outcome(name, "TIMEOUT", f"{name}: TIMEOUT - {e}")]
+    except Exception as e:
+        error = e
+    if not notes:
+        why = f"XML inválido ({error})" if error is not None else "nenhuma NFS-e no XML"
+        return [_outcome(name, "ERRO", f"{name}: ERRO - {why}")]
+
+    outs = []
+    multi = len(notes) > 1 or error is not None
+    for k, (parser_name, rec) in enumerate(notes, 1):
+        label = f"{name}#{k}" if multi else name
+        ok, missing = parse_result_status(rec, require_serie=True)
+        if ok:
+            outs.append(_outcome(label, "OK", f"{label}: OK (XML)", rec, parser_name))
+        else:
+            outs.append(_outcome(label, "ERRO", f"{label}: ERRO ({', '.join(missing)}) (XML)",
+                                 rec, parser_name))
+    if error is not None:
+        outs.append(_outcome(name, "ERRO", f"{name}: ERRO - XML inválido ({error})"))
+    peak = peak_rss_mb()
+    for out in outs:
+        out["peak_rss_mb"] = peak
+    return outs
+
+
+def process_task(task: Tuple[str, object], min_chars: int = 40) -> List[dict]:
+    """
+    task = (nome, caminho | bytes | exceção de leitura do ZIP). Todos os
+    resultados levam "tarefa" = nome, e o último deles "fim_tarefa" = True (o
+    diário do lote marca a tarefa inteira como concluída, mesmo quando ela gera
+    várias notas).
+    """
+    name, source = task
+    if isinstance(source, PriorResults):
+        return list(source)
+    if isinstance(source, Exception):
+        outs = [_outcome(name, "ERRO", f"{name}: ERRO - {source}")]
+    elif is_xml(name):
+        outs = process_xml(name, source)
+    else:
+        outs = process_source(name, source, min_chars)
+    return _tagged(name, outs)
+
+
+class PriorResults(list):
+    """Resultados já conhecidos da tarefa (manifesto/diário): saem sem reprocessar."""
+
+
+def _prior(reuse, name: str) -> Optional[PriorResults]:
+    outs = reuse(name) if reuse is not None else None
+    return PriorResults(outs) if outs is not None else None
+
+
+def _tagged(name: str, outs: List[dict]) -> List[dict]:
+    for out in outs:
+        out["tarefa"] = name
+    outs[-1]["fim_tarefa"] = True
+    return outs
+
+
+def _process_chunk(chunk: List[Tuple[str, object]], min_chars: int) -> List[dict]:
+    outs = []
+    for task in chunk:
+        outs.extend(process_task(task, min_chars))
+    return outs
+
+
+def _process_isolated(task: Tuple[str, object], min_chars: int) -> List[dict]:
+    # usado só depois que um worker morreu/travou: cada arquivo num processo
+    # próprio, para que um PDF que derruba (ou trava) o interpretador não leve
+    # os outros junto
+    name = task[0]
+    ex = _pool(1)
+    try:
+        return ex.submit(process_task, task, min_chars).result(timeout=_watchdog_timeout(1))
+    except FutureTimeout:
+        _kill_workers(ex)
+        return _tagged(name, [_outcome(name, "TIMEOUT", f"{name}: TIMEOUT - processo travado (encerrado)")])
+    except BrokenProcessPool:
+        return _tagged(name, [_outcome(name, "ERRO", f"{name}: ERRO - processo abortado")])
+    finally:
+        ex.shutdown(wait=True)
+
+
+def _watchdog_timeout(n_tasks: int) -> Optional[float]:
+    """Espera máxima pelo resultado de n arquivos num worker (None = sem watchdog)."""
+    per_task = (DOC_TIMEOUT_S or 0) + (PARSE_TIMEOUT_S or 0)
+    if not per_task:
+        return None
+    if ocr_available():
+        # qualquer PDF do lote pode ser um scan: o prazo do OCR também conta
+        if not OCR_TIMEOUT_S:
+            return None
+        per_task += OCR_TIMEOUT_S
+    return n_tasks * per_task + (WATCHDOG_GRACE_S or 0)
+
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    # cada worker fica com a sua fatia dos processos de OCR: com 1 worker (lote de
+    # um arquivo, app do Streamlit) o OCR paralelo por página usa todos
+    return ProcessPoolExecutor(max_workers=workers, initializer=set_worker_share,
+                               initargs=(ocr_processes(workers),))
+
+
+def _kill_workers(ex: ProcessPoolExecutor) -> None:
+    # o executor não expõe como matar um worker; os processos ficam em _processes
+    for proc in list((getattr(ex, "_processes", None) or {}).values()):
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+
+
+def _next_result(ex: ProcessPoolExecutor, pending: deque) -> List[dict]:
+    chunk, future = pending[0]
+    try:
+        outs = future.result(timeout=_watchdog_timeout(len(chunk)))
+    except FutureTimeout:
+        # worker travado em código nativo (nem o SIGALRM do prazo o interrompe)
+        _kill_workers(ex)
+        raise BrokenProcessPool("worker sem resposta (watchdog)")
+    pending.popleft()
+    return outs
+
+
+# ---------- Motor do lote ----------
+def resolve_workers(workers: Optional[int] = None) -> int:
+    workers = workers or BATCH_WORKERS or os.cpu_count() or 1
+    return max(1, int(workers))
+
+def iter_tasks(items: Iterable, reuse: Optional[Callable[[str], Optional[List[dict]]]] = None
+               ) -> Iterator[Tuple[str, object]]:
+    """
+    Normaliza a entrada do lote em tarefas (nome, caminho|bytes), sob demanda:
+      - caminho de PDF/XML        -> (nome do arquivo, caminho)
+      - caminho de ZIP            -> um (zip/membro.pdf, bytes) por PDF/XML de dentro
+      - (nome, bytes|caminho)     -> idem, expandindo se `nome` for .zip
+    reuse(nome) -> lista de resultados já conhecidos (ou None): a tarefa sai com
+    eles em vez de ser processada (ZIP inteiro ou membro: nem é lido).
+    """
+    known = (lambda label: _prior(reuse, label)) if reuse is not None else None
+    for item in items:
+        if isinstance(item, tuple):
+            name, source = item
+        else:
+            name, source = os.path.basename(str(item)), str(item)
+        prior = _prior(reuse, name)
+        if prior is not None:
+            yield name, prior
+        elif is_archive(name):
+            yield from iter_archive(source, name, known)
+        else:
+            yield name, source
+
+
+def _chunked(tasks: Iterator, size: int) -> Iterator[list]:
+    chunk = []
+    for t in tasks:
+        chunk.append(t)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _warm() -> int:
+    # roda em cada worker novo: o processo sobe e importa o pipeline agora
+    return os.getpid()
+
+
+class WorkerPool:
+    """
+    Pool de processos reaproveitado entre lotes (modo contínuo, ver inbox.py):
+    os workers ficam de pé e já aquecidos, então um lote pequeno não paga a
+    subida dos processos nem os imports. Se um worker morrer/travar, o pool é
+    descartado e o próximo executor() sobe outro.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = resolve_workers(workers)
+        self._ex: Optional[ProcessPoolExecutor] = None
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self._ex is None:
+            self._ex = _pool(self.workers)
+            for f in [self._ex.submit(_warm) for _ in range(self.workers)]:
+                f.result()
+        return self._ex
+
+    def discard(self) -> None:
+        if self._ex is not None:
+            _kill_workers(self._ex)
+            self._ex.shutdown(wait=False, cancel_futures=True)
+            self._ex = None
+
+    def close(self) -> None:
+        if self._ex is not None:
+            self._ex.shutdown(wait=True)
+            self._ex = None
+
+
+def run_batch(paths: Iterable, workers: Optional[int] = None,
+              chunksize: Optional[int] = None, min_chars: int = 40,
+              reuse: Optional[Callable[[str], Optional[List[dict]]]] = None,
+              pool: Optional[WorkerPool] = None) -> Iterator[dict]:
+    """
+    Processa `paths` e produz os resultados NA MESMA ORDEM de entrada
+    (a saída TXT/XLSX/CSV fica idêntica à execução serial). Um PDF com várias
+    notas produz um resultado por nota, em sequência.
+
+    paths:     caminhos de PDF/XML/ZIP ou tuplas (nome, bytes) — ver iter_tasks().
+               ZIPs são lidos membro a membro conforme os workers liberam vaga
+               (no máximo 2 lotes por worker em memória).
+    workers:   nº de processos (None -> settings.BATCH_WORKERS ou nº de CPUs)
+    chunksize: arquivos enviados por vez a cada worker (None -> settings.BATCH_CHUNK_SIZE)
+    min_chars: abaixo disso o PDF é IMAGEM
+    reuse:     reuse(nome) -> resultados já conhecidos (manifesto/diário), que saem
+               no lugar do processamento, na mesma posição; None = processa
+    pool:      WorkerPool já aquecido (modo contínuo); ignora `workers` e não é
+               fechado no fim
+    """
+    if pool is not None:
+        workers = pool.workers
+    elif isinstance(paths, (list, tuple)) and not any(
+            is_archive(p[0] if isinstance(p, tuple) else p) for p in paths):
+        workers = min(resolve_workers(workers), max(1, len(paths)))
+    else:
+        workers = resolve_workers(workers)
+    chunksize = max(1, int(chunksize or BATCH_CHUNK_SIZE or 1))
+    tasks = iter_tasks(paths, reuse)
+
+    # serial só onde o prazo por documento funciona (SIGALRM na thread principal);
+    # numa thread (ex.: sessão do Streamlit) o trabalho vai para um processo
+    if pool is None and workers == 1 and (can_interrupt() or not _watchdog_timeout(1)):
+        for task in tasks:
+            yield from process_task(task, min_chars)
+        return
+
+    chunks = _chunked(tasks, chunksize)
+    while True:
+        pending = deque()   # [lote, future] na ordem de envio
+        try:
+            yield from _run_pool(chunks, pending, workers, min_chars, pool)
+            return
+        except BrokenProcessPool:
+            if pool is not None:
+                pool.discard()
+            # um worker morreu (ex.: crash nativo no pdfminer) ou travou (watchdog):
+            # os lotes em andamento são refeitos um arquivo por processo e o
+            # resto segue num pool novo
+            for chunk, _ in pending:
+                for task in chunk:
+                    yield from _process_isolated(task, min_chars)
+
+
+def _run_pool(chunks: Iterator[list], pending: deque, workers: int,
+              min_chars: int, pool: Optional[WorkerPool] = None) -> Iterator[dict]:
+    if pool is not None:
+        yield from _feed(pool.executor(), chunks, pending, workers, min_chars)
+        return
+    with _pool(workers) as ex:
+        yield from _feed(ex, chunks, pending, workers, min_chars)
+
+
+def _feed(ex: ProcessPoolExecutor, chunks: Iterator[list], pending: deque, workers: int,
+          min_chars: int) -> Iterator[dict]:
+    for chunk in chunks:
+        pending.append([chunk, None])
+        pending[-1][1] = ex.submit(_process_chunk, chunk, min_chars)
+        if len(pending) >= workers * 2:
+            yield from _next_result(ex, pending)
+    while pending:
+        yield from _next_result(ex, pending)
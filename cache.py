@@ -0,0 +1,237 @@
+# cache.py
+# Cache persistente em disco (SQLite) endereçado por conteúdo:
+#   - texto extraído por página, chave = SHA-256 dos bytes do PDF (+ backend)
+#   - texto das regiões (caixas) lidas para os templates de layout, mesma chave
+#   - registro parseado (NfseRecord.to_dict), chave = (SHA-256 do texto + regiões do
+#     layout, nome do parser, versão do parser, settings_fingerprint())
+# Os dados vão comprimidos (zlib). Despejo LRU quando passa de CACHE_MAX_MB.
+# O SQLite em modo WAL permite vários processos (workers do lote, sessões do
+# Streamlit) lendo e gravando ao mesmo tempo.
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from extractor import EXTRACTOR_BACKEND, open_document
+from record import NfseRecord, as_record
+from settings import CACHE_ENABLED, CACHE_DIR, CACHE_MAX_MB, DEFAULTS, FALLBACK_CLIENTE
+
+logger = logging.getLogger(__name__)
+
+_DB_NAME = "nfse_cache.sqlite3"
+_EVICT_EVERY = 32          # checa o tamanho total a cada N gravações (por processo)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    key   TEXT PRIMARY KEY,
+    data  BLOB NOT NULL,
+    size  INTEGER NOT NULL,
+    atime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    key   TEXT PRIMARY KEY,
+    data  BLOB NOT NULL,
+    size  INTEGER NOT NULL,
+    atime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS texts_atime ON texts(atime);
+CREATE INDEX IF NOT EXISTS records_atime ON records(atime);
+"""
+
+_TABLES = ("texts", "records")
+
+
+# ---------------- hashes ----------------
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def sha256_file(path, bufsize: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(bufsize), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def settings_fingerprint() -> str:
+    """
+    Resumo de settings.DEFAULTS + FALLBACK_CLIENTE, que os parsers copiam para o
+    registro: mudar cfps/acumulador/cliente padrão invalida os registros guardados.
+    """
+    payload = json.dumps([DEFAULTS, FALLBACK_CLIENTE], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def sha256_context(text) -> str:
+    """
+    sha256_text de um DocumentContext, incluindo as regiões do layout
+    (ctx.regions) quando houver: o mesmo texto com outras regiões (ou com o
+    template desligado) é outro registro.
+    """
+    regions = getattr(text, "regions", None)
+    if not regions:
+        return sha256_text(text)
+    payload = json.dumps(sorted(regions.items()), ensure_ascii=False)
+    return hashlib.sha256(f"{text or ''}\0{payload}".encode("utf-8")).hexdigest()
+
+
+# ---------------- armazenamento ----------------
+class Cache:
+    def __init__(self, directory=None, max_mb: Optional[float] = None):
+        self.directory = Path(directory or CACHE_DIR)
+        self.max_bytes = int((max_mb if max_mb is not None else CACHE_MAX_MB) * 1024 * 1024)
+        self._con = None
+        self._pid = None
+        self._puts = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # uma conexão por processo (conexões SQLite não atravessam fork)
+        if self._con is None or self._pid != os.getpid():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.directory / _DB_NAME), timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.executescript(_SCHEMA)
+            self._con, self._pid, self._puts = con, os.getpid(), 0
+        return self._con
+
+    def _get(self, table: str, key: str):
+        con = self._conn()
+        row = con.execute(f"SELECT data FROM {table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with con:
+            con.execute(f"UPDATE {table} SET atime = ? WHERE key = ?", (time.time(), key))
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def _put(self, table: str, key: str, value):
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), 6)
+        con = self._conn()
+        with con:
+            con.execute(
+                f"INSERT OR REPLACE INTO {table} (key, data, size, atime) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()),
+            )
+        self._puts += 1
+        if self._puts % _EVICT_EVERY == 1:
+            self.evict()
+
+    def evict(self):
+        """Apaga as entradas menos usadas até ficar abaixo de 90% do limite."""
+        con = self._conn()
+        total = sum(con.execute(f"SELECT COALESCE(SUM(size), 0) FROM {t}").fetchone()[0] for t in _TABLES)
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = con.execute(
+            "SELECT t, key, size FROM ("
+            " SELECT 'texts' AS t, key, size, atime FROM texts UNION ALL"
+            " SELECT 'records' AS t, key, size, atime FROM records"
+            ") ORDER BY atime"
+        ).fetchall()
+        with con:
+            for table, key, size in rows:
+                if total <= target:
+                    break
+                con.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+                total -= size
+
+    # --- texto extraído (lista de páginas; None = página não extraída) ---
+    def get_pages(self, pdf_sha: str, backend: str) -> Optional[List[Optional[str]]]:
+        return self._get("texts", f"{pdf_sha}:{backend}")
+
+    def put_pages(self, pdf_sha: str, backend: str, pages: List[Optional[str]]):
+        self._put("texts", f"{pdf_sha}:{backend}", pages)
+
+    # --- regiões (extractor.region_key -> texto) ---
+    def get_regions(self, pdf_sha: str, backend: str) -> Optional[Dict[str, str]]:
+        return self._get("texts", f"{pdf_sha}:{backend}:regions")
+
+    def put_regions(self, pdf_sha: str, backend: str, regions: Dict[str, str]):
+        self._put("texts", f"{pdf_sha}:{backend}:regions", regions)
+
+    # --- registros parseados ---
+    def get_record(self, text_sha: str, parser_name: str, parser_version: str) -> Optional[dict]:
+        return self._get("records", f"{text_sha}|{parser_name}|{parser_version}|{settings_fingerprint()}")
+
+    def put_record(self, text_sha: str, parser_name: str, parser_version: str, record: dict):
+        self._put("records", f"{text_sha}|{parser_name}|{parser_version}|{settings_fingerprint()}", record)
+
+
+_CACHE: Optional[Cache] = None
+
+def get_cache() -> Optional[Cache]:
+    """Cache padrão (settings.CACHE_DIR); None se CACHE_ENABLED = False."""
+    global _CACHE
+    if not CACHE_ENABLED:
+        return None
+    if _CACHE is None:
+        _CACHE = Cache()
+    return _CACHE
+
+
+# ---------------- atalhos usados pelo pipeline ----------------
+# Qualquer falha do cache (disco cheio, banco travado...) é só logada: o
+# processamento segue como se fosse um "miss".
+
+def open_cached_document(source, backend: Optional[str] = None):
+    """
+    Como extractor.open_document, mas reaproveita as páginas já extraídas em
+    execuções anteriores (chave = SHA-256 dos bytes do PDF). Num cache quente o
+    PDF nem chega a ser aberto.
+    """
+    backend = (backend or EXTRACTOR_BACKEND or "pdfplumber").lower()
+    cache = get_cache()
+    pdf_sha, pages, regions = None, None, None
+    if cache is not None:
+        try:
+            pdf_sha = sha256_bytes(source) if isinstance(source, (bytes, bytearray)) else sha256_file(source)
+            pages = cache.get_pages(pdf_sha, backend)
+            if pages is not None:
+                regions = cache.get_regions(pdf_sha, backend)
+        except Exception:
+            logger.exception("cache: falha ao ler texto")
+    doc = open_document(source, backend, pages, regions=regions)
+    doc.sha256 = pdf_sha
+    return doc
+
+def save_document(doc):
+    """Grava no cache as páginas e regiões novas extraídas nesta abertura (se houver)."""
+    cache = get_cache()
+    if cache is None or not getattr(doc, "sha256", None):
+        return
+    try:
+        if doc.pages_extracted:
+            cache.put_pages(doc.sha256, doc.backend, doc.snapshot())
+        if doc.regions_extracted:
+            cache.put_regions(doc.sha256, doc.backend, doc.region_snapshot())
+    except Exception:
+        logger.exception("cache: falha ao gravar texto")
+
+def cached_parse(parser_name: str, parser_version: str, parse_fn, text: str) -> NfseRecord:
+    """Roda parse_fn(text), reaproveitando o resultado de (texto + regiões, parser, versão) já vistos."""
+    cache = get_cache()
+    if cache is None:
+        return parse_fn(text)
+    text_sha = sha256_context(text)
+    try:
+        rec = cache.get_record(text_sha, parser_name, parser_version)
+        if rec is not None:
+            return as_record(rec)
+    except Exception:
+        logger.exception("cache: falha ao ler registro")
+    rec = parse_fn(text)
+    if isinstance(rec, NfseRecord):
+        try:
+            cache.put_record(text_sha, parser_name, parser_version, rec.to_dict())
+        except Exception:
+            logger.exception("cache: falha ao gravar registro")
+    return rec
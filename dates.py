@@ -0,0 +1,83 @@
+# dates.py
+# Normalização de datas -> dd/mm/aaaa. As notas trazem quase sempre os mesmos
+# formatos ("08/07/2025", "2025-07-08", "08-07-2025", "emitido em 08/07/2025
+# 21:43"): esses saem por regex pré-compiladas, sem o parse "fuzzy" do dateutil,
+# que fica só como último recurso. Os resultados ficam memorizados (as mesmas
+# datas se repetem em todo o lote).
+#
+#     normalize_date("emitido em 8/7/2025")        -> "08/07/2025"
+#     normalize_date("2025-07-08T10:00:00")        -> "08/07/2025"
+#     normalize_date("31/04/2025")                 -> "31/04/2025" (inválida: volta como veio)
+#     normalize_date("2025-07-08", fuzzy=False)    -> "08/07/2025" (só os formatos fixos)
+#     to_date("08/07/2025")                        -> datetime.date(2025, 7, 8)
+import re
+from datetime import date
+from functools import lru_cache
+from typing import Optional
+
+try:
+    from dateutil import parser as dtp
+except Exception:  # sem dateutil: só os formatos fixos
+    dtp = None
+
+# prefixos que aparecem colados na data ("emitido em", "Data da Emissão:")
+_PREFIX = r"(?:(?:emitid[ao]\s+em|data\s*(?:e\s*hora\s*)?(?:d[ae]\s*)?emiss[aã]o)\s*[:\-]?\s*)?"
+_TIME = r"(?:[\sT]+\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+\-]\d{2}:?\d{2})?)?"
+
+# formatos fixos (strict): os mesmos do writer (%d/%m/%Y, %Y-%m-%d, %d-%m-%Y)
+_RX_DMY = re.compile(r"(\d{1,2})([/\-])(\d{1,2})\2(\d{4})")
+_RX_YMD = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+# formatos do texto das notas (fuzzy): prefixo, "." como separador e hora
+_RX_DMY_TEXT = re.compile(_PREFIX + r"(\d{1,2})([/\-\.])(\d{1,2})\2(\d{4})" + _TIME, re.I)
+_RX_YMD_TEXT = re.compile(_PREFIX + r"(\d{4})-(\d{1,2})-(\d{1,2})" + _TIME, re.I)
+
+
+def _date(y: str, m: str, d: str) -> Optional[date]:
+    try:
+        return date(int(y), int(m), int(d))
+    except ValueError:
+        return None
+
+
+def _fast(s: str, dmy, ymd) -> Optional[date]:
+    m = dmy.fullmatch(s)
+    if m:
+        return _date(m.group(4), m.group(3), m.group(1))
+    m = ymd.fullmatch(s)
+    if m:
+        return _date(m.group(1), m.group(2), m.group(3))
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _parse(s: str, fuzzy: bool) -> Optional[date]:
+    if not fuzzy:
+        return _fast(s, _RX_DMY, _RX_YMD)
+    out = _fast(s, _RX_DMY_TEXT, _RX_YMD_TEXT)
+    if out is not None or dtp is None:
+        return out
+    # último recurso: dateutil (dia primeiro, ignorando o texto em volta)
+    try:
+        return dtp.parse(s, dayfirst=True, fuzzy=True).date()
+    except Exception:
+        return None
+
+
+def to_date(s: Optional[str], fuzzy: bool = True) -> Optional[date]:
+    """
+    Texto -> datetime.date (None se não entender).
+    fuzzy=False: só os formatos fixos, sem prefixo/hora e sem dateutil.
+    """
+    s = (s or "").strip()
+    return _parse(s, fuzzy) if s else None
+
+
+def format_date(d: date) -> str:
+    return f"{d.day:02d}/{d.month:02d}/{d.year:04d}"
+
+
+def normalize_date(s: Optional[str], fuzzy: bool = True) -> str:
+    """Data -> dd/mm/aaaa; devolve o texto (sem espaços nas pontas) se não entender."""
+    s = (s or "").strip()
+    d = _parse(s, fuzzy) if s else None
+    return format_date(d) if d is not None else s
@@ -0,0 +1,96 @@
+# deadlines.py
+# Orçamento de tempo/memória por documento. Dentro de `with budget(...)` um
+# timer (SIGALRM, a cada TICK_S) confere o relógio e o RSS do processo: passou
+# do prazo -> DocumentTimeout; passou da memória -> MemoryBudgetExceeded. O
+# sinal interrompe tanto o pdfminer (Python puro) quanto uma regex com
+# backtracking catastrófico (o re confere sinais durante o match).
+#
+#     with budget(DOC_TIMEOUT_S, "extração") as b:
+#         ...
+#     b.error     # a exceção disparada (mesmo que alguém a tenha engolido) ou None
+#
+# SIGALRM só existe no Unix e só na thread principal: fora disso budget() não
+# limita nada (can_interrupt() diz qual é o caso) e quem chama deve rodar o
+# trabalho num processo à parte (ver batch.run_batch). Código nativo que não
+# devolve o controle ao interpretador também escapa daqui: para isso o lote tem
+# o watchdog do processo pai, que mata o worker.
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from memstats import current_rss_mb, MemoryBudgetExceeded
+
+TICK_S = 0.25
+
+
+class DocumentTimeout(BaseException):
+    """
+    O documento passou do prazo. BaseException (como KeyboardInterrupt) para
+    não ser engolida pelos `except Exception` da extração e dos parsers.
+    """
+
+
+class Budget:
+    __slots__ = ("what", "deadline", "seconds", "max_rss_mb", "error")
+
+    def __init__(self, what: str, seconds: Optional[float], max_rss_mb: Optional[float]):
+        self.what = what
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.max_rss_mb = max_rss_mb
+        self.error: Optional[BaseException] = None
+
+    def check(self) -> None:
+        """Relança o estouro do orçamento, caso o código protegido o tenha engolido."""
+        if self.error is not None:
+            raise self.error
+
+
+_active: List[Budget] = []
+_previous_handler = None
+
+
+def can_interrupt() -> bool:
+    """True se budget() consegue interromper o trabalho nesta thread."""
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+def _on_tick(signum, frame) -> None:
+    now = time.monotonic()
+    rss = None
+    for b in _active:
+        if b.error is not None:
+            continue            # já disparou: deixa o cleanup (finally) rodar
+        if b.deadline is not None and now >= b.deadline:
+            b.error = DocumentTimeout(f"{b.what} passou de {b.seconds:g}s")
+            raise b.error
+        if b.max_rss_mb:
+            rss = current_rss_mb() if rss is None else rss
+            if rss is not None and rss > b.max_rss_mb:
+                b.error = MemoryBudgetExceeded(
+                    f"{b.what} passou de {b.max_rss_mb:.0f} MB (RSS {rss:.0f} MB)")
+                raise b.error
+
+
+@contextmanager
+def budget(seconds: Optional[float], what: str = "documento",
+           max_rss_mb: Optional[float] = None) -> Iterator[Budget]:
+    """Limita o bloco a `seconds` segundos e `max_rss_mb` de RSS (None = sem limite)."""
+    b = Budget(what, seconds, max_rss_mb)
+    if not (seconds or max_rss_mb) or not can_interrupt():
+        yield b
+        return
+    global _previous_handler
+    if not _active:
+        _previous_handler = signal.signal(signal.SIGALRM, _on_tick)
+        signal.setitimer(signal.ITIMER_REAL, TICK_S, TICK_S)
+    _active.append(b)
+    try:
+        yield b
+    finally:
+        _active.remove(b)
+        if not _active:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, _previous_handler or signal.SIG_DFL)
@@ -0,0 +1,70 @@
+# doc_context.py
+# Texto de um documento + as visões derivadas que o roteador e os parsers usam
+# (maiúsculas, sem acento, cabeçalho, linhas). Cada visão é calculada uma vez,
+# na primeira vez que alguém pede, e reaproveitada por can_parse e parse.
+import unicodedata
+from functools import cached_property
+from typing import Dict, List, Optional
+
+
+def norm_ascii_upper(s: str) -> str:
+    """Remove acentos (NFKD -> ASCII) e passa para maiúsculas."""
+    s = s or ""
+    s = unicodedata.normalize("NFKD", s).encode("ASCII", "ignore").decode("ASCII")
+    return s.upper()
+
+
+class DocumentContext(str):
+    """
+    É o próprio texto (subclasse de str: regex, fatiamento e o cache de
+    registros funcionam igual), com as visões derivadas memoizadas.
+    Fatias (ctx[:n]) voltam a ser str comum; use head()/head_norm().
+
+    regions: texto das caixas de PARSER["regions"] lidas do PDF pelo roteador
+    ({nome: texto}); None quando o layout não tem template ou não há PDF.
+    """
+
+    regions: Optional[Dict[str, str]] = None
+
+    def __new__(cls, text: str = ""):
+        return super().__new__(cls, text or "")
+
+    @cached_property
+    def upper_text(self) -> str:
+        return str.upper(self)
+
+    @cached_property
+    def norm_text(self) -> str:
+        return norm_ascii_upper(self)
+
+    @cached_property
+    def lines(self) -> List[str]:
+        return self.splitlines()
+
+    @cached_property
+    def _heads(self) -> Dict[int, str]:
+        return {}
+
+    @cached_property
+    def _heads_norm(self) -> Dict[int, str]:
+        return {}
+
+    def head(self, n: int) -> str:
+        """Primeiros n caracteres do texto original."""
+        h = self._heads.get(n)
+        if h is None:
+            h = self._heads[n] = str(self[:n])
+        return h
+
+    def head_norm(self, n: int) -> str:
+        """Primeiros n caracteres, normalizados (NFKD pode mudar o comprimento,
+        por isso é a normalização do cabeçalho e não um corte de norm_text)."""
+        h = self._heads_norm.get(n)
+        if h is None:
+            h = self._heads_norm[n] = norm_ascii_upper(self.head(n))
+        return h
+
+
+def as_context(text) -> DocumentContext:
+    """Devolve `text` se já for um DocumentContext; senão embrulha."""
+    return text if isinstance(text, DocumentContext) else DocumentContext(text)
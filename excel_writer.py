@@ -1,7 +1,23 @@
 # excel_writer.py
-from datetime import datetime
+# XLSX no layout Domínio. A planilha é gravada em streaming pelo xlsxwriter
+# (constant_memory: cada linha vai para o disco assim que é escrita), direto dos
+# registros, sem montar DataFrame: 50k+ notas não ficam inteiras na memória.
+# XlsxSink/CsvSink recebem as linhas uma a uma (ver sinks.FanOut, no main.run).
+import csv
+import os
+
 import pandas as pd
 from settings import BLANK_PARTY_FIELDS  # ← adiciona o flag
+from dates import normalize_date
+from record import NfseRecord, cents, dominio_row, fmt_money
+from sinks import Sink, blank_party
+
+try:
+    import xlsxwriter
+except Exception:  # sem xlsxwriter: pandas + openpyxl (monta tudo na memória)
+    xlsxwriter = None
+
+SHEET_NAME = "Notas"
 
 # Cabeçalho EXATO do Excel do Domínio (28 colunas)
 DOMINIO_COLUMNS = [
@@ -13,73 +29,104 @@ DOMINIO_COLUMNS = [
 ]
 
 def br_money(v):
-    s = str(v or "").strip()
-    if not s:
-        return "0,00"
-    s = s.replace(".", "").replace(",", ".")
-    try:
-        num = float(s)
-    except ValueError:
-        num = 0.0
-    inteiro, dec = f"{num:.2f}".split(".")
-    return f"{inteiro},{dec}"
+    # centavos (int) ou texto ("1.234,56") -> "1234,56"
+    return fmt_money(v if isinstance(v, int) else cents(str(v or "")))
 
 def br_date(s):
-    s = (s or "").strip()
-    for fmt in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y"):
-        try:
-            return datetime.strptime(s, fmt).strftime("%d/%m/%Y")
-        except ValueError:
-            pass
-    return s  # deixa como veio se não couber
-
-def record_to_row(n: dict) -> list:
+    # texto avulso -> dd/mm/aaaa (só formatos fixos); deixa como veio se não couber
+    return normalize_date(s, fuzzy=False)
+
+def record_to_row(n: NfseRecord) -> list:
+    # registro tipado (centavos/data): o texto do Domínio é gerado só aqui;
     # aplica o flag: se BLANK_PARTY_FIELDS for True, deixa campos em branco
-    razao_social = "" if BLANK_PARTY_FIELDS else n.get("razao_social","")
-    uf = "" if BLANK_PARTY_FIELDS else n.get("uf","")
-    municipio = "" if BLANK_PARTY_FIELDS else n.get("municipio","")
-    endereco = "" if BLANK_PARTY_FIELDS else n.get("endereco","")
-
-    # mapeia o dict padronizado -> ordem do Excel
-    return [
-        n.get("cnpj_cpf",""),
-        razao_social,
-        uf,
-        municipio,
-        endereco,
-        str(n.get("numero_documento","")).strip(),
-        str(n.get("serie","")).strip(),
-        br_date(n.get("data")),
-        str(n.get("situacao","0")).strip(),
-        str(n.get("acumulador","")).strip(),
-        str(n.get("cfps","")).strip(),
-        br_money(n.get("valor_servicos")),
-        br_money(n.get("valor_descontos")),
-        br_money(n.get("valor_deducao")),
-        br_money(n.get("valor_contabil")),
-        br_money(n.get("base_calculo")),
-        br_money(n.get("aliquota_iss")),
-        br_money(n.get("valor_iss_normal")),
-        br_money(n.get("valor_iss_retido")),
-        br_money(n.get("valor_irrf")),
-        br_money(n.get("valor_pis")),
-        br_money(n.get("valor_cofins")),
-        br_money(n.get("valor_csll")),
-        br_money(n.get("valor_crf")),
-        br_money(n.get("valor_inss")),
-        n.get("codigo_item","") or "",
-        (str(n.get("quantidade","")).replace(".", ",") if n.get("quantidade") not in (None,"") else ""),
-        (str(n.get("valor_unitario","")).replace(".", ",") if n.get("valor_unitario") not in (None,"") else ""),
-    ]
-
-def write_xlsx(registros: list, xlsx_path: str):
-    rows = [record_to_row(r) for r in registros]
-    df = pd.DataFrame(rows, columns=DOMINIO_COLUMNS)
-    # mantém tudo como texto (não perde zeros nem vírgulas)
-    with pd.ExcelWriter(xlsx_path, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Notas")
-
-def write_csv_semicolon(registros: list, csv_path: str):
-    rows = [record_to_row(r) for r in registros]
-    df = pd.DataFrame(rows, columns=DOMINIO_COLUMNS)
-    df.to_csv(csv_path, index=False, sep=";", encoding="utf-8-sig")
+    row = dominio_row(n)
+    return blank_party(row) if BLANK_PARTY_FIELDS else row
+
+class XlsxSink(Sink):
+    """
+    Aba "Notas" (cabeçalho DOMINIO_COLUMNS, tudo como texto: não perde zeros
+    nem vírgulas), linha a linha. `xlsx_path` é um caminho ou arquivo aberto
+    (BytesIO); o arquivo só fica completo no close().
+    """
+
+    blank_party = BLANK_PARTY_FIELDS
+
+    def __init__(self, xlsx_path):
+        self.count = 0
+        if xlsxwriter is None:
+            # sem xlsxwriter: pandas + openpyxl no close (monta tudo na memória)
+            self.path, self.rows = xlsx_path, []
+            return
+        self.wb = xlsxwriter.Workbook(xlsx_path, {"constant_memory": True})
+        self.ws = self.wb.add_worksheet(SHEET_NAME)
+        for col, name in enumerate(DOMINIO_COLUMNS):
+            self.ws.write_string(0, col, name)
+
+    def write_row(self, row: list) -> None:
+        self.count += 1
+        if xlsxwriter is None:
+            self.rows.append(row)
+            return
+        # write_string: nada de conversão para número, fórmula ("=...") ou link;
+        # coluna vazia fica sem célula (em branco, como no pandas.to_excel)
+        for col, value in enumerate(row):
+            if value:
+                self.ws.write_string(self.count, col, value)
+
+    def close(self) -> None:
+        # constant_memory: as linhas já foram para o arquivo temporário; aqui
+        # sai o .xlsx (não há flush parcial: o zip só existe no fim)
+        if xlsxwriter is None:
+            df = pd.DataFrame(self.rows, columns=DOMINIO_COLUMNS)
+            with pd.ExcelWriter(self.path, engine="openpyxl") as writer:
+                df.to_excel(writer, index=False, sheet_name=SHEET_NAME)
+            self.rows = []
+            return
+        self.wb.close()
+
+class CsvSink(Sink):
+    """
+    CSV ";" (utf-8 com BOM, como o pandas gravava), linha a linha. append:
+    acrescenta no CSV existente (cabeçalho e BOM só se ele estiver vazio).
+    """
+
+    blank_party = BLANK_PARTY_FIELDS
+
+    def __init__(self, csv_path, append: bool = False):
+        fresh = not append or not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        self.f = open(csv_path, "w" if fresh else "a", encoding="utf-8-sig", newline="")
+        self.w = csv.writer(self.f, delimiter=";", lineterminator=os.linesep)
+        if fresh:
+            self.w.writerow(DOMINIO_COLUMNS)
+
+    def write_row(self, row: list) -> None:
+        self.w.writerow(row)
+
+    def flush(self) -> None:
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+def write_xlsx(registros, xlsx_path) -> int:
+    """
+    Grava a aba "Notas" de uma vez. `registros` pode ser qualquer iterável (é
+    consumido uma vez); `xlsx_path` é um caminho ou arquivo aberto (BytesIO).
+    Devolve o nº de notas.
+    """
+    with XlsxSink(xlsx_path) as sink:
+        return sink.extend(registros)
+
+def write_csv_semicolon(registros, csv_path: str) -> int:
+    with CsvSink(csv_path) as sink:
+        return sink.extend(registros)
+
+def csv_to_xlsx(csv_path, xlsx_path) -> int:
+    """XLSX a partir do CSV ";" (já no layout): linha a linha, sem reparsear nada."""
+    with open(csv_path, encoding="utf-8-sig", newline="") as f, XlsxSink(xlsx_path) as sink:
+        rows = csv.reader(f, delimiter=";")
+        next(rows, None)   # cabeçalho
+        n = 0
+        for n, row in enumerate(rows, 1):
+            sink.write_row(row)
+    return n
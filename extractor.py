@@ -1,33 +1,486 @@
-import pdfplumber
+import re
+import time
+from io import BytesIO
 from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import pdfplumber
+from pdfplumber.utils import extract_text as chars_to_text
+
+from memstats import current_rss_mb, MemoryBudgetExceeded
+
+# PyMuPDF (opcional): bem mais rápido que o pdfminer em PDFs com camada de texto
+try:
+    import pymupdf as fitz  # nome novo (PyMuPDF >= 1.24.3)
+except Exception:
+    try:
+        import fitz
+    except Exception:
+        fitz = None
+
+from settings import (EXTRACTOR_BACKEND, EXTRACT_LOW_MEMORY, EXTRACT_MAX_RSS_MB,
+                      FAST_SCAN_DETECTION, SCAN_MIN_IMAGE_COVERAGE)
 
 # Caminho do PDF de teste
 PDF_FILE = Path(r"C:\Pedro\Python\Read_NFSe_txt\PDF\cwb_pdfs\NFSe_Curitiba.pdf")
 
-def extract_text(pdf_path: str) -> str:
-    texts = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for p in pdf.pages:
-            t = p.extract_text() or ""
-            texts.append(t)
-    return "\n".join(texts).strip()
+# abaixo disso (caracteres de texto) o PDF é tratado como imagem/scan
+MIN_TEXT_CHARS = 40
+
+
+class ExtractionResult(NamedTuple):
+    """
+    Resultado único da extração de um PDF (feita uma só vez por arquivo).
+    O mesmo objeto alimenta a checagem de IMAGEM, o roteador e o parser.
+    """
+    text: str               # texto de todas as páginas, já com strip()
+    page_chars: List[int]   # nº de caracteres extraídos por página
+    n_pages: int
+    is_image: bool          # True se o texto total ficou abaixo de min_chars
+    elapsed: float          # segundos gastos na extração
+    backend: str = "pdfplumber"
+    peak_rss_mb: Optional[float] = None  # maior RSS do processo medido durante a extração
+
+
+# ---------------- backends de extração ----------------
+# Cada backend abre o PDF (caminho ou bytes) e entrega o texto página a página.
+# Interface: len(doc), doc.page_text(i), doc.region_texts(i, caixas),
+#            doc.probe_page(i), doc.release(i), doc.close()
+#
+# release(i) libera os caches de layout da página i (modo de memória limitada).
+#
+# region_texts(i, caixas) lê só o texto de cada caixa (x0, top, x1, bottom), em
+# pontos, com a origem no canto superior esquerdo da página (coordenadas do
+# pdfplumber e do MuPDF). Entram só os caracteres/palavras inteiramente dentro
+# da caixa, então rótulos vizinhos que encostam na borda ficam de fora.
+#
+# probe_page(i) é a inspeção barata (sem análise de layout) usada para detectar
+# scan: {"fonts": nº de fontes, "text_ops": há operadores de texto,
+#        "images": nº de imagens, "image_coverage": fração da página coberta}
+# ou None quando não dá para concluir nada.
+
+# "a b c d e f cm /Im0 Do" no content stream: matriz de posicionamento da imagem
+_RX_IMAGE_DO = re.compile(
+    rb"(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+-?[\d.]+\s+-?[\d.]+\s+cm\s*/([^\s/\[\]()<>]+)\s*Do"
+)
+_RX_TEXT_OP = re.compile(rb"\bBT\b")
+
+Box = Tuple[float, float, float, float]  # (x0, top, x1, bottom)
+
+
+def _inside(x0: float, top: float, x1: float, bottom: float, box: Box) -> bool:
+    return x0 >= box[0] and top >= box[1] and x1 <= box[2] and bottom <= box[3]
+
+
+class PdfplumberBackend:
+    name = "pdfplumber"
+
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray)):
+            source = BytesIO(source)
+        self._pdf = pdfplumber.open(source)
+
+    def __len__(self) -> int:
+        return len(self._pdf.pages)
+
+    def page_text(self, i: int) -> str:
+        return self._pdf.pages[i].extract_text() or ""
+
+    def region_texts(self, i: int, boxes: Sequence[Box]) -> List[str]:
+        # os caracteres da página são lidos uma vez (e já estão carregados se o
+        # texto dela acabou de sair); cada caixa monta o texto só dos seus
+        chars = self._pdf.pages[i].chars
+        return [
+            chars_to_text([c for c in chars if _inside(c["x0"], c["top"], c["x1"], c["bottom"], b)]) or ""
+            for b in boxes
+        ]
+
+    def release(self, i: int):
+        # o pdfplumber guarda chars/objetos/layout da página até o PDF fechar
+        page = self._pdf.pages[i]
+        getattr(page, "close", page.flush_cache)()
+
+    def probe_page(self, i: int):
+        # lê só o dicionário de recursos e o content stream cru (sem pdfminer layout)
+        from pdfminer.pdftypes import resolve1
+        page = self._pdf.pages[i]
+        res = resolve1(page.page_obj.resources) or {}
+        fonts = resolve1(res.get("Font")) or {}
+        images = set()
+        for name, ref in (resolve1(res.get("XObject")) or {}).items():
+            sub = resolve1(ref).attrs.get("Subtype")
+            if getattr(sub, "name", sub) == "Image":
+                images.add(name.encode("latin-1"))
+            else:
+                return None  # Form XObject pode esconder texto: sem veredito barato
+        data = b"".join(resolve1(c).get_data() for c in (page.page_obj.contents or []))
+        covered = 0.0
+        for a, b, c, d, name in _RX_IMAGE_DO.findall(data):
+            if name in images:
+                covered += abs(float(a) * float(d) - float(b) * float(c))
+        area = float(page.width * page.height) or 1.0
+        return {
+            "fonts": len(fonts),
+            "text_ops": bool(_RX_TEXT_OP.search(data)),
+            "images": len(images),
+            "image_coverage": min(1.0, covered / area),
+        }
+
+    def close(self):
+        self._pdf.close()
+
+
+# ligaduras/espaços que o MuPDF devolve literalmente e o pdfminer não
+_FITZ_REPLACE = {
+    "\ufb00": "ff", "\ufb01": "fi", "\ufb02": "fl", "\ufb03": "ffi", "\ufb04": "ffl",
+    "\u00a0": " ", "\u2002": " ", "\u2003": " ", "\u2009": " ", "\u202f": " ",
+    "\u00ad": "",
+}
+_FITZ_TABLE = str.maketrans(_FITZ_REPLACE)
+
+
+class FitzBackend:
+    """
+    Backend PyMuPDF. Remonta as linhas como o pdfplumber faz (palavras agrupadas
+    pelo topo com tolerância de 3pt, ordenadas por x e separadas por um espaço),
+    para que as regex dos parsers continuem casando.
+    """
+    name = "fitz"
+    y_tolerance = 3
+
+    def __init__(self, source):
+        if fitz is None:
+            raise RuntimeError("PyMuPDF (fitz) não está instalado; use o backend 'pdfplumber'")
+        if isinstance(source, (bytes, bytearray)):
+            self._doc = fitz.open(stream=bytes(source), filetype="pdf")
+        else:
+            self._doc = fitz.open(str(source))
+
+    def __len__(self) -> int:
+        return self._doc.page_count
+
+    def _join_words(self, words) -> str:
+        # (x0, y0, x1, y1, palavra, bloco, linha, nº)
+        words = sorted(words, key=lambda w: w[1])
+        lines, cur, last_top = [], [], None
+        for w in words:
+            if last_top is not None and w[1] - last_top > self.y_tolerance:
+                lines.append(cur)
+                cur = []
+            cur.append(w)
+            last_top = w[1]
+        if cur:
+            lines.append(cur)
+        out = []
+        for ln in lines:
+            ln.sort(key=lambda w: w[0])
+            out.append(" ".join(w[4] for w in ln))
+        return "\n".join(out).translate(_FITZ_TABLE)
+
+    def page_text(self, i: int) -> str:
+        return self._join_words(self._doc[i].get_text("words"))
+
+    def region_texts(self, i: int, boxes: Sequence[Box]) -> List[str]:
+        # o clip faz o MuPDF ler só o retângulo, mas devolve também palavras que
+        # só encostam nele: filtra pelas que cabem inteiras
+        page = self._doc[i]
+        out = []
+        for b in boxes:
+            words = page.get_text("words", clip=fitz.Rect(b))
+            out.append(self._join_words([w for w in words if _inside(w[0], w[1], w[2], w[3], b)]))
+        return out
+
+    def release(self, i: int):
+        # esvazia o cache interno do MuPDF (fontes/imagens decodificadas)
+        fitz.TOOLS.store_shrink(100)
+
+    def probe_page(self, i: int):
+        page = self._doc[i]
+        rect = page.rect
+        covered = sum(abs(fitz.Rect(im["bbox"]) & rect) for im in page.get_image_info())
+        return {
+            "fonts": len(page.get_fonts()),
+            "text_ops": bool(page.get_text("text").strip()),
+            "images": len(page.get_images()),
+            "image_coverage": min(1.0, covered / (abs(rect) or 1.0)),
+        }
+
+    def close(self):
+        self._doc.close()
+
+
+BACKENDS = {
+    PdfplumberBackend.name: PdfplumberBackend,
+    FitzBackend.name: FitzBackend,
+}
+
+
+def scan_verdict(info) -> Optional[bool]:
+    """
+    True  -> página é imagem (sem fontes/texto e coberta por imagem): scan
+    False -> página tem camada de texto
+    None  -> inconclusivo (decide-se pelo texto extraído)
+    """
+    if not info:
+        return None
+    if info["fonts"] == 0 and not info["text_ops"]:
+        if info["images"] and info["image_coverage"] >= SCAN_MIN_IMAGE_COVERAGE:
+            return True
+        return None
+    if info["fonts"] and info["text_ops"]:
+        return False
+    return None
+
+
+def open_backend(source, backend: Optional[str] = None):
+    """Abre `source` (caminho ou bytes) com o backend pedido (ou settings.EXTRACTOR_BACKEND)."""
+    name = (backend or EXTRACTOR_BACKEND or "pdfplumber").lower()
+    try:
+        cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"backend de extração desconhecido: {name!r} (opções: {', '.join(BACKENDS)})")
+    return cls(source)
+
+
+# ---------------- extração preguiçosa (página a página) ----------------
+class LazyDocument:
+    """
+    Texto do PDF sob demanda: cada página só é extraída (e paga) quando alguém
+    pede por ela. Páginas já lidas ficam memorizadas.
+
+        with LazyDocument(path) as doc:
+            doc.head(1500)          # só as páginas necessárias para 1500 caracteres
+            doc.next_page()         # próxima página ainda não consumida
+            doc.text(max_pages=1)   # texto das N primeiras páginas
+            doc.text()              # documento inteiro (igual ao extract())
+            doc.regions(0, {"numero": (460, 30, 580, 48)})  # só o texto da caixa
+    """
+
+    def __init__(self, source, backend: Optional[str] = None,
+                 pages: Optional[List[Optional[str]]] = None,
+                 low_memory: Optional[bool] = None, max_rss_mb: Optional[float] = None,
+                 regions: Optional[Dict[str, str]] = None):
+        """
+        pages:      textos já conhecidos (ex.: vindos do cache), um por página; None
+                    marca página ainda não extraída. Se vier completo o PDF nem é aberto.
+        regions:    textos de regiões já conhecidos (ex.: do cache), ver region_key()
+        low_memory: libera o layout de cada página logo após extrair o texto
+                    (padrão settings.EXTRACT_LOW_MEMORY)
+        max_rss_mb: se o RSS do processo passar disso durante a extração,
+                    levanta MemoryBudgetExceeded (padrão settings.EXTRACT_MAX_RSS_MB)
+        """
+        self.low_memory = EXTRACT_LOW_MEMORY if low_memory is None else low_memory
+        self.max_rss_mb = EXTRACT_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+        self.peak_rss_mb = current_rss_mb()
+        self._source = source
+        self.backend = (backend or EXTRACTOR_BACKEND or "pdfplumber").lower()
+        self._doc = None
+        self.elapsed = 0.0
+        if pages is None:
+            self._open()
+            pages = [None] * len(self._doc)
+        self._pages: List[Optional[str]] = list(pages)
+        self.n_pages = len(self._pages)
+        self.pages_extracted = 0   # páginas extraídas nesta abertura (fora do cache)
+        self._cursor = 0
+        self.scan_probe = None     # resultado de probe_page(0), se foi feito
+        self._regions: Dict[str, str] = dict(regions or {})
+        self.regions_extracted = 0  # regiões lidas do PDF nesta abertura
+        self._held: Optional[int] = None  # página com layout ainda carregado (low_memory)
+
+    def _open(self):
+        if self._doc is None:
+            t0 = time.perf_counter()
+            self._doc = open_backend(self._source, self.backend)
+            self.elapsed += time.perf_counter() - t0
+        return self._doc
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._held = None
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+    @property
+    def pages_read(self) -> int:
+        return sum(1 for p in self._pages if p is not None)
+
+    def snapshot(self) -> List[Optional[str]]:
+        """Páginas conhecidas até agora (None = não extraída), para guardar em cache."""
+        return list(self._pages)
+
+    def page(self, i: int) -> str:
+        t = self._pages[i]
+        if t is None:
+            doc = self._open()
+            t0 = time.perf_counter()
+            t = doc.page_text(i)
+            if self.low_memory:
+                # o layout fica carregado até a próxima página ser extraída: quem
+                # lê regiões logo depois (regions()) não reprocessa a página
+                self._release_held()
+                self._held = i
+            self.elapsed += time.perf_counter() - t0
+            self._pages[i] = t
+            self.pages_extracted += 1
+            self._check_memory()
+        return t
+
+    def _release_held(self):
+        if self._held is not None and self._doc is not None:
+            self._doc.release(self._held)
+        self._held = None
+
+    def regions(self, page: int, boxes: Dict[str, Box]) -> Dict[str, str]:
+        """
+        Texto de cada caixa {nome: (x0, top, x1, bottom)} da página `page`, sem
+        montar o texto da página inteira (ver region_texts dos backends). Cada
+        caixa é lida uma vez e memorizada; regiões fora do documento, ou sem PDF
+        por trás (texto de OCR), voltam vazias.
+        """
+        keys = {name: region_key(page, box) for name, box in boxes.items()}
+        todo = {k: boxes[name] for name, k in keys.items() if k not in self._regions}
+        if todo and self._source is not None and 0 <= page < self.n_pages:
+            doc = self._open()
+            t0 = time.perf_counter()
+            texts = doc.region_texts(page, list(todo.values()))
+            if self.low_memory and self._held != page:
+                doc.release(page)
+            self.elapsed += time.perf_counter() - t0
+            self._regions.update(zip(todo, texts))
+            self.regions_extracted += len(todo)
+            self._check_memory()
+        return {name: self._regions.get(k, "") for name, k in keys.items()}
+
+    def region_snapshot(self) -> Dict[str, str]:
+        """Regiões lidas até agora (chave = region_key), para guardar em cache."""
+        return dict(self._regions)
+
+    def _check_memory(self):
+        rss = current_rss_mb()
+        if rss is None:
+            return
+        if self.peak_rss_mb is None or rss > self.peak_rss_mb:
+            self.peak_rss_mb = rss
+        if self.max_rss_mb and rss > self.max_rss_mb:
+            self.close()
+            raise MemoryBudgetExceeded(
+                f"extração passou de {self.max_rss_mb:.0f} MB (RSS {rss:.0f} MB)"
+            )
+
+    def next_page(self) -> Optional[str]:
+        if self._cursor >= self.n_pages:
+            return None
+        t = self.page(self._cursor)
+        self._cursor += 1
+        return t
+
+    def iter_pages(self):
+        for i in range(self.n_pages):
+            yield self.page(i)
+
+    def text(self, max_pages: Optional[int] = None) -> str:
+        n = self.n_pages if max_pages is None else min(max_pages, self.n_pages)
+        return "\n".join(self.page(i) for i in range(n)).strip()
+
+    def head(self, n_chars: int) -> str:
+        """
+        Os primeiros `n_chars` do texto (mesmo que doc.text()[:n_chars]),
+        extraindo só as páginas necessárias para chegar lá.
+        """
+        parts = []
+        for i in range(self.n_pages):
+            parts.append(self.page(i))
+            joined = "\n".join(parts).lstrip()
+            if len(joined.rstrip()) >= n_chars:
+                return joined[:n_chars]
+        return self.text()[:n_chars]
+
+    def looks_scanned(self) -> Optional[bool]:
+        """
+        Pré-classificação barata pela 1ª página (fontes, operadores de texto e
+        cobertura de imagem), sem análise de layout. Ver scan_verdict().
+        """
+        if not FAST_SCAN_DETECTION or not self.n_pages or self._pages[0] is not None:
+            return None  # texto da 1ª página já conhecido (cache): decide pelo texto
+        try:
+            self.scan_probe = self._open().probe_page(0)
+        except Exception:
+            return None
+        return scan_verdict(self.scan_probe)
+
+    def is_image(self, min_chars: int = MIN_TEXT_CHARS) -> bool:
+        # scan evidente na 1ª página: responde em milissegundos, sem extrair nada
+        if self.looks_scanned():
+            return True
+        # senão lê páginas só até juntar min_chars de texto
+        return len(self.head(min_chars)) < min_chars
+
+    def result(self, min_chars: int = MIN_TEXT_CHARS) -> ExtractionResult:
+        """Extrai o que faltar e devolve o resultado completo."""
+        texts = list(self.iter_pages())
+        text = "\n".join(texts).strip()
+        return ExtractionResult(
+            text=text,
+            page_chars=[len(t) for t in texts],
+            n_pages=self.n_pages,
+            is_image=len(text) < min_chars,
+            elapsed=self.elapsed,
+            backend=self.backend,
+            peak_rss_mb=self.peak_rss_mb,
+        )
+
+
+def region_key(page: int, box: Box) -> str:
+    """Chave estável de uma região: "página:x0,top,x1,bottom"."""
+    return f"{page}:" + ",".join(f"{v:g}" for v in box)
+
+
+def open_document(source, backend: Optional[str] = None,
+                  pages: Optional[List[Optional[str]]] = None, **kwargs) -> LazyDocument:
+    """Abre um PDF (caminho ou bytes) para leitura página a página."""
+    if isinstance(source, Path):
+        source = str(source)
+    return LazyDocument(source, backend, pages, **kwargs)
+
+
+# ---------------- extração completa ----------------
+def _extract(source, min_chars: int, backend: Optional[str]) -> ExtractionResult:
+    with LazyDocument(source, backend) as doc:
+        return doc.result(min_chars)
+
+
+def extract(pdf_path: str, min_chars: int = MIN_TEXT_CHARS,
+            backend: Optional[str] = None) -> ExtractionResult:
+    return _extract(str(pdf_path), min_chars, backend)
+
+
+def extract_bytes(file_bytes: bytes, min_chars: int = MIN_TEXT_CHARS,
+                  backend: Optional[str] = None) -> ExtractionResult:
+    return _extract(file_bytes, min_chars, backend)
+
+
+# --- atalhos antigos (só o texto) ---
+def extract_text(pdf_path: str, backend: Optional[str] = None) -> str:
+    return extract(pdf_path, backend=backend).text
+
+
+def extract_text_bytes(file_bytes: bytes, backend: Optional[str] = None) -> str:
+    return extract_bytes(file_bytes, backend=backend).text
+
 
 if __name__ == "__main__":
-    text = extract_text(PDF_FILE)
-    print(text)   # Mostra tudo no console
-    
+    res = extract(PDF_FILE)
+    print(res.text)   # Mostra tudo no console
+    print(f"-- {res.n_pages} página(s), {sum(res.page_chars)} caracteres, "
+          f"{res.elapsed:.2f}s [{res.backend}], pico RSS {res.peak_rss_mb or 0:.0f} MB")
+
     # opcional: salvar em arquivo para analisar melhor
     with open("saida_bruta.txt", "w", encoding="utf-8") as f:
-        f.write(text)
-
-# extractor.py (adicionar)
-from io import BytesIO
-import pdfplumber
-
-def extract_text_bytes(file_bytes: bytes) -> str:
-    texts = []
-    with pdfplumber.open(BytesIO(file_bytes)) as pdf:
-        for p in pdf.pages:
-            t = p.extract_text() or ""
-            texts.append(t)
-    return "\n".join(texts).strip()
+        f.write(res.text)
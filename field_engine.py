@@ -0,0 +1,409 @@
+# field_engine.py
+# Motor de extração de campos declarativo. Cada layout descreve os campos como
+# dados (rótulo, regex do valor, janela, fallbacks) num FieldSet, compilado uma
+# vez no import. Na extração cada rótulo/regex distinto do FieldSet é procurado
+# no máximo uma vez (campos que usam o mesmo rótulo dividem a busca, fallbacks
+# só são procurados se forem necessários); depois cada campo só olha a janela dele.
+#
+#     FIELDS = FieldSet({
+#         "numero": Match(r"Nota\s*N[ºo]\s*([0-9]+)"),
+#         "data":   Match(r"emitido\s+em\s+([0-9/]{10})", conv=date_any),
+#         "iss":    After(r"\bISS\b", 250, value=RX_MONEY_RS),
+#         "serv":   First(After(LABEL, 350), After(LABEL, 350, tail=1200)),
+#     })
+#     valores = FIELDS.extract(texto)   # {"numero": "...", ...}
+#
+# Índice de rótulos: no compile, cada padrão ganha as palavras-chave literais
+# com que todo match dele começa ("ISS" para \b(ISS|ISSQN)\b, "DEDUC"/"DEDUÇ"...).
+# No documento, as posições de cada palavra-chave são achadas uma vez (str.find
+# no texto em maiúsculas, memoizado no DocumentContext) e o padrão só é testado
+# com .match() nessas posições, em vez de varrer o texto inteiro com a regex.
+#
+# Os resultados são os mesmos de re.search(rx, texto) campo a campo.
+# (Uma alternação única com todos os rótulos foi medida e ficou mais lenta que
+# as buscas separadas já compiladas: o re do Python não tem Aho-Corasick e cada
+# busca isolada aproveita o prefixo literal do padrão. Um índice dos tokens de
+# valor, com busca binária depois do rótulo, também foi medido e perdeu para a
+# busca direta na janela, que é curta.)
+import heapq
+import re
+from typing import Callable, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+try:  # Python 3.11+
+    from re import _parser as sre_parse
+except ImportError:  # pragma: no cover
+    import sre_parse
+
+from dates import normalize_date
+from record import cents
+from doc_context import as_context
+
+# valores mais comuns depois de um rótulo
+RX_NUMBER = r"(?:R\$)?\s*([\d\.\,]+)"   # "R$ 1.234,56", "1.234,56", "150"
+RX_MONEY_RS = r"R\$\s*([\d\.\,]+)"      # só com "R$"
+RX_PERCENT = r"\(([\d\.\,]+)\s*%\)"     # "(2,00 %)"
+
+
+# ---------------- conversões de valor ----------------
+def date_any(s: str) -> str:
+    """Qualquer data legível -> dd/mm/aaaa (devolve o texto se não entender)."""
+    return normalize_date(s)
+
+
+def first_line(s: str) -> str:
+    s = (s or "").strip()
+    return s.splitlines()[0].strip() if s else ""
+
+
+# ---------------- tipos de campo ----------------
+# locate(texto, found) -> (valor, (início, fim) | None, conversão | None): como
+# get(), dizendo também de que trecho do texto o valor saiu e como o trecho vira
+# o valor (usado pelo template_learner). None no trecho = valor default.
+Span = Optional[Tuple[int, int]]
+
+
+class Field:
+    """Base: um campo com um padrão localizador (rx) cuja 1ª ocorrência decide o valor."""
+
+    default = ""
+
+    def __init__(self, rx: str, flags: int = re.I, head: Optional[int] = None,
+                 tail: Optional[int] = None):
+        self.rx = re.compile(rx, flags)
+        # head/tail: procura só nos primeiros/últimos N caracteres (busca própria, no trecho)
+        self.head = head
+        self.tail = tail
+        self._k: Optional[int] = None
+
+    def _bind(self, register: Callable[["re.Pattern"], int]) -> None:
+        if self.head is None and self.tail is None:
+            self._k = register(self.rx)
+
+    def _search(self, text: str, found: "_Hits") -> Tuple[str, Optional["re.Match"], int]:
+        """(trecho procurado, match, deslocamento do trecho no texto)."""
+        if self._k is not None:
+            return text, found[self._k], 0
+        base = 0
+        if self.head is not None:
+            text = text[:self.head]
+        if self.tail is not None:
+            base = max(0, len(text) - self.tail)
+            text = text[-self.tail:]
+        return text, self.rx.search(text), base
+
+    def get(self, text: str, found: "_Hits") -> object:
+        text, m, _ = self._search(text, found)
+        return self.resolve(text, m)
+
+    def resolve(self, text: str, m: Optional["re.Match"]) -> object:
+        raise NotImplementedError
+
+    def convert(self, raw: str) -> object:
+        """Trecho do texto -> valor do campo (o mesmo tratamento do resolve())."""
+        raise NotImplementedError
+
+
+class Match(Field):
+    """Grupo `group` da 1ª ocorrência de `rx` (como o antigo _m()), convertido por `conv`."""
+
+    def __init__(self, rx: str, flags: int = re.I, group: int = 1,
+                 conv: Optional[Callable[[str], str]] = None, strip: bool = True,
+                 default: str = "", **kw):
+        super().__init__(rx, flags, **kw)
+        self.group = group
+        self.conv = conv
+        self.strip = strip
+        self.default = default
+
+    def resolve(self, text, m):
+        if not m:
+            return self.default
+        return self.convert(m.group(self.group) or "")
+
+    def convert(self, raw):
+        v = raw.strip() if self.strip else raw
+        if not v:
+            return self.default
+        return self.conv(v) if self.conv else v
+
+    def locate(self, text, found):
+        sub, m, base = self._search(text, found)
+        if not m or m.start(self.group) < 0:
+            return self.resolve(sub, m), None, None
+        a, b = m.span(self.group)
+        return self.convert(m.group(self.group)), (base + a, base + b), self.convert
+
+
+class After(Field):
+    """
+    Rótulo -> 1º `value` nos `window` caracteres depois da 1ª ocorrência do
+    rótulo (como o antigo _find_money_after()).
+    """
+
+    def __init__(self, label: str, window: int, value: str = RX_NUMBER,
+                 flags: int = re.I, value_flags: int = 0,
+                 conv: Callable[[str], object] = cents, default: object = 0, **kw):
+        super().__init__(label, flags, **kw)
+        self.window = window
+        self.value = re.compile(value, value_flags)
+        self.conv = conv
+        self.default = default
+
+    def _value(self, text, m) -> Optional["re.Match"]:
+        end = m.end()
+        return self.value.search(text[end: end + self.window])
+
+    def resolve(self, text, m):
+        v = self._value(text, m) if m else None
+        return self.conv(v.group(1)) if v else self.default
+
+    def convert(self, raw):
+        return self.conv(raw)
+
+    def locate(self, text, found):
+        sub, m, base = self._search(text, found)
+        v = self._value(sub, m) if m else None
+        if not v:
+            return self.default, None, None
+        off = base + m.end()
+        return self.conv(v.group(1)), (off + v.start(1), off + v.end(1)), self.convert
+
+
+class Row:
+    """
+    Tabela em duas linhas: a 1ª linha que casa `header` e a regex `row` na
+    linha seguinte. Valor = tupla de grupos de `row` (None se não casar).
+    """
+
+    default = None
+
+    def __init__(self, header: str, row: str, flags: int = re.I):
+        self.header = re.compile(header, flags)
+        self.row = re.compile(row, flags)
+
+    def _bind(self, register) -> None:
+        pass
+
+    def get(self, text, found):
+        lines = as_context(text).lines
+        for i, ln in enumerate(lines):
+            if self.header.search(ln):
+                if i + 1 < len(lines):
+                    m = self.row.search(lines[i + 1])
+                    return m.groups() if m else None
+                return None
+        return None
+
+    def locate(self, text, found):
+        # tupla de vários trechos: não tem um trecho só para apontar
+        return self.get(text, found), None, None
+
+
+class First:
+    """Primeira alternativa com valor (diferente do default dela); `conv` no resultado."""
+
+    def __init__(self, *alts, conv: Optional[Callable[[str], str]] = None):
+        self.alts = alts
+        self.conv = conv
+        self.default = alts[-1].default
+
+    def _bind(self, register) -> None:
+        for a in self.alts:
+            a._bind(register)
+
+    def get(self, text, found):
+        v = self.default
+        for a in self.alts:
+            v = a.get(text, found)
+            if v and v != a.default:
+                break
+        return self.conv(v) if self.conv else v
+
+    def locate(self, text, found):
+        v, span, conv = self.default, None, None
+        for a in self.alts:
+            v, span, conv = a.locate(text, found)
+            if v and v != a.default:
+                break
+        if self.conv is None:
+            return v, span, conv
+        post = self.conv
+        return post(v), span, (lambda raw: post(conv(raw))) if conv else None
+
+
+# ---------------- índice de rótulos ----------------
+_MAX_KEYWORDS = 16   # mais variações que isso: para de estender o prefixo
+_MAX_KEYWORD_LEN = 8  # já é seletivo o bastante
+_MAX_CLASS = 4       # [cç], [ÉE]...; classes maiores encerram o prefixo
+_MAX_TRIES = 8       # posições testadas com .match() antes de voltar ao .search()
+
+# caracteres que o re.I casa com letras ASCII mas que str.upper() não leva à
+# mesma letra (ı, İ, ſ, sinal Kelvin, Angström): com eles no texto, busca normal
+_FOLD_TRAPS = "\u0130\u0131\u017f\u212a\u212b"
+
+
+def _expand(items, states):
+    """Estende os prefixos abertos `states` [(texto, aberto)] com a sequência `items`."""
+    for op, av in items:
+        if not any(o for _, o in states):
+            break
+        if op is sre_parse.LITERAL:
+            alts = [(chr(av), True)]
+        elif op is sre_parse.IN and len(av) <= _MAX_CLASS and all(o is sre_parse.LITERAL for o, _ in av):
+            alts = [(chr(c), True) for _, c in av]
+        elif op is sre_parse.AT:
+            alts = [("", True)]  # \b etc.: largura zero, o .match() confere
+        elif op is sre_parse.SUBPATTERN:
+            alts = _expand(av[-1], [("", True)])
+        elif op is sre_parse.BRANCH:
+            alts = [st for branch in av[1] for st in _expand(branch, [("", True)])]
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            # pelo menos uma repetição: o prefixo dela vale, mas fecha ali
+            alts = [(t, o and av[0] == av[1] == 1) for t, o in _expand(av[2], [("", True)])]
+        else:
+            alts = [("", False)]
+        nxt = []
+        for t, o in states:
+            if not o:
+                nxt.append((t, o))
+            elif len(t) >= _MAX_KEYWORD_LEN:
+                nxt.append((t, False))
+            else:
+                nxt.extend((t + a, ao) for a, ao in alts)
+        if len(nxt) > _MAX_KEYWORDS:
+            return [(t, False) for t, _ in states]
+        states = nxt
+    return states
+
+
+def label_keywords(rx: "re.Pattern") -> Optional[FrozenSet[str]]:
+    """
+    Palavras-chave (maiúsculas) com que todo match de `rx` começa, ou None se
+    não der para garantir (padrão começa com classe larga, \s, repetição opcional...).
+    """
+    try:
+        states = _expand(sre_parse.parse(rx.pattern, rx.flags), [("", True)])
+    except Exception:
+        return None
+    kws = set()
+    for t, _ in states:
+        k = t.upper()
+        if len(k) < 2 or len(k) != len(t):
+            return None
+        kws.add(k)
+    # "ISS" já cobre as posições de "ISSQN"
+    return frozenset(k for k in kws if not any(o != k and k.startswith(o) for o in kws))
+
+
+class _Hits:
+    """
+    1ª ocorrência de cada padrão do FieldSet, procurada só quando alguém pede.
+    Padrões com palavras-chave usam o índice de posições do documento.
+    """
+
+    __slots__ = ("_patterns", "_keywords", "_text", "_found", "_upper", "_positions")
+    _MISSING = object()
+
+    def __init__(self, patterns: List["re.Pattern"],
+                 keywords: List[Optional[FrozenSet[str]]], text: str):
+        self._patterns = patterns
+        self._keywords = keywords
+        self._text = text
+        self._found = [self._MISSING] * len(patterns)
+        self._upper = self._MISSING
+        self._positions: Dict[str, list] = {}
+
+    def __getitem__(self, k: int) -> Optional["re.Match"]:
+        m = self._found[k]
+        if m is self._MISSING:
+            m = self._found[k] = self._first(k)
+        return m
+
+    def _upper_text(self) -> Optional[str]:
+        if self._upper is self._MISSING:
+            text = self._text
+            up = as_context(text).upper_text
+            # maiúsculas com outro comprimento (ß -> SS) desalinham as posições
+            if len(up) != len(text) or any(c in text for c in _FOLD_TRAPS):
+                up = None
+            self._upper = up
+        return self._upper
+
+    def positions(self, kw: str) -> Iterator[int]:
+        """
+        Posições de `kw` no texto em maiúsculas, em ordem. Cada posição é achada
+        uma vez por documento e só quando alguém chega nela (o 1º match costuma
+        estar no começo; documentos grandes não são varridos à toa).
+        """
+        entry = self._positions.get(kw)
+        if entry is None:
+            entry = self._positions[kw] = [[], 0]  # posições achadas, próximo início
+        found = entry[0]
+        i = 0
+        while True:
+            if i < len(found):
+                yield found[i]
+                i += 1
+                continue
+            if entry[1] < 0:
+                return
+            p = self._upper.find(kw, entry[1])
+            entry[1] = p + 1 if p >= 0 else -1
+            if p >= 0:
+                found.append(p)
+
+    def _first(self, k: int) -> Optional["re.Match"]:
+        rx = self._patterns[k]
+        kws = self._keywords[k]
+        if kws is None or self._upper_text() is None:
+            return rx.search(self._text)
+        if len(kws) == 1:
+            cand = self.positions(next(iter(kws)))
+        else:
+            # palavras-chave distintas e sem prefixo comum: posições nunca se repetem
+            cand = heapq.merge(*(self.positions(kw) for kw in kws))
+        for tries, p in enumerate(cand):
+            if tries == _MAX_TRIES:
+                # rótulo comum que não casa (ex.: "IR" dentro de palavras): a
+                # partir daqui a varredura do re, em C, sai mais barata
+                return rx.search(self._text, p)
+            m = rx.match(self._text, p)
+            if m:
+                return m
+        return None
+
+
+# ---------------- conjunto de campos de um layout ----------------
+class FieldSet:
+    """Campos de um layout, compilados uma vez; padrões repetidos viram uma busca só."""
+
+    def __init__(self, fields: Dict[str, object]):
+        self.fields = dict(fields)
+        self._patterns: List["re.Pattern"] = []
+        self._keywords: List[Optional[FrozenSet[str]]] = []
+        self._index: Dict[Tuple[str, int], int] = {}
+        for f in self.fields.values():
+            f._bind(self._register)
+
+    def _register(self, rx: "re.Pattern") -> int:
+        key = (rx.pattern, rx.flags)
+        if key not in self._index:
+            self._index[key] = len(self._patterns)
+            self._patterns.append(rx)
+            self._keywords.append(label_keywords(rx))
+        return self._index[key]
+
+    def extract(self, text: str) -> Dict[str, object]:
+        text = text or ""
+        found = _Hits(self._patterns, self._keywords, text)
+        return {name: f.get(text, found) for name, f in self.fields.items()}
+
+    def extract_located(self, text: str) -> Tuple[Dict[str, object], Dict[str, tuple]]:
+        """Como extract(), mais {campo: (trecho, conversão)} de cada valor (ver locate())."""
+        text = text or ""
+        found = _Hits(self._patterns, self._keywords, text)
+        values, located = {}, {}
+        for name, f in self.fields.items():
+            values[name], span, conv = f.locate(text, found)
+            located[name] = (span, conv)
+        return values, located
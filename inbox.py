@@ -0,0 +1,268 @@
+# inbox.py
+# Modo contínuo (python main.py --watch): vigia as pastas de entrada
+# (settings.WATCH_DIRS), onde scanners e robôs de e-mail largam PDFs/XMLs/ZIPs
+# o dia todo, e processa o que chega sem ninguém rodar o main.py na mão.
+#
+#   - um arquivo só entra quando parou de mudar (tamanho/mtime) há WATCH_SETTLE_S:
+#     cópia pela rede ainda em andamento não é lida pela metade;
+#   - os prontos são juntados em micro-lotes: sai quando junta WATCH_BATCH_MAX
+#     arquivos ou WATCH_BATCH_WINDOW_S depois do 1º, o que vier antes;
+#   - o lote roda num WorkerPool que fica de pé entre os micro-lotes (workers
+#     já aquecidos: nada de subir processos e importar os parsers a cada lote);
+#   - arquivo concluído vai para <pasta>/WATCH_DONE_SUBDIR (não é lido de novo
+#     depois de reiniciar) e só então as notas dele são acrescentadas no TXT/CSV
+#     do dia (WATCH_ROLL), com flush: uma queda no meio não duplica as linhas na
+#     volta (no pior caso o arquivo fica em processados sem as linhas, e basta
+#     devolvê-lo à pasta). O XLSX do dia é regerado a partir do CSV quando o dia
+#     vira e quando o modo contínuo para. Com WATCH_DONE_SUBDIR = None o arquivo
+#     fica onde está e só a memória do processo evita reprocessar;
+#   - as pastas vigiadas não devem ser a PDF_DIR do main.run (settings.WATCH_DIRS
+#     tem a pasta "entrada" própria): os arquivos lidos saem delas.
+#
+# Da chegada à linha no TXT: ~WATCH_SETTLE_S + WATCH_POLL_S + WATCH_BATCH_WINDOW_S
+# + o processamento da nota (com os padrões, 2-3 s para um PDF com texto).
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from settings import (BATCH_CHUNK_SIZE, OUTPUT_TXT, PDF_DIR, WATCH_DIRS, WATCH_POLL_S,
+                      WATCH_SETTLE_S, WATCH_BATCH_MAX, WATCH_BATCH_WINDOW_S,
+                      WATCH_DONE_SUBDIR, WATCH_ROLL)
+from archive import is_archive
+from batch import WorkerPool, run_batch
+from excel_writer import CsvSink, csv_to_xlsx
+from journal import top_level
+from nfse_xml import is_xml
+from sinks import FanOut
+from writer import TxtSink
+
+
+def is_input(name: str) -> bool:
+    # ocultos e temporários do Office/compactadores ficam de fora
+    if name.startswith((".", "~$")):
+        return False
+    return name.lower().endswith(".pdf") or is_xml(name) or is_archive(name)
+
+
+# ---------------- chegada dos arquivos ----------------
+class InboxScanner:
+    """Arquivos das pastas que terminaram de chegar (parados há `settle_s`)."""
+
+    def __init__(self, dirs: Iterable, settle_s: float = WATCH_SETTLE_S):
+        self.dirs = [str(d) for d in dirs]
+        self.settle_s = settle_s
+        self._seen: Dict[str, Tuple[tuple, float]] = {}   # caminho -> (assinatura, desde)
+        self._taken: Dict[str, tuple] = {}                # já entregues -> assinatura
+
+    def _scan(self) -> Dict[str, tuple]:
+        found = {}
+        for d in self.dirs:
+            try:
+                entries = list(os.scandir(d))
+            except OSError:
+                continue    # pasta de rede fora do ar: tenta na próxima varredura
+            for e in entries:
+                try:
+                    if e.is_file() and is_input(e.name):
+                        st = e.stat()
+                        found[e.path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        return found
+
+    def poll(self, now: float) -> List[str]:
+        """Caminhos que ficaram prontos desde a última chamada (cada um sai uma vez)."""
+        found = self._scan()
+        ready = []
+        for path, sig in found.items():
+            if self._taken.get(path) == sig:
+                continue
+            prev = self._seen.get(path)
+            if prev is None or prev[0] != sig:
+                self._seen[path] = (sig, now)
+            elif now - prev[1] >= self.settle_s:
+                del self._seen[path]
+                self._taken[path] = sig
+                ready.append((prev[1], path))
+        # o que sumiu da pasta (movido/apagado) é esquecido
+        for table in (self._seen, self._taken):
+            for path in [p for p in table if p not in found]:
+                del table[path]
+        return [path for _, path in sorted(ready)]
+
+    def release(self, path: str) -> None:
+        """Devolve o arquivo para a fila (o micro-lote dele falhou)."""
+        self._taken.pop(path, None)
+
+
+# ---------------- saídas do dia ----------------
+class RollingOutput:
+    """
+    TXT e CSV abertos em append, um par por período (WATCH_ROLL, ex. por dia:
+    notas_cwb_2025-07-08.txt). O XLSX do período sai do CSV ao fechar.
+    """
+
+    def __init__(self, base_txt=OUTPUT_TXT, roll: Optional[str] = WATCH_ROLL):
+        self.base = str(base_txt)
+        self.roll = roll
+        self.key: Optional[str] = None
+        self.sink: Optional[FanOut] = None
+
+    def paths(self, key: str) -> Tuple[str, str, str]:
+        stem, ext = os.path.splitext(self.base)
+        if key:
+            stem = f"{stem}_{key}"
+        return stem + ext, stem + "_preview.csv", stem + "_preview.xlsx"
+
+    def add(self, rec) -> None:
+        key = datetime.now().strftime(self.roll) if self.roll else ""
+        if key != self.key or self.sink is None:
+            self.close()
+            txt_path, csv_path, _ = self.paths(key)
+            self.key = key
+            self.sink = FanOut([TxtSink(txt_path, append=True), CsvSink(csv_path, append=True)],
+                               flush_every=None)
+        self.sink.add(rec)
+
+    def flush(self) -> None:
+        if self.sink is not None:
+            self.sink.flush()
+
+    def close(self) -> None:
+        if self.sink is None:
+            return
+        self.sink.close()
+        self.sink = None
+        _, csv_path, xlsx_path = self.paths(self.key)
+        csv_to_xlsx(csv_path, xlsx_path)
+        print(f"Gerado XLSX:  {xlsx_path}")
+
+
+def _move_done(path: str, subdir: str) -> str:
+    dest_dir = os.path.join(os.path.dirname(path), subdir)
+    os.makedirs(dest_dir, exist_ok=True)
+    stem, ext = os.path.splitext(os.path.basename(path))
+    dest, k = os.path.join(dest_dir, stem + ext), 1
+    while os.path.exists(dest):
+        k += 1
+        dest = os.path.join(dest_dir, f"{stem} ({k}){ext}")
+    shutil.move(path, dest)
+    return dest
+
+
+# ---------------- micro-lotes ----------------
+def process_batch(paths: List[str], pool: WorkerPool, output: RollingOutput,
+                  finished: Optional[List[str]] = None,
+                  done_subdir: Optional[str] = WATCH_DONE_SUBDIR) -> int:
+    """
+    Processa um micro-lote no pool aquecido e acrescenta as notas em `output`.
+    Cada arquivo concluído vai para `done_subdir`, as notas dele entram em
+    `output` (com flush) e ele entra em `finished`. Os nomes (basename) do lote
+    precisam ser únicos. Devolve o nº de notas gravadas.
+    """
+    finished = [] if finished is None else finished
+    by_name = {os.path.basename(p): p for p in paths}
+
+    def finish(name, recs):
+        path, dest = by_name[name], None
+        if done_subdir:
+            try:
+                dest = _move_done(path, done_subdir)
+            except OSError as e:   # ex.: arquivo aberto por outro programa
+                print(f"{name}: não foi possível mover para {done_subdir} - {e}")
+        try:
+            for rec in recs:
+                output.add(rec)
+            output.flush()
+        except Exception:
+            if dest is not None:
+                shutil.move(dest, path)   # volta para a pasta: o arquivo é refeito
+            raise
+        finished.append(path)
+
+    # lote pequeno: espalha pelos workers em vez de mandar tudo para um só
+    chunksize = max(1, min(BATCH_CHUNK_SIZE or 1, -(-len(paths) // pool.workers)))
+    n, current, recs = 0, None, []
+    for out in run_batch(paths, chunksize=chunksize, pool=pool):
+        print(out["log"])
+        top = top_level(out.get("tarefa") or out["arquivo"])
+        if top != current:
+            if current is not None:
+                finish(current, recs)
+                n += len(recs)
+            current, recs = top, []
+        if out["registro"] is not None:
+            recs.append(out["registro"])
+    if current is not None:
+        finish(current, recs)
+        n += len(recs)
+    # sem nenhum resultado (ex.: ZIP vazio): também conta como lido
+    for name, path in by_name.items():
+        if path not in finished:
+            finish(name, [])
+    return n
+
+
+def _take(pending: List[str], limit: int) -> Tuple[List[str], List[str]]:
+    # até `limit` arquivos, sem repetir nome entre pastas (o lote identifica pelo nome)
+    batch, rest, names = [], [], set()
+    for path in pending:
+        name = os.path.basename(path)
+        if len(batch) < limit and name not in names:
+            batch.append(path)
+            names.add(name)
+        else:
+            rest.append(path)
+    return batch, rest
+
+
+def watch(dirs: Optional[Iterable] = None, workers: Optional[int] = None, stop=None) -> None:
+    """
+    Roda até Ctrl+C (ou até `stop.is_set()`, ex.: threading.Event).
+    dirs: pastas vigiadas (None -> settings.WATCH_DIRS); workers: ver run_batch.
+    """
+    dirs = [str(d) for d in (dirs or WATCH_DIRS)]
+    for d in dirs:
+        try:
+            os.makedirs(d, exist_ok=True)
+        except OSError:
+            pass    # pasta de rede fora do ar: o scanner tenta de novo
+        if WATCH_DONE_SUBDIR and os.path.abspath(d) == os.path.abspath(str(PDF_DIR)):
+            print(f"Aviso: {d} é a PDF_DIR do main.run; os arquivos lidos vão para "
+                  f"{WATCH_DONE_SUBDIR} e saem do lote.")
+    scanner = InboxScanner(dirs)
+    output = RollingOutput()
+    pool = WorkerPool(workers)
+    pool.executor()   # sobe e aquece os workers antes do 1º arquivo
+    print(f"Vigiando: {', '.join(dirs)} ({pool.workers} worker(s)). Ctrl+C para parar.")
+
+    pending: List[str] = []
+    since: Optional[float] = None   # quando o 1º arquivo da fila ficou pronto
+    try:
+        while stop is None or not stop.is_set():
+            now = time.monotonic()
+            pending.extend(scanner.poll(now))
+            if pending and since is None:
+                since = now
+            while pending and (len(pending) >= WATCH_BATCH_MAX
+                               or now - since >= WATCH_BATCH_WINDOW_S):
+                batch, pending = _take(pending, WATCH_BATCH_MAX)
+                finished: List[str] = []
+                try:
+                    process_batch(batch, pool, output, finished)
+                except Exception as e:
+                    # ex.: disco da saída cheio: o que não terminou volta para a fila
+                    print(f"ERRO no micro-lote ({len(batch)} arquivo(s)): {e}")
+                    for path in batch:
+                        if path not in finished:
+                            scanner.release(path)
+                now = time.monotonic()
+                since = now if pending else None
+            time.sleep(WATCH_POLL_S)
+    except KeyboardInterrupt:
+        print("Parando...")
+    finally:
+        pool.close()
+        output.close()
@@ -0,0 +1,187 @@
+# journal.py
+# Diário do lote (main.run): cada tarefa (PDF/XML, ou membro de ZIP) concluída
+# vai para um JSONL ao lado do OUTPUT_TXT, com o resultado de cada nota (status,
+# log e registro). Se o processo cair ou for morto no meio do lote, a próxima
+# execução lê o diário e as tarefas já concluídas saem dele (na mesma posição
+# do lote, sem reprocessar); o resto segue do ponto onde parou. Terminado o
+# lote, o diário é apagado.
+#
+#     jr = BatchJournal(journal_path(OUTPUT_TXT), {nome: fingerprint(caminho)})
+#     for out in run_batch(paths, reuse=jr.lookup):
+#         if not out.get("reusado"):      # "diario": veio daqui
+#             jr.record(out)
+#     jr.finish()
+#
+# Linhas do diário:
+#   {"inicio": true}                                abertura (uma por execução)
+#   {"t": tarefa, "n": k, "fp": ..., "out": {...}}  um resultado (nota) da tarefa
+#   {"t": tarefa, "n": k, "fp": ..., "fim": true}   tarefa completa (fsync aqui)
+# Uma tarefa só conta como concluída com a linha "fim"; resultados soltos (a
+# execução caiu no meio dela) são descartados e a tarefa é refeita. "n" separa
+# tarefas de mesmo nome (o mesmo PDF duas vezes num ZIP). "fp" é o tamanho +
+# mtime do arquivo de entrada (do ZIP, para membros): se o arquivo mudou, a
+# tarefa também é refeita.
+import json
+import os
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+from record import as_record
+
+# campos do resultado do lote que vão para o diário ("peak_rss_mb" não)
+OUT_FIELDS = ("arquivo", "status", "log", "registro", "parser", "ocr")
+
+
+def journal_path(output_txt) -> str:
+    """notas.txt -> notas_journal.jsonl (mesma pasta)."""
+    return os.path.splitext(str(output_txt))[0] + "_journal.jsonl"
+
+
+def fingerprint(path) -> str:
+    """'tamanho:mtime_ns' do arquivo ('' se não existir)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def dump_out(out: dict) -> dict:
+    """Resultado do lote -> JSON (registro via to_dict)."""
+    entry = {k: out.get(k) for k in OUT_FIELDS}
+    rec = out.get("registro")
+    entry["registro"] = as_record(rec).to_dict() if rec is not None else None
+    return entry
+
+
+def load_out(entry: dict) -> dict:
+    """Inverso de dump_out (registro volta a ser NfseRecord)."""
+    out = dict(entry)
+    out["registro"] = as_record(out.get("registro"))
+    return out
+
+
+def top_level(task: str) -> str:
+    # "lote.zip/pasta/nota.pdf" -> "lote.zip" (tarefas de ZIP usam o fp do ZIP)
+    return task.split("/", 1)[0]
+
+
+class BatchJournal:
+    """
+    Diário de um lote. `fingerprints` = {nome do arquivo de entrada: fingerprint()},
+    com os nomes como o lote os vê (basename do caminho).
+    """
+
+    def __init__(self, path, fingerprints: Dict[str, str]):
+        self.path = str(path)
+        self.fingerprints = fingerprints
+        # (tarefa, k) -> (fp, [offsets das linhas de resultado]), na ordem de conclusão
+        self.done: Dict[Tuple[str, int], tuple] = {}
+        self._load()
+        self.f = open(self.path, "a", encoding="utf-8", newline="\n")
+        self._write({"inicio": True})
+        self._seen: Counter = Counter()     # ocorrências de cada nome nesta execução
+        self._queue: deque = deque()        # (tarefa, k) que o lote vai processar
+        self._current: Optional[Tuple[str, int]] = None
+        self._current_fp = ""
+
+    # ---- leitura
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        pending: Dict[Tuple[str, int], List[int]] = {}
+        last = None     # tarefa da linha anterior (None após "inicio"/"fim")
+        end = 0
+        with open(self.path, "rb") as f:
+            for raw in iter(f.readline, b""):
+                off = end
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    break   # linha cortada (queda no meio da gravação): o resto é descartado
+                if not raw.endswith(b"\n"):
+                    break
+                end += len(raw)
+                if entry.get("t") is None:
+                    last = None
+                    continue
+                t = (entry["t"], entry.get("n", 1))
+                if entry.get("fim"):
+                    self.done.pop(t, None)   # refeita: vale a última conclusão
+                    self.done[t] = (entry.get("fp", ""), pending.pop(t, []))
+                    last = None
+                else:
+                    if last != t:
+                        pending[t] = []      # nova tentativa desta tarefa
+                    pending[t].append(off)
+                    last = t
+        if end < os.path.getsize(self.path):
+            # corta o lixo do fim, para as próximas linhas começarem limpas
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+
+    def fp(self, task: str) -> str:
+        return self.fingerprints.get(top_level(task), "")
+
+    def _valid(self, key: Tuple[str, int]) -> bool:
+        entry = self.done.get(key)
+        return entry is not None and bool(entry[0]) and entry[0] == self.fp(key[0])
+
+    def lookup(self, task: str) -> Optional[List[dict]]:
+        """
+        Resultados da tarefa, se ela foi concluída numa execução anterior (e o
+        arquivo não mudou); senão None. É o `reuse` do run_batch: chamado uma
+        vez por tarefa, na ordem do lote. Os resultados vêm com "reusado" = "diario".
+        """
+        self._seen[task] += 1
+        key = (task, self._seen[task])
+        if not self._valid(key):
+            self._queue.append(key)
+            return None
+        offsets = self.done[key][1]
+        outs = []
+        with open(self.path, "rb") as f:
+            for off in offsets:
+                f.seek(off)
+                out = load_out(json.loads(f.readline())["out"])
+                out["tarefa"] = task
+                out["reusado"] = "diario"
+                outs.append(out)
+        if outs:
+            outs[-1]["fim_tarefa"] = True
+        return outs
+
+    # ---- gravação
+    def _write(self, entry: dict) -> None:
+        self.f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _line(self, **extra) -> dict:
+        task, k = self._current
+        return {"t": task, "n": k, "fp": self._current_fp, **extra}
+
+    def record(self, out: dict) -> None:
+        """Grava um resultado do lote; com "fim_tarefa", a tarefa fica concluída."""
+        if self._current is None:
+            task = out.get("tarefa") or out["arquivo"]
+            if self._queue and self._queue[0][0] == task:
+                self._current = self._queue.popleft()
+            else:   # tarefa que não passou pelo lookup (lote sem reuse)
+                self._seen[task] += 1
+                self._current = (task, self._seen[task])
+            self._current_fp = self.fp(task)
+        self._write(self._line(out=dump_out(out)))
+        if out.get("fim_tarefa", True):
+            self._write(self._line(fim=True))
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self._current = None
+
+    def close(self) -> None:
+        """Fecha sem concluir a tarefa em andamento (lote interrompido)."""
+        if not self.f.closed:
+            self.f.close()
+
+    def finish(self) -> None:
+        """Lote completo: apaga o diário."""
+        self.close()
+        os.remove(self.path)
@@ -0,0 +1,155 @@
+# layout_classifier.py
+# Classificador de layout em uma passada: junta os marcadores de todos os
+# parsers registrados numa única regex (literais fatorados em trie), varre o
+# texto (sem acento, maiúsculo) uma vez e decide o parser pela ordem de
+# prioridade do roteador.
+#
+# Cada parser declara em PARSER["markers"] uma lista de regras; a regra casa
+# quando TODOS os marcadores dela aparecem no texto, e o parser casa quando
+# QUALQUER regra casa:
+#     "markers": [
+#         ("DANFSE",),                           # str = trecho literal
+#         ("CHAVE DE ACESSO", "NFS"),            # E
+#         (re.compile(r"\bCURITIBA\s*\(PR\)"),), # regex (sobre o texto normalizado)
+#     ]
+# Literais são normalizados como o texto (doc_context.norm_ascii_upper), então
+# "SÃO PAULO" também casa "SAO PAULO" de um OCR sem acento.
+import logging
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from doc_context import as_context, norm_ascii_upper
+
+logger = logging.getLogger(__name__)
+
+
+def _marker_source(marker) -> str:
+    if isinstance(marker, re.Pattern):
+        return marker.pattern
+    return re.escape(norm_ascii_upper(marker))
+
+
+def _trie_regex(words: Sequence[str]) -> str:
+    """
+    Alternação dos literais fatorada por prefixo comum (trie): em cada posição
+    o re só desce pelo ramo do caractere atual, então o custo da varredura quase
+    não cresce com o nº de marcadores (a alternação ingênua testa um por um).
+    """
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node: dict) -> str:
+        optional = "" in node
+        alts = [re.escape(ch) + emit(sub) for ch, sub in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if optional:
+            body = (body if len(alts) > 1 else "(?:" + body + ")") + "?"
+        return body
+
+    return emit(trie)
+
+
+class LayoutClassifier:
+    """
+    Compilado uma vez a partir da lista de parsers (em ordem de prioridade).
+    Parsers sem "markers" (ex.: o genérico) caem no can_parse() deles, na
+    mesma posição da ordem.
+    """
+
+    def __init__(self, parsers: Sequence[dict]):
+        self.parsers = list(parsers)
+        self._sources: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._literals: List[str] = []
+        self._regexes: List[str] = []
+        self._by_first: Dict[str, Tuple[int, ...]] = {}  # 1º caractere -> marcadores literais
+        self._regex_ids: Tuple[int, ...] = ()
+        # por parser: lista de regras, cada regra = tupla de índices de marcador
+        self._rules: List[Optional[List[Tuple[int, ...]]]] = []
+        for p in self.parsers:
+            markers = p.get("markers")
+            if not markers:
+                self._rules.append(None)
+                continue
+            self._rules.append([tuple(self._add(m) for m in rule) for rule in markers])
+
+        self._patterns = [re.compile(src) for src in self._sources]
+        # uma regex só acha as posições onde ALGUM marcador começa (literais na
+        # trie, regex dos parsers como alternativas extras); em cada posição só
+        # os marcadores que podem começar ali são testados com .match()
+        parts = []
+        if self._literals:
+            parts.append(_trie_regex(self._literals))
+        parts.extend(f"(?:{src})" for src in self._regexes)
+        self._scan = re.compile("|".join(parts)) if parts else None
+
+    def _add(self, marker) -> int:
+        src = _marker_source(marker)
+        if src not in self._index:
+            k = self._index[src] = len(self._sources)
+            self._sources.append(src)
+            if isinstance(marker, re.Pattern):
+                self._regexes.append(src)
+                self._regex_ids += (k,)
+            else:
+                lit = norm_ascii_upper(marker)
+                self._literals.append(lit)
+                self._by_first[lit[0]] = self._by_first.get(lit[0], ()) + (k,)
+        return self._index[src]
+
+    def scan(self, norm_text: str) -> Set[int]:
+        """Índices dos marcadores presentes no texto normalizado."""
+        found: Set[int] = set()
+        if self._scan is None:
+            return found
+        total = len(self._patterns)
+        pos = 0
+        while len(found) < total:
+            m = self._scan.search(norm_text, pos)
+            if m is None:
+                break
+            pos = m.start()
+            for k in self._by_first.get(norm_text[pos], ()) + self._regex_ids:
+                if k not in found and self._patterns[k].match(norm_text, pos):
+                    found.add(k)
+            # +1 (e não m.end()): marcadores podem se sobrepor
+            pos += 1
+        return found
+
+    def classify(self, text) -> Tuple[Optional[dict], float]:
+        """
+        (PARSER vencedor, confiança). Confiança = fração dos marcadores do
+        parser vencedor que apareceram no texto (1.0 = todos); 0.0 quando
+        ninguém casou pelos marcadores e o vencedor veio do can_parse().
+        (None, 0.0) se nenhum parser aceitar o texto.
+        """
+        ctx = as_context(text)
+        found = self.scan(ctx.norm_text)
+        for p, rules in zip(self.parsers, self._rules):
+            if rules is None:
+                try:
+                    can = p.get("can_parse")
+                    if callable(can) and can(ctx):
+                        return p, 0.0
+                except Exception as e:
+                    logger.exception("Erro ao testar can_parse para parser %s: %s", p.get("name"), e)
+                continue
+            if any(all(k in found for k in rule) for rule in rules):
+                own = {k for rule in rules for k in rule}
+                return p, len(own & found) / len(own)
+        return None, 0.0
+
+
+def match_markers(markers, text) -> bool:
+    """Testa as regras de um parser só (para o can_parse do próprio módulo)."""
+    T = as_context(text).norm_text
+    for rule in markers:
+        if all(re.search(_marker_source(m), T) for m in rule):
+            return True
+    return False
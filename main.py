@@ -1,86 +1,109 @@
 # main.py (substituir o conteúdo atual por este)
 import os
-import re
-from pathlib import Path
-from settings import PDF_DIR, OUTPUT_TXT
-from extractor import extract_text  # sua função existente (pdfplumber)
-from parser_router import select_parser
-from writer import write_txt
-from excel_writer import write_xlsx, write_csv_semicolon
-
-# ---------- Helpers ----------
-def is_valid_cnpj(s: str) -> bool:
-    if not s:
-        return False
-    digits = re.sub(r"\D", "", s)
-    return len(digits) == 14
-
-def parse_result_status(parse_res: dict, require_serie: bool = True):
-    """
-    Retorna (is_valid: bool, missing: list)
-    """
-    missing = []
-    if not isinstance(parse_res, dict):
-        return False, ["PARSE_FAIL"]
-    c = parse_res.get("cnpj_cpf", "") or ""
-    n = str(parse_res.get("numero_documento", "") or "").strip()
-    s = str(parse_res.get("serie", "") or "").strip()
-    if not is_valid_cnpj(c):
-        missing.append("CNPJ")
-    if not n or not re.search(r"\d", n):
-        missing.append("NÚMERO")
-    if require_serie and not s:
-        missing.append("SÉRIE")
-    return (len(missing) == 0), missing
+import sys
+from settings import PDF_DIR, OUTPUT_TXT, BATCH_JOURNAL, MANIFEST_ENABLED
+from batch import run_batch, is_valid_cnpj, parse_result_status  # noqa: F401 (helpers reexportados)
+from archive import is_archive
+from nfse_xml import is_xml
+from journal import BatchJournal, fingerprint, journal_path, top_level
+from manifest import Manifest, manifest_path
+from sinks import FanOut
+from writer import TxtSink
+from excel_writer import XlsxSink, CsvSink
 
 # ---------- Main ----------
-def run():
-    registros = []
-    # lista arquivos no PDF_DIR (PDF_DIR já vem do settings como Path)
-    for fname in sorted(os.listdir(PDF_DIR)):
-        if not fname.lower().endswith(".pdf"):
-            continue
-        path = PDF_DIR / fname
-        filename = fname
+def _save_manifest(manifest, arquivo, notas):
+    # arquivo de entrada completo: grava no manifesto, a menos que tudo tenha
+    # vindo dele mesmo (nada mudou)
+    if arquivo is not None and any(n.get("reusado") != "manifesto" for n in notas):
+        manifest.put(arquivo, notas)
 
-        # 1) extrair texto com pdfplumber via extractor.extract_text
-        text = extract_text(str(path)) or ""
-        # heurística simples: se pouco ou nada de texto, considerar imagem/scan
-        if len(text.strip()) < 40:
-            print(f"{filename}: IMAGEM")
-            # opcional: pode salvar um registro com erro ou ignorar completamente
-            continue
+def run(workers=None, chunksize=None):
+    """
+    Processa todos os PDFs (e XMLs de NFS-e) de PDF_DIR.
 
-        # 2) selecionar parser e rodar
-        parser_name, parse_fn = select_parser(text)
-        try:
-            parsed = parse_fn(text)  # parsed deve ser dict
-        except Exception as e:
-            print(f"{filename}: ERRO (parse exception)")
-            # opcional: log de exceção
-            # import traceback; traceback.print_exc()
-            continue
+    workers:   nº de processos em paralelo (None -> settings.BATCH_WORKERS / nº de CPUs; 1 = serial)
+    chunksize: arquivos entregues por vez a cada processo (None -> settings.BATCH_CHUNK_SIZE)
+    """
+    peak_mb = 0.0
+    # lista arquivos no PDF_DIR (PDF_DIR já vem do settings como Path);
+    # ZIPs de PDFs são lidos direto, sem descompactar em disco; XMLs de NFS-e
+    # (Nacional/ABRASF) viram registro direto, sem extração de PDF
+    paths = [
+        str(PDF_DIR / fname)
+        for fname in sorted(os.listdir(PDF_DIR))
+        if fname.lower().endswith(".pdf") or is_xml(fname) or is_archive(fname)
+    ]
 
-        # 3) validar campos essenciais
-        ok, missing = parse_result_status(parsed, require_serie=True)
-        if ok:
-            print(f"{filename}: OK")
-        else:
-            print(f"{filename}: ERRO ({', '.join(missing)})")
+    # manifesto: arquivos que não mudaram desde a última execução saem dele
+    # (ver manifest.py); diário: se a execução anterior caiu no meio, o que ela
+    # concluiu não é refeito (ver journal.py)
+    manifest = Manifest(manifest_path(OUTPUT_TXT), paths) if MANIFEST_ENABLED else None
+    journal = None
+    if BATCH_JOURNAL:
+        journal = BatchJournal(journal_path(OUTPUT_TXT),
+                               {os.path.basename(p): fingerprint(p) for p in paths})
 
-        # 4) armazenar o parsed (mantive o comportamento original)
-        registros.append(parsed)
+    def reuse(name):
+        outs = manifest.lookup(name) if manifest is not None else None
+        if outs is None and journal is not None:
+            outs = journal.lookup(name)
+        return outs
 
-    # após processar todos, gravar outputs (mesmo se alguns foram IMAGEM/ERRO)
-    write_txt(registros, OUTPUT_TXT)
     xlsx_path = str(OUTPUT_TXT).replace(".txt", "_preview.xlsx")
     csv_path  = str(OUTPUT_TXT).replace(".txt", "_preview.csv")
-    write_xlsx(registros, xlsx_path)
-    write_csv_semicolon(registros, csv_path)
+    reusados = 0
+    arquivo, notas = None, []     # resultados do arquivo de entrada atual (p/ o manifesto)
+    try:
+        # cada registro vai para TXT/XLSX/CSV assim que sai do parse (nada acumula);
+        # os arquivos são fechados mesmo se alguns PDFs foram IMAGEM/ERRO
+        with FanOut([TxtSink(OUTPUT_TXT), XlsxSink(xlsx_path), CsvSink(csv_path)]) as saida:
+            # extrair -> rotear -> parsear em paralelo; resultados chegam na ordem dos arquivos
+            for out in run_batch(paths, workers=workers, chunksize=chunksize, reuse=reuse):
+                if out.get("reusado"):
+                    reusados += 1
+                else:
+                    print(out["log"])
+                    peak_mb = max(peak_mb, out.get("peak_rss_mb") or 0.0)
+                    if journal is not None:
+                        journal.record(out)
+                if manifest is not None:
+                    top = top_level(out.get("tarefa") or out["arquivo"])
+                    if top != arquivo:
+                        _save_manifest(manifest, arquivo, notas)
+                        arquivo, notas = top, []
+                    notas.append(out)
+                # IMAGEM e exceção de parse não geram registro; ERRO de validação gera
+                # (mantive o comportamento original)
+                if out["registro"] is not None:
+                    saida.add(out["registro"])
+            if manifest is not None:
+                _save_manifest(manifest, arquivo, notas)
+                manifest.prune()
+    except BaseException:
+        # interrompido: o diário fica para a próxima execução retomar
+        if journal is not None:
+            journal.close()
+        raise
+    finally:
+        if manifest is not None:
+            manifest.close()
+    if journal is not None:
+        journal.finish()
 
+    if reusados:
+        print(f"Reaproveitados: {reusados} resultado(s) de execuções anteriores (manifesto/diário)")
     print(f"Gerado TXT:   {OUTPUT_TXT}")
     print(f"Gerado XLSX:  {xlsx_path}")
     print(f"Gerado CSV ;: {csv_path}")
+    if peak_mb:
+        # maior pico de memória entre os processos (útil para dimensionar BATCH_WORKERS)
+        print(f"Pico RSS/worker: {peak_mb:.0f} MB")
 
 if __name__ == "__main__":
-    run()
+    if "--watch" in sys.argv[1:]:
+        # modo contínuo: vigia settings.WATCH_DIRS (ver inbox.py)
+        from inbox import watch
+        watch()
+    else:
+        run()
@@ -0,0 +1,156 @@
+# manifest.py
+# Manifesto do diretório (main.run): para cada arquivo de entrada já processado
+# guarda tamanho, mtime, SHA-256 do conteúdo e os resultados (status, log,
+# registro e versão do parser de cada nota). A execução seguinte só extrai e
+# parseia o que é novo ou mudou; o resto sai do manifesto, na mesma posição,
+# e o OUTPUT_TXT/XLSX/CSV é regerado com tudo.
+#
+#     mf = Manifest(manifest_path(OUTPUT_TXT), paths)
+#     for out in run_batch(paths, reuse=mf.lookup): ...   # "reusado" = "manifesto"
+#     mf.put(nome, resultados_do_arquivo)
+#     mf.prune()                                          # tira o que saiu da pasta
+#
+# Um arquivo é reaproveitado quando:
+#   - tamanho + mtime batem (sem ler o arquivo), ou o mtime mudou mas o SHA-256
+#     é o mesmo (arquivo copiado/tocado);
+#   - a versão do parser de cada nota é a atual (PARSER["version"] /
+#     nfse_xml.XML_VERSION): subir a versão de um parser refaz só as notas dele;
+#   - settings.DEFAULTS / FALLBACK_CLIENTE (copiados para o registro) são os
+#     mesmos (cache.settings_fingerprint): mudar o cfps, o acumulador ou o cliente
+#     padrão refaz tudo;
+#   - nenhuma nota deu TIMEOUT (depende da máquina: tenta de novo), nem ERRO ou
+#     IMAGEM sem parser (leitura/extração falhou, processo abortado, OCR que não
+#     estava instalado...): só falha de parse de um parser conhecido é guardada.
+# SQLite, um commit por arquivo: o manifesto fica válido mesmo se o lote cair.
+import json
+import os
+import sqlite3
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+from cache import settings_fingerprint, sha256_file
+from journal import dump_out, load_out
+from nfse_xml import XML_ABRASF, XML_NACIONAL, XML_VERSION
+from parser_router import parser_version
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256   TEXT NOT NULL,
+    results  BLOB NOT NULL,
+    updated  REAL NOT NULL
+);
+"""
+
+
+def manifest_path(output_txt) -> str:
+    """notas.txt -> notas_manifest.sqlite3 (mesma pasta)."""
+    return os.path.splitext(str(output_txt))[0] + "_manifest.sqlite3"
+
+
+def version_of(parser: str) -> str:
+    if parser in (XML_NACIONAL, XML_ABRASF):
+        return XML_VERSION
+    return parser_version(parser)
+
+
+def _fresh(outs: List[dict]) -> bool:
+    config = settings_fingerprint()
+    for out in outs:
+        if out.get("config") != config:
+            return False
+        if out.get("status") == "TIMEOUT":
+            return False
+        if out.get("status") in ("ERRO", "IMAGEM") and not out.get("parser"):
+            return False
+        if out.get("parser") and out.get("versao") != version_of(out["parser"]):
+            return False
+    return True
+
+
+class Manifest:
+    """
+    Manifesto dos arquivos `paths` (os nomes do lote são os basenames deles).
+    Entradas de arquivos que não estão em `paths` ficam até o prune().
+    """
+
+    def __init__(self, db_path, paths: Iterable):
+        self.db_path = str(db_path)
+        self.by_name: Dict[str, str] = {os.path.basename(str(p)): str(p) for p in paths}
+        self.con = sqlite3.connect(self.db_path, timeout=30)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.executescript(_SCHEMA)
+
+    def lookup(self, name: str) -> Optional[List[dict]]:
+        """
+        Resultados guardados do arquivo `name`, se ele não mudou e os parsers
+        são os mesmos; senão None. É o `reuse` do run_batch (membros de ZIP
+        não têm entrada própria: o ZIP entra inteiro). Os resultados vêm com
+        "reusado" = "manifesto".
+        """
+        path = self.by_name.get(name)
+        if path is None:
+            return None
+        row = self.con.execute(
+            "SELECT size, mtime_ns, sha256, results FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, sha, blob = row
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+            if st.st_size != size or sha256_file(path) != sha:
+                return None
+            with self.con:
+                self.con.execute("UPDATE files SET mtime_ns = ? WHERE path = ?",
+                                 (st.st_mtime_ns, path))
+        outs = json.loads(zlib.decompress(blob).decode("utf-8"))
+        if not _fresh(outs):
+            return None
+        outs = [load_out(o) for o in outs]
+        for out in outs:
+            out["reusado"] = "manifesto"
+        return outs
+
+    def put(self, name: str, outs: List[dict]) -> None:
+        """Guarda os resultados do arquivo `name` (todas as notas dele, em ordem)."""
+        path = self.by_name.get(name)
+        if path is None:
+            return
+        try:
+            st = os.stat(path)
+            sha = sha256_file(path)
+        except OSError:
+            return
+        entries, config = [], settings_fingerprint()
+        for out in outs:
+            entry = dump_out(out)
+            entry["tarefa"] = out.get("tarefa")
+            entry["fim_tarefa"] = out.get("fim_tarefa", False)
+            entry["versao"] = version_of(out["parser"]) if out.get("parser") else ""
+            entry["config"] = config
+            entries.append(entry)
+        blob = zlib.compress(json.dumps(entries, ensure_ascii=False).encode("utf-8"), 6)
+        with self.con:
+            self.con.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, results, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, sha, blob, time.time()),
+            )
+
+    def prune(self) -> int:
+        """Apaga as entradas de arquivos fora de `paths`; devolve quantas."""
+        keep = set(self.by_name.values())
+        gone = [p for (p,) in self.con.execute("SELECT path FROM files") if p not in keep]
+        with self.con:
+            self.con.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in gone])
+        return len(gone)
+
+    def close(self) -> None:
+        self.con.close()
@@ -0,0 +1,52 @@
+# memstats.py
+# Medição de memória (RSS) do processo atual, para limitar a extração e
+# dimensionar os workers. Só stdlib (psutil é usado se estiver instalado).
+import os
+import sys
+from typing import Optional
+
+try:
+    import resource  # Unix
+except Exception:
+    resource = None
+
+try:
+    import psutil  # opcional (único jeito no Windows)
+except Exception:
+    psutil = None
+
+_MB = 1024 * 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    """RSS atual do processo em MB (None se não houver como medir)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / _MB
+    except Exception:
+        pass
+    if psutil is not None:
+        try:
+            return psutil.Process().memory_info().rss / _MB
+        except Exception:
+            pass
+    return None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Pico de RSS do processo desde o início, em MB."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux devolve KB; macOS devolve bytes
+        return peak / _MB if sys.platform == "darwin" else peak / 1024
+    if psutil is not None:
+        try:
+            info = psutil.Process().memory_info()
+            return getattr(info, "peak_wset", info.rss) / _MB
+        except Exception:
+            pass
+    return None
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """A extração de um documento passou do limite de memória configurado."""
@@ -0,0 +1,240 @@
+# nfse_xml.py
+# Leitura direta do XML da NFS-e (Padrão Nacional e ABRASF 1.x/2.x), sem PDF:
+# o XML traz os valores exatos, então nada de pdfminer nem heurística de texto.
+# O arquivo é lido em streaming (iterparse): cada nota vira um NfseRecord assim
+# que o elemento dela fecha e é descartada em seguida, então um lote/lista com
+# milhares de notas não fica inteiro na memória.
+#
+#     for layout, rec in iter_xml_records("notas.xml"):   # caminho, bytes ou arquivo
+#         ...   # layout = XML_NACIONAL | XML_ABRASF
+#
+# Elementos de nota reconhecidos (namespace ignorado):
+#   - Nacional: NFSe/infNFSe (com DPS/infDPS dentro)
+#   - ABRASF:   InfNfse (ListaNfse/CompNfse, ConsultarLoteRpsResposta...);
+#               CompNfse com NfseCancelamento -> situação 2 (cancelada)
+import xml.etree.ElementTree as ET
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+from io import BytesIO
+from typing import Iterator, Optional, Tuple
+
+from dates import to_date
+from record import NfseRecord
+from settings import DEFAULTS, FALLBACK_CLIENTE
+
+XML_EXTENSIONS = (".xml",)
+XML_NACIONAL = "NFS-e Nacional (XML)"
+XML_ABRASF = "ABRASF (XML)"
+# versão do mapeamento XML -> registro (como PARSER["version"]: mudou a lógica,
+# sobe a versão e o manifesto do lote refaz só os XMLs)
+XML_VERSION = "1"
+
+
+def is_xml(name: str) -> bool:
+    return str(name).lower().endswith(XML_EXTENSIONS)
+
+
+# ---------------- helpers ----------------
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+@lru_cache(maxsize=None)
+def _q(path: str) -> str:
+    # "A/B" -> "{*}A/{*}B" (qualquer namespace)
+    return "/".join("{*}" + p if p and p not in (".", "..") else p for p in path.split("/"))
+
+
+def _get(el, *paths: str) -> str:
+    """Texto do 1º caminho que existir e não estiver vazio ("" se nenhum)."""
+    for path in paths:
+        e = el.find(_q(path))
+        if e is not None and e.text and e.text.strip():
+            return e.text.strip()
+    return ""
+
+
+def _decimal(s: str) -> Optional[Decimal]:
+    try:
+        v = Decimal(s)
+    except (InvalidOperation, ValueError):
+        return None
+    return v if v.is_finite() else None
+
+
+def _to_cents(v: Optional[Decimal]) -> int:
+    return int((v * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP)) if v is not None else 0
+
+
+def _cents(s: str) -> int:
+    # decimal do XML usa ponto: "1234.56" -> 123456
+    return _to_cents(_decimal(s))
+
+
+def _aliquota(s: str) -> int:
+    # ABRASF 1.x manda fração (0.05), os demais percentual (5.00) -> centésimos de %
+    v = _decimal(s)
+    if v is not None and 0 < v < 1:
+        v *= 100
+    return _to_cents(v)
+
+
+def _date(s: str):
+    # "2025-07-08T10:00:00-03:00" / "2025-07-08" -> date
+    return to_date(s[:10], fuzzy=False) if s else None
+
+
+def _doc(s: str) -> str:
+    # o XML traz só os dígitos; os PDFs saem formatados (00.000.000/0000-00)
+    if len(s) == 14 and s.isdigit():
+        return f"{s[:2]}.{s[2:5]}.{s[5:8]}/{s[8:12]}-{s[12:]}"
+    if len(s) == 11 and s.isdigit():
+        return f"{s[:3]}.{s[3:6]}.{s[6:9]}-{s[9:]}"
+    return s
+
+
+def _endereco(el, logradouro: str, numero: str) -> str:
+    return ", ".join(p for p in (_get(el, logradouro), _get(el, numero)) if p)
+
+
+def _finish(d: NfseRecord) -> NfseRecord:
+    d["cnpj_cpf"] = d["cnpj_cpf"] or FALLBACK_CLIENTE.get("cnpj_cpf", "")
+    d["razao_social"] = d["razao_social"] or FALLBACK_CLIENTE.get("razao_social", "")
+    d["valor_contabil"] = d["valor_servicos"] - d["valor_descontos"] - d["valor_deducao"]
+    d["acumulador"] = DEFAULTS.get("acumulador", "1")
+    d["cfps"] = DEFAULTS.get("cfps", "9101")
+    return d
+
+
+# ---------------- Padrão Nacional (infNFSe) ----------------
+def map_nacional(inf) -> NfseRecord:
+    """Elemento infNFSe -> registro (prestador nas colunas de cliente, como nos PDFs)."""
+    d = NfseRecord(situacao=DEFAULTS.get("situacao", "0"))
+    dps = inf.find(_q("DPS/infDPS"))
+    if dps is None:
+        dps = ET.Element("infDPS")
+    vals = dps.find(_q("valores"))
+    if vals is None:
+        vals = ET.Element("valores")
+
+    d["numero_documento"] = _get(inf, "nNFSe")
+    d["serie"] = _get(dps, "serie")
+    d.set_data(_date(_get(dps, "dhEmi", "dCompet") or _get(inf, "dhProc")))
+
+    d["cnpj_cpf"] = _doc(_get(inf, "emit/CNPJ", "emit/CPF") or _get(dps, "prest/CNPJ", "prest/CPF"))
+    d["razao_social"] = _get(inf, "emit/xNome") or _get(dps, "prest/xNome")
+    d["endereco"] = _endereco(inf, "emit/enderNac/xLgr", "emit/enderNac/nro")
+    d["municipio"] = _get(inf, "xLocEmi")
+    d["uf"] = _get(inf, "emit/enderNac/UF")
+
+    d["valor_servicos"] = _cents(_get(vals, "vServPrest/vServ"))
+    d["valor_descontos"] = _cents(_get(vals, "vDescCondIncond/vDescIncond"))
+    d["valor_deducao"] = _cents(_get(vals, "vDedRed/vDR"))
+    d["base_calculo"] = _cents(_get(inf, "valores/vBC"))
+    d["aliquota_iss"] = _cents(_get(inf, "valores/pAliqAplic") or _get(vals, "trib/tribMun/pAliq"))
+
+    # tpRetISSQN: 1 = não retido; 2 = retido pelo tomador; 3 = pelo intermediário
+    iss = _cents(_get(inf, "valores/vISSQN"))
+    if _get(vals, "trib/tribMun/tpRetISSQN") in ("2", "3"):
+        d["valor_iss_retido"] = iss
+    else:
+        d["valor_iss_normal"] = iss
+
+    d["valor_irrf"] = _cents(_get(vals, "trib/tribFed/vRetIRRF"))
+    d["valor_csll"] = _cents(_get(vals, "trib/tribFed/vRetCSLL"))
+    d["valor_inss"] = _cents(_get(vals, "trib/tribFed/vRetCP"))
+    # PIS/COFINS só entram como retenção quando tpRetPisCofins = 1 (retido)
+    if _get(vals, "trib/tribFed/piscofins/tpRetPisCofins") == "1":
+        d["valor_pis"] = _cents(_get(vals, "trib/tribFed/piscofins/vPis"))
+        d["valor_cofins"] = _cents(_get(vals, "trib/tribFed/piscofins/vCofins"))
+    return _finish(d)
+
+
+# ---------------- ABRASF (InfNfse) ----------------
+def map_abrasf(inf, cancelada: bool = False) -> NfseRecord:
+    """Elemento InfNfse (ABRASF 1.x ou 2.x) -> registro."""
+    d = NfseRecord(situacao="2" if cancelada else DEFAULTS.get("situacao", "0"))
+    # 1.x: InfNfse/Servico/Valores; 2.x: .../InfDeclaracaoPrestacaoServico/Servico/Valores
+    servico = inf.find(_q("Servico"))
+    if servico is None:
+        servico = inf.find(_q(".//InfDeclaracaoPrestacaoServico/Servico"))
+    if servico is None:
+        servico = ET.Element("Servico")
+    vals = servico.find(_q("Valores"))
+    if vals is None:
+        vals = ET.Element("Valores")
+    prest = "PrestadorServico/"
+
+    d["numero_documento"] = _get(inf, "Numero")
+    d["serie"] = _get(inf, ".//IdentificacaoRps/Serie")
+    d.set_data(_date(_get(inf, "DataEmissao", ".//InfDeclaracaoPrestacaoServico/Competencia")))
+
+    d["cnpj_cpf"] = _doc(_get(inf, prest + "IdentificacaoPrestador/Cnpj",
+                              prest + "IdentificacaoPrestador/CpfCnpj/Cnpj",
+                              prest + "IdentificacaoPrestador/CpfCnpj/Cpf"))
+    d["razao_social"] = _get(inf, prest + "RazaoSocial", prest + "NomeFantasia")
+    d["endereco"] = _endereco(inf, prest + "Endereco/Endereco", prest + "Endereco/Numero")
+    d["uf"] = _get(inf, prest + "Endereco/Uf")
+    # município só vem como código IBGE (CodigoMunicipio): fica em branco
+
+    d["valor_servicos"] = _cents(_get(vals, "ValorServicos"))
+    d["valor_descontos"] = _cents(_get(vals, "DescontoIncondicionado"))
+    d["valor_deducao"] = _cents(_get(vals, "ValorDeducoes"))
+    d["base_calculo"] = _cents(_get(vals, "BaseCalculo") or _get(inf, "ValoresNfse/BaseCalculo"))
+    d["aliquota_iss"] = _aliquota(_get(vals, "Aliquota") or _get(inf, "ValoresNfse/Aliquota"))
+
+    # IssRetido: 1 = sim, 2 = não (1.x dentro de Valores, 2.x em Servico)
+    iss = _cents(_get(vals, "ValorIss") or _get(inf, "ValoresNfse/ValorIss"))
+    if (_get(vals, "IssRetido") or _get(servico, "IssRetido")) == "1":
+        d["valor_iss_retido"] = _cents(_get(vals, "ValorIssRetido")) or iss
+    else:
+        d["valor_iss_normal"] = iss
+
+    d["valor_pis"] = _cents(_get(vals, "ValorPis"))
+    d["valor_cofins"] = _cents(_get(vals, "ValorCofins"))
+    d["valor_inss"] = _cents(_get(vals, "ValorInss"))
+    d["valor_irrf"] = _cents(_get(vals, "ValorIr"))
+    d["valor_csll"] = _cents(_get(vals, "ValorCsll"))
+    return _finish(d)
+
+
+# ---------------- leitura em streaming ----------------
+def iter_xml_records(source) -> Iterator[Tuple[str, NfseRecord]]:
+    """
+    (layout, registro) para cada NFS-e do XML `source` (caminho, bytes ou
+    arquivo aberto), na ordem do arquivo. Erro de XML malformado propaga
+    (ET.ParseError) depois das notas já lidas.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    stack = []                      # elementos abertos (para soltar os já lidos)
+    comp: Optional[list] = None     # CompNfse aberto: [InfNfse, cancelada]
+    for event, el in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            stack.append(el)
+            if _local(el.tag) == "CompNfse":
+                comp = [None, False]
+            continue
+        stack.pop()
+        tag = _local(el.tag)
+        done = None
+        if tag == "infNFSe":
+            done = (XML_NACIONAL, map_nacional(el))
+        elif tag == "InfNfse":
+            if comp is not None:
+                comp[0] = el        # espera o CompNfse fechar (pode vir cancelamento)
+                continue
+            done = (XML_ABRASF, map_abrasf(el))
+        elif tag == "NfseCancelamento" and comp is not None:
+            comp[1] = True
+        elif tag == "CompNfse" and comp is not None:
+            if comp[0] is not None:
+                done = (XML_ABRASF, map_abrasf(comp[0], cancelada=comp[1]))
+            comp = None
+        else:
+            continue
+        # nota lida: solta o elemento (e o que ele segurava) do pai
+        if stack:
+            stack[-1].remove(el)
+        if done is not None:
+            yield done
@@ -0,0 +1,139 @@
+# ocr.py
+# OCR local (Tesseract) para NFS-e escaneadas: rasteriza as páginas e roda o
+# tesseract em paralelo, uma página por tarefa. O texto resultante vai para o
+# mesmo roteador/parsers do texto nativo. Resultado em cache pelo SHA-256 do PDF.
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Iterator, List, Optional
+
+from extractor import LazyDocument, fitz
+from parallel import bounded_map, in_worker
+from cache import get_cache, sha256_bytes, sha256_file
+
+try:
+    import pytesseract
+    from PIL import Image
+except Exception:
+    pytesseract = None
+
+from settings import OCR_ENABLED, OCR_LANG, OCR_DPI, OCR_WORKERS, OCR_CONFIG, OCR_TESSERACT_CMD
+
+logger = logging.getLogger(__name__)
+
+_AVAILABLE = None
+# processos de OCR deste worker do lote (ver set_worker_share)
+_WORKER_SHARE = 1
+
+
+def available() -> bool:
+    """OCR habilitado e tesseract encontrado (pytesseract + binário)."""
+    global _AVAILABLE
+    if not OCR_ENABLED or pytesseract is None:
+        return False
+    if _AVAILABLE is None:
+        if OCR_TESSERACT_CMD:
+            pytesseract.pytesseract.tesseract_cmd = OCR_TESSERACT_CMD
+        try:
+            pytesseract.get_tesseract_version()
+            _AVAILABLE = True
+        except Exception:
+            logger.warning("OCR: tesseract não encontrado; PDFs escaneados seguem como IMAGEM")
+            _AVAILABLE = False
+    return _AVAILABLE
+
+
+# ---------------- rasterização (processo principal) ----------------
+def rasterize(source, dpi: int = OCR_DPI) -> Iterator[bytes]:
+    """Gera um PNG (tons de cinza) por página, uma de cada vez."""
+    if fitz is not None:
+        doc = fitz.open(stream=bytes(source), filetype="pdf") if isinstance(source, (bytes, bytearray)) \
+            else fitz.open(str(source))
+        try:
+            for page in doc:
+                yield page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY).tobytes("png")
+        finally:
+            doc.close()
+        return
+
+    import pdfplumber
+    src = BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    with pdfplumber.open(src) as pdf:
+        for page in pdf.pages:
+            buf = BytesIO()
+            page.to_image(resolution=dpi).original.convert("L").save(buf, format="PNG")
+            page.close()
+            yield buf.getvalue()
+
+
+# ---------------- OCR de uma página (roda no worker) ----------------
+def ocr_page(png: bytes) -> str:
+    # o paralelismo já é por página: cada tesseract usa uma thread só
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    if OCR_TESSERACT_CMD:
+        pytesseract.pytesseract.tesseract_cmd = OCR_TESSERACT_CMD
+    with Image.open(BytesIO(png)) as img:
+        return pytesseract.image_to_string(img, lang=OCR_LANG, config=OCR_CONFIG) or ""
+
+
+def ocr_processes(batch_workers: int = 1) -> int:
+    """Processos de OCR para cada um de `batch_workers` workers do lote (total ~ OCR_WORKERS)."""
+    total = int(OCR_WORKERS or os.cpu_count() or 1)
+    return max(1, total // max(1, int(batch_workers)))
+
+
+def set_worker_share(n: int) -> None:
+    """Chamado ao subir cada worker do lote: quantos processos de OCR ele pode usar."""
+    global _WORKER_SHARE
+    _WORKER_SHARE = max(1, int(n))
+
+
+def ocr_pages(source, workers: Optional[int] = None) -> List[str]:
+    """
+    OCR de todas as páginas, em paralelo por página (pool limitado a `workers`
+    processos e no máximo 2x isso de páginas rasterizadas na memória).
+    Dentro de um worker do lote usa a fatia dele (set_worker_share): lote de um
+    arquivo só fica com todos os processos; lote grande, serial por worker.
+    """
+    if workers is None:
+        workers = _WORKER_SHARE if in_worker() else ocr_processes()
+    workers = max(1, int(workers))
+    if workers == 1:
+        return [ocr_page(png) for png in rasterize(source)]
+    ex = ProcessPoolExecutor(max_workers=workers)
+    try:
+        return list(bounded_map(ex, ocr_page, rasterize(source), max_inflight=workers * 2))
+    finally:
+        # prazo estourado (DocumentTimeout) no meio: não espera as páginas na fila
+        ex.shutdown(wait=True, cancel_futures=True)
+
+
+def open_ocr_document(source, pdf_sha: Optional[str] = None,
+                      workers: Optional[int] = None) -> Optional[LazyDocument]:
+    """
+    Documento com o texto vindo do OCR (mesma interface do extractor.LazyDocument),
+    pronto para select_parser_lazy(). None se o OCR estiver desligado/indisponível.
+    """
+    if not available():
+        return None
+    key = f"ocr-{OCR_LANG}-{OCR_DPI}"
+    cache = get_cache()
+    pages = None
+    if cache is not None:
+        try:
+            if not pdf_sha:
+                pdf_sha = sha256_bytes(source) if isinstance(source, (bytes, bytearray)) else sha256_file(source)
+            pages = cache.get_pages(pdf_sha, key)
+        except Exception:
+            logger.exception("cache: falha ao ler OCR")
+    if pages is None:
+        pages = ocr_pages(source, workers)
+        if cache is not None and pdf_sha:
+            try:
+                cache.put_pages(pdf_sha, key, pages)
+            except Exception:
+                logger.exception("cache: falha ao gravar OCR")
+    doc = LazyDocument(None, backend=key, pages=pages)
+    doc.sha256 = pdf_sha
+    return doc
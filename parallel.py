@@ -0,0 +1,27 @@
+# parallel.py
+# Utilitários de pool de processos compartilhados pelo lote e pelo OCR.
+import multiprocessing
+from collections import deque
+from typing import Callable, Iterable, Iterator
+
+
+def in_worker() -> bool:
+    """True quando estamos dentro de um processo filho (worker de um pool)."""
+    return multiprocessing.parent_process() is not None
+
+
+def bounded_map(executor, fn: Callable, iterable: Iterable, max_inflight: int) -> Iterator:
+    """
+    Como executor.map, mas consome `iterable` aos poucos: no máximo
+    `max_inflight` tarefas pendentes ao mesmo tempo. Os resultados saem na ordem
+    de entrada. Serve para entradas grandes/geradas sob demanda (páginas
+    rasterizadas, membros de um ZIP...) que não cabem todas na memória.
+    """
+    max_inflight = max(1, int(max_inflight))
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_inflight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -1,77 +1,139 @@
 import re
-from dateutil import parser as dtp
 from settings import DEFAULTS, FALLBACK_CLIENTE
-
-
-def _first_line(s: str) -> str:
-    s = (s or "").strip()
-    return s.splitlines()[0].strip() if s else ""
-
-def _m(rx, text, flags=re.I):
-    m = re.search(rx, text, flags)
-    return (m.group(1) or "").strip() if m else ""
-
-def _money(s):
-    s = (s or "").strip()
-    if not s:
-        return "0,00"
-    s = s.replace(".", "").replace(",", ".")
-    try:
-        v = float(s)
-    except ValueError:
-        v = 0.0
-    return f"{v:.2f}".replace(".", ",")
-
-def _date_any(s):
-    s = (s or "").strip()
-    if not s:
-        return s
-    try:
-        d = dtp.parse(s, dayfirst=True, fuzzy=True)
-        return d.strftime("%d/%m/%Y")
-    except Exception:
-        return s
-
-def parse_cwb(text: str) -> dict:
-    d = {}
+from doc_context import as_context
+from field_engine import FieldSet, Match, Row, cents, date_any, first_line
+from layout_classifier import match_markers
+from record import NfseRecord
+
+
+# ---------- campos do layout (compilados uma vez; ver field_engine)
+FIELDS = FieldSet({
+    # DOCUMENTO (topo)
+    "numero_documento": Match(r"Nota\s*N[ºo]\s*([0-9]+)"),
+    "serie":            Match(r"S[ée]rie\s*([A-Za-z0-9\-]+)"),
+    "data":             Match(r"emitido\s+em\s+([0-9]{2}/[0-9]{2}/[0-9]{4})", conv=date_any),
+    # trecho entre "PRESTADOR ..." e o próximo bloco ("TOMADOR", "DISCRIMINAÇÃO", etc.)
+    "prest_bloco": Match(
+        r"PRESTADOR(?:\s+DE\s+SERVI[ÇC]OS)?(.*?)(?:TOMADOR|DISCRIMINA[ÇC][AÃ]O|SERVI[ÇC]OS\s+PRESTADOS|VALOR\s+DOS\s+SERVI[ÇC]OS)",
+        flags=re.I | re.S, strip=False,
+    ),
+    # fallback: "Recebi(emos) do Prestador: NOME ... CNPJ: 00.000.000/0000-00"
+    "recebi_nome": Match(r"Recebi\(emos\)\s+do\s+Prestador\s*:\s*([^C\n\r]+)"),  # antes de "CNPJ:"
+    "recebi_cnpj": Match(r"Recebi\(emos\)\s+do\s+Prestador.*?CNPJ\s*:\s*([\d\.\-\/]{14,18})"),
+    # VALORES: pares de linhas fixos
+    # "DEDUÇÕES DESCONTOS B. CÁLCULO ISS ISS RETIDO COFINS" -> linha seguinte tem:
+    #    R$ <deducao>   R$ <desconto>   R$ <base>   R$ <iss>(<aliquota %>)   <SIM/NÃO>   R$ <cofins>
+    "tabela_iss": Row(
+        r"DEDU[CÇ][ÕO]ES\s+DESCONTOS\s+B\.\s*C[ÁA]LCULO\s+ISS\s+ISS\s+RETIDO\s+COFINS",
+        r"R\$\s*([\d\.\,]+)\s+"      # 1 deduções
+        r"R\$\s*([\d\.\,]+)\s+"      # 2 descontos
+        r"R\$\s*([\d\.\,]+)\s+"      # 3 base cálculo
+        r"R\$\s*([\d\.\,]+)\s*\(\s*([\d\.\,]+)\s*%\s*\)\s+"  # 4 ISS valor, 5 alíquota
+        r"([A-ZÇÃÕ]+)\s+"            # 6 RETIDO (SIM/NÃO)
+        r"R\$\s*([\d\.\,]+)",        # 7 COFINS
+    ),
+    # "PIS CSLL IR INSS VALOR DOS SERVIÇOS" -> linha seguinte tem:
+    #    R$ <pis>  R$ <csll>  R$ <ir>  R$ <inss>  R$ <valor_servicos>
+    "tabela_retencoes": Row(
+        r"\bPIS\s+CSLL\s+IR\s+INSS\s+VALOR\s+DOS\s+SERVI[ÇC]OS\b",
+        r"R\$\s*([\d\.\,]+)\s+"   # 1 PIS
+        r"R\$\s*([\d\.\,]+)\s+"   # 2 CSLL
+        r"R\$\s*([\d\.\,]+)\s+"   # 3 IR
+        r"R\$\s*([\d\.\,]+)\s+"   # 4 INSS
+        r"R\$\s*([\d\.\,]+)",     # 5 VALOR DOS SERVIÇOS
+    ),
+})
+
+# ---------- template de regiões (página 1; pontos, origem no canto superior esquerdo)
+# Lidas por coordenadas (ver extractor.LazyDocument.regions), essas caixas não
+# dependem da ordem em que o pdfminer remonta as colunas da grade de valores.
+# Só completam o que a regex do texto (ancorada nos rótulos) não achou: quando a
+# discriminação tem outra altura a grade sobe/desce e a caixa fixa pega a célula
+# vizinha, que tem o mesmo formato "R$ <valor>".
+REGIONS = {
+    "page": 0,
+    "boxes": {
+        "numero_documento": (460, 30, 580, 48),    # "Número da nota" (canto superior)
+        "serie":            (246, 71, 281, 89),    # "Série 1,"
+        "cnpj":             (100, 156, 215, 174),  # CNPJ do PRESTADOR
+        # linha de "DEDUÇÕES DESCONTOS B. CÁLCULO ISS ISS RETIDO COFINS"
+        "valor_deducao":    (15, 388, 100, 408),
+        "valor_descontos":  (100, 388, 195, 408),
+        "base_calculo":     (195, 388, 295, 408),
+        "iss":              (295, 388, 420, 408),  # "R$ 102,11(4,9300 %)"
+        "iss_retido":       (420, 388, 500, 408),  # SIM/NÃO
+        "valor_cofins":     (500, 388, 580, 408),
+        # linha de "PIS CSLL IR INSS VALOR DOS SERVIÇOS"
+        "valor_pis":        (15, 418, 100, 438),
+        "valor_csll":       (100, 418, 195, 438),
+        "valor_irrf":       (195, 418, 295, 438),
+        "valor_inss":       (295, 418, 420, 438),
+        "valor_servicos":   (420, 418, 580, 438),
+    },
+}
+
+# formato esperado em cada caixa (as demais são células "R$ <valor>")
+_RX_CELL_MONEY = re.compile(r"^\s*R\$\s*([\d\.\,]+)\s*$")
+REGION_FIELDS = {
+    "numero_documento": re.compile(r"^\s*([0-9]+)\s*$"),
+    "serie":            re.compile(r"S[ée]rie\s*([A-Za-z0-9\-]+)", re.I),
+    "cnpj":             re.compile(r"\bCNPJ\s*:\s*([\d\.\-\/]{14,18})", re.I),
+    "iss":              re.compile(r"^\s*R\$\s*([\d\.\,]+)\s*\(\s*([\d\.\,]+)\s*%\s*\)\s*$"),
+    "iss_retido":       re.compile(r"^\s*([A-ZÇÃÕ]+)\s*$"),
+}
+
+
+def _region_values(regions) -> dict:
+    """{campo: valor} das caixas lidas do PDF que vieram no formato esperado."""
+    out = {}
+    for name, raw in (regions or {}).items():
+        m = REGION_FIELDS.get(name, _RX_CELL_MONEY).search(raw or "")
+        if m:
+            out[name] = m.groups() if len(m.groups()) > 1 else m.group(1)
+    return out
+
+
+# campos procurados dentro do bloco do PRESTADOR
+PRESTADOR_FIELDS = FieldSet({
+    "cnpj":      Match(r"\bCNPJ\s*:\s*([\d\.\-\/]{14,18})"),
+    "razao":     Match(r"Raz[aã]o\s*Social\s*:\s*(.+)", conv=first_line),
+    "nome":      Match(r"Nome\s*:\s*(.+)", conv=first_line),
+    "endereco":  Match(r"Endere[cç]o\s*:\s*(.+)", conv=first_line),
+    "municipio": Match(r"Munic[ií]pio\s*:\s*(.+)"),
+    "uf":        Match(r"\bUF\s*:\s*([A-Z]{2})\b"),
+})
+
+
+def parse_cwb(text: str) -> NfseRecord:
+    text = as_context(text)
+    v = FIELDS.extract(text)
+    r = _region_values(text.regions)   # caixas do template (se o PDF foi lido)
+    d = NfseRecord()
 
     # ---------- DOCUMENTO (topo)
-    d["numero_documento"] = _m(r"Nota\s*N[ºo]\s*([0-9]+)", text)
-    d["serie"]            = _m(r"S[ée]rie\s*([A-Za-z0-9\-]+)", text)
-    d["data"]             = _date_any(_m(r"emitido\s+em\s+([0-9]{2}/[0-9]{2}/[0-9]{4})", text))
+    d["numero_documento"] = v["numero_documento"] or r.get("numero_documento")
+    d["serie"]            = v["serie"] or r.get("serie")
+    d["data"]             = v["data"]
 
     # ---------- ISOLAR BLOCO DO PRESTADOR
-    # 1) Tenta pegar o trecho entre "PRESTADOR ..." e o próximo bloco ("TOMADOR", "DISCRIMINAÇÃO", etc.)
-    m_prest = re.search(
-        r"PRESTADOR(?:\s+DE\s+SERVI[ÇC]OS)?(.*?)(?:TOMADOR|DISCRIMINA[ÇC][AÃ]O|SERVI[ÇC]OS\s+PRESTADOS|VALOR\s+DOS\s+SERVI[ÇC]OS)",
-        text, re.I | re.S
-    )
-    if m_prest:
-        prest_bloco = m_prest.group(1)
-    else:
-        prest_bloco = ""
-
-    # 2) Se não achou bloco formal, tenta fallback: "Recebi(emos) do Prestador: NOME ... CNPJ: 00.000.000/0000-00"
+    prest_bloco = v["prest_bloco"]
+
+    # Se não achou bloco formal, cria um bloco sintético só com os dados da linha
+    # "Recebi(emos) do Prestador: ..."
     if not prest_bloco:
-        # Cria um bloco sintético só com os dados que conseguimos nessa linha
-        nome_prest = _m(r"Recebi\(emos\)\s+do\s+Prestador\s*:\s*([^C\n\r]+)", text)  # antes de "CNPJ:"
-        cnpj_prest = _m(r"Recebi\(emos\)\s+do\s+Prestador.*?CNPJ\s*:\s*([\d\.\-\/]{14,18})", text)
-        prest_bloco = f"Razão Social: {nome_prest or ''}\nCNPJ: {cnpj_prest or ''}\n"
+        prest_bloco = f"Razão Social: {v['recebi_nome'] or ''}\nCNPJ: {v['recebi_cnpj'] or ''}\n"
+    p = PRESTADOR_FIELDS.extract(prest_bloco)
 
     # ---------- PRESTADOR: CNPJ / Razão Social / Endereço / Município / UF
-    cnpj_prest  = _m(r"\bCNPJ\s*:\s*([\d\.\-\/]{14,18})", prest_bloco) \
-              or _m(r"Recebi\(emos\)\s+do\s+Prestador.*?CNPJ\s*:\s*([\d\.\-\/]{14,18})", text)
+    cnpj_prest  = p["cnpj"] or v["recebi_cnpj"] or r.get("cnpj")
     # Razão social: tenta no bloco; se vazio, pega da linha "Recebi(emos) do Prestador: ..."
-    razao_prest = _first_line(_m(r"Raz[aã]o\s*Social\s*:\s*(.+)", prest_bloco)) \
-              or _first_line(_m(r"Nome\s*:\s*(.+)", prest_bloco)) \
-              or _first_line(_m(r"Recebi\(emos\)\s+do\s+Prestador\s*:\s*([^C\n\r]+)", text))
+    razao_prest = p["razao"] or p["nome"] or first_line(v["recebi_nome"])
 
-
-    end_prest   = _first_line(_m(r"Endere[cç]o\s*:\s*(.+)", prest_bloco))
-    mun_line    = _m(r"Munic[ií]pio\s*:\s*(.+)", prest_bloco)
+    end_prest   = p["endereco"]
+    mun_line    = p["municipio"]
     mun_prest   = (mun_line.split("UF:")[0].strip() if mun_line else "")
-    uf_prest    = _m(r"\bUF\s*:\s*([A-Z]{2})\b", prest_bloco)
-    
+    uf_prest    = p["uf"]
+
     # Preenche os campos "CLIENTE" do layout com os dados do PRESTADOR
     d["cnpj_cpf"]     = cnpj_prest or FALLBACK_CLIENTE.get("cnpj_cpf","")
     d["razao_social"] = razao_prest or FALLBACK_CLIENTE.get("razao_social","")
@@ -80,79 +142,45 @@ def parse_cwb(text: str) -> dict:
     d["uf"]           = uf_prest or FALLBACK_CLIENTE.get("uf","")
 
 
-    # ---------- VALORES
-    # ---------- VALORES (mapeando pares de linhas fixos por regex)
-    lines = text.splitlines()
-
-    # zera defaults
-    d["valor_deducao"] = d["valor_descontos"] = d["base_calculo"] = "0,00"
-    d["valor_iss_normal"] = d["valor_iss_retido"] = "0,00"
-    d["valor_cofins"] = d["valor_pis"] = d["valor_csll"] = d["valor_irrf"] = d["valor_inss"] = "0,00"
-    d["valor_servicos"] = d["aliquota_iss"] = "0,00"
-
-    # 1) Bloco: "DEDUÇÕES DESCONTOS B. CÁLCULO ISS ISS RETIDO COFINS" -> linha seguinte tem:
-    #    R$ <deducao>   R$ <desconto>   R$ <base>   R$ <iss>(<aliquota %>)   <SIM/NÃO>   R$ <cofins>
-    for i, ln in enumerate(lines):
-        if re.search(r"DEDU[CÇ][ÕO]ES\s+DESCONTOS\s+B\.\s*C[ÁA]LCULO\s+ISS\s+ISS\s+RETIDO\s+COFINS", ln, re.I):
-            if i+1 < len(lines):
-                val_line = lines[i+1]
-                m = re.search(
-                    r"R\$\s*([\d\.\,]+)\s+"      # 1 deduções
-                    r"R\$\s*([\d\.\,]+)\s+"      # 2 descontos
-                    r"R\$\s*([\d\.\,]+)\s+"      # 3 base cálculo
-                    r"R\$\s*([\d\.\,]+)\s*\(\s*([\d\.\,]+)\s*%\s*\)\s+"  # 4 ISS valor, 5 alíquota
-                    r"([A-ZÇÃÕ]+)\s+"            # 6 RETIDO (SIM/NÃO)
-                    r"R\$\s*([\d\.\,]+)",        # 7 COFINS
-                    val_line, re.I
-                )
-                if m:
-                    ded, desc, base, iss_val, iss_pct, iss_ret, cofins = m.groups()
-                    d["valor_deducao"]   = _money(ded)
-                    d["valor_descontos"] = _money(desc)
-                    d["base_calculo"]    = _money(base)
-                    d["aliquota_iss"]    = _money(iss_pct)
-                    # ISS normal x retido
-                    if iss_ret.strip().upper().startswith("N"):   # NÃO
-                        d["valor_iss_normal"] = _money(iss_val)
-                        d["valor_iss_retido"] = "0,00"
-                    else:  # SIM
-                        d["valor_iss_normal"] = "0,00"
-                        d["valor_iss_retido"] = _money(iss_val)
-                    d["valor_cofins"]    = _money(cofins)
-            break
-
-    # 2) Bloco: "PIS CSLL IR INSS VALOR DOS SERVIÇOS" -> linha seguinte tem:
-    #    R$ <pis>  R$ <csll>  R$ <ir>  R$ <inss>  R$ <valor_servicos>
-    for i, ln in enumerate(lines):
-        if re.search(r"\bPIS\s+CSLL\s+IR\s+INSS\s+VALOR\s+DOS\s+SERVI[ÇC]OS\b", ln, re.I):
-            if i+1 < len(lines):
-                val_line = lines[i+1]
-                m = re.search(
-                    r"R\$\s*([\d\.\,]+)\s+"   # 1 PIS
-                    r"R\$\s*([\d\.\,]+)\s+"   # 2 CSLL
-                    r"R\$\s*([\d\.\,]+)\s+"   # 3 IR
-                    r"R\$\s*([\d\.\,]+)\s+"   # 4 INSS
-                    r"R\$\s*([\d\.\,]+)",     # 5 VALOR DOS SERVIÇOS
-                    val_line, re.I
-                )
-                if m:
-                    pis, csll, ir, inss, vserv = m.groups()
-                    d["valor_pis"]      = _money(pis)
-                    d["valor_csll"]     = _money(csll)
-                    d["valor_irrf"]     = _money(ir)
-                    d["valor_inss"]     = _money(inss)
-                    d["valor_servicos"] = _money(vserv)
-            break
-
-
-    # Valor contábil = serviços - descontos - dedução
-    try:
-        vs  = float(d["valor_servicos"].replace(".","").replace(",","."))
-        vd  = float(d["valor_descontos"].replace(".","").replace(",","."))
-        vdd = float(d["valor_deducao"].replace(".","").replace(",","."))
-        d["valor_contabil"] = f"{(vs - vd - vdd):.2f}".replace(".", ",")
-    except:
-        d["valor_contabil"] = d["valor_servicos"]
+    # ---------- VALORES (mapeando pares de linhas fixos)
+    # zera defaults (centavos)
+    d["valor_deducao"] = d["valor_descontos"] = d["base_calculo"] = 0
+    d["valor_iss_normal"] = d["valor_iss_retido"] = 0
+    d["valor_cofins"] = d["valor_pis"] = d["valor_csll"] = d["valor_irrf"] = d["valor_inss"] = 0
+    d["valor_servicos"] = d["aliquota_iss"] = 0
+
+    cells = {}
+    if v["tabela_iss"]:
+        ded, desc, base, iss_val, iss_pct, iss_ret, cofins = v["tabela_iss"]
+        cells.update(valor_deducao=ded, valor_descontos=desc, base_calculo=base,
+                     iss=(iss_val, iss_pct), iss_retido=iss_ret, valor_cofins=cofins)
+    if v["tabela_retencoes"]:
+        pis, csll, ir, inss, vserv = v["tabela_retencoes"]
+        cells.update(valor_pis=pis, valor_csll=csll, valor_irrf=ir, valor_inss=inss,
+                     valor_servicos=vserv)
+    # células lidas por coordenada só entram onde a linha do texto não casou
+    for k, val in r.items():
+        if k not in ("numero_documento", "serie", "cnpj"):
+            cells.setdefault(k, val)
+
+    for k in ("valor_deducao", "valor_descontos", "base_calculo", "valor_cofins",
+              "valor_pis", "valor_csll", "valor_irrf", "valor_inss", "valor_servicos"):
+        if k in cells:
+            d[k] = cents(cells[k])
+    if "iss" in cells and "iss_retido" in cells:
+        iss_val, iss_pct = cells["iss"]
+        d["aliquota_iss"] = cents(iss_pct)
+        # ISS normal x retido
+        if cells["iss_retido"].strip().upper().startswith("N"):   # NÃO
+            d["valor_iss_normal"] = cents(iss_val)
+            d["valor_iss_retido"] = 0
+        else:  # SIM
+            d["valor_iss_normal"] = 0
+            d["valor_iss_retido"] = cents(iss_val)
+
+
+    # Valor contábil = serviços - descontos - dedução (em centavos, sem float)
+    d["valor_contabil"] = d["valor_servicos"] - d["valor_descontos"] - d["valor_deducao"]
 
     # ---------- Defaults Domínio
     d["situacao"]   = DEFAULTS["situacao"]
@@ -169,17 +197,22 @@ def parse_cwb(text: str) -> dict:
 # --- AUTO-DETECÇÃO DE CIDADE (para o roteador) ---------------------
 import re
 
+# sinais bem característicos da NFS-e de Curitiba (ver layout_classifier)
+MARKERS = [
+    ("PREFEITURA DE CURITIBA",),
+    (re.compile(r"\bCURITIBA\s*\(PR\)"),),
+    ("NFS-E - NOTA FISCAL DE SERVIÇOS ELETRÔNICA", "CURITIBA"),
+]
+
 def can_parse_cwb(text: str) -> bool:
-    t = text.upper()
-    # sinais bem característicos da NFS-e de Curitiba
-    return (
-        "PREFEITURA DE CURITIBA" in t
-        or re.search(r"\bCURITIBA\s*\(PR\)", t)
-        or "NFS-E - NOTA FISCAL DE SERVIÇOS ELETRÔNICA" in t and "CURITIBA" in t
-    )
+    return match_markers(MARKERS, text)
 
 PARSER = {
     "name": "Curitiba (CWB)",
     "can_parse": can_parse_cwb,
     "parse": parse_cwb,
+    "markers": MARKERS,
+    "regions": REGIONS,
+    "version": "3",  # suba ao mudar a lógica: invalida os registros em cache
+    "max_pages": 1,  # layout de uma página: anexos seguintes não são lidos
 }
\ No newline at end of file
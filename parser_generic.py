@@ -1,39 +1,13 @@
 # parser_generic.py
 import re
-from dateutil import parser as dtp
 from settings import DEFAULTS, FALLBACK_CLIENTE
 import unicodedata
+from doc_context import as_context
+from field_engine import FieldSet, After, First, Match, RX_PERCENT, cents, date_any, first_line
+from record import NfseRecord
+from template_learner import TemplateLearner, record_ok
 
-# ----------------------- Helpers -----------------------
-
-def _m(rx, text, flags=re.I):
-    m = re.search(rx, text, flags)
-    return (m.group(1) or "").strip() if m else ""
-
-def _first_line(s: str) -> str:
-    s = (s or "").strip()
-    return s.splitlines()[0].strip() if s else ""
-
-def _money(s):
-    s = (s or "").strip()
-    if not s:
-        return "0,00"
-    s = s.replace(".", "").replace(",", ".")
-    try:
-        v = float(s)
-    except Exception:
-        v = 0.0
-    return f"{v:.2f}".replace(".", ",")
-
-def _date_any(s):
-    s = (s or "").strip()
-    if not s:
-        return s
-    try:
-        d = dtp.parse(s, dayfirst=True, fuzzy=True)
-        return d.strftime("%d/%m/%Y")
-    except Exception:
-        return s
+# ----------------------- Campos (compilados uma vez; ver field_engine) -----------------------
 
 # Rótulos tolerantes
 LABELS_VALOR_SERVICOS = r"(VALOR\s+TOTAL\s+DOS\s+SERVI[ÇC]OS|VALOR\s+DOS\s+SERVI[ÇC]OS|VALOR\s+SERVI[ÇC]OS|VALOR\s+DO\s+SERVI[ÇC]O)"
@@ -51,33 +25,87 @@ LABELS_INSS           = r"\bINSS\b"
 # Bloco do Prestador pode aparecer como Prestador/Emitente/Fornecedor
 PRESTADOR_BLOCK       = r"(PRESTADOR|EMITENTE|FORNECEDOR)(?:\s+DE\s+SERVI[ÇC]OS)?"
 
-def _find_money_after(label_rx: str, text: str, lookahead: int = 350) -> str:
-    m = re.search(label_rx, text, re.I)
-    if not m:
-        return "0,00"
-    sub = text[m.end(): m.end() + lookahead]
-    m2 = re.search(r"(?:R\$)?\s*([\d\.\,]+)", sub)
-    return _money(m2.group(1)) if m2 else "0,00"
+def _clean(s):
+    s = (s or "").strip()
+    s = re.sub(r'^[\s:–—\-]+', '', s)
+    s = re.sub(r'[\s:–—\-]+$', '', s)
+    return s
 
-def _find_money_within(label_rx: str, text: str, window: int = 400):
-    m = re.search(label_rx, text, re.I)
-    if not m:
-        return "0,00", "0,00"
-    sub = text[m.end(): m.end() + window]
-    m_val = re.search(r"(?:R\$)?\s*([\d\.\,]+)", sub)
-    m_pct = re.search(r"\(([\d\.\,]+)\s*%\)", sub)
-    val = _money(m_val.group(1)) if m_val else "0,00"
-    pct = _money(m_pct.group(1)) if m_pct else "0,00"
-    return val, pct
-
-def _extract_aliquota(text: str) -> str:
-    m = re.search(r"Al[ií]quota\s*(?:do\s*ISS|%)\s*[:\(\)]?\s*([\d\.\,]+)", text, re.I)
-    return _money(m.group(1)) if m else "0,00"
-
-def _extract_retencao_inline(text: str, campo: str) -> str:
-    rx = fr"{campo}\s*[:\-]?\s*\(?R\$?\)?\s*([\d\.\,]+)"
-    m = re.search(rx, text, re.I)
-    return _money(m.group(1)) if m else "0,00"
+def _clean_serie(s):
+    serie_candidate = _clean(s).strip()
+    # Ignorar termos genéricos sem número
+    if serie_candidate.lower() in {"da", "de", "do", "das", "dos"}:
+        serie_candidate = ""
+    # preferir tokens numéricos quando possível
+    if serie_candidate and not serie_candidate.isdigit():
+        # tenta extrair primeiro grupo numérico dentro do token (ex: "DPS900" -> 900)
+        mnum = re.search(r"(\d{1,6})", serie_candidate)
+        if mnum:
+            serie_candidate = mnum.group(1)
+        else:
+            # se não há dígitos, esvazia para evitar falso positivo
+            serie_candidate = ""
+    return serie_candidate
+
+def _retencao_inline(campo: str) -> Match:
+    # "PIS: R$ 1,00", "COFINS (R$) 2,00"...
+    return Match(fr"{campo}\s*[:\-]?\s*\(?R\$?\)?\s*([\d\.\,]+)", conv=cents, default=0)
+
+# campos procurados tanto no bloco do prestador quanto no texto todo
+_PRESTADOR_SPEC = {
+    "cnpj":      Match(r"\bCNPJ\s*[:\-]?\s*([\d\.\-\/]{14,18})"),
+    "endereco":  Match(r"Endere[cç]o\s*[:\-]?\s*([^\r\n]+)"),
+    "municipio": Match(r"Munic[ií]pio\s*[:\-]?\s*([^\r\n]+)"),
+    "uf":        Match(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b"),
+    # razão social: padrões explícitos (o resto da heurística fica no parser)
+    "razao": First(
+        Match(r"Raz[aã]o\s*Social\s*(?:do\s*Prestador)?\s*[:\-]?\s*(.+)", conv=first_line),
+        Match(r"Nome\s*(?:\/\s*Raz[aã]o\s*Social)?\s*(?:do\s*Prestador)?\s*[:\-]?\s*(.+)", conv=first_line),
+        Match(r"Denomina[cç][aã]o\s*Social\s*[:\-]?\s*(.+)", conv=first_line),
+    ),
+}
+PRESTADOR_FIELDS = FieldSet(_PRESTADOR_SPEC)
+
+FIELDS = FieldSet(dict(_PRESTADOR_SPEC, **{
+    # Documento: matches diretos mais flexíveis (acentos e hífens diferentes)
+    "numero_documento": First(
+        Match(r'Nota\s*N[ºo°]?\s*[:–—\-]?\s*([0-9]{1,15})', conv=_clean),
+        Match(r'N[úu]mero\s+da\s+nota\s*[:–—\-]?\s*([0-9]{1,15})', conv=_clean),
+        Match(r'N[úu]mero\s+da\s+NFS[–—\-\s]?e\s*[:–—\-]?\s*([0-9]{1,15})', conv=_clean),
+        Match(r'NFS[–—\-\s]?e\s*[:–—\-]?\s*([0-9]{1,15})', conv=_clean),
+    ),
+    # Série (ignora falsos positivos como 'da', 'de', 'do')
+    "serie": Match(r'(?:S[ÉE]RIE|SERIE)\s*[:–—\-]?\s*([A-Za-z0-9\-]+)', conv=_clean_serie),
+    "data": First(
+        Match(r"(?:Data\s*(?:da)?\s*Emiss[aã]o|emitid[ao]\s*em)\s*[:\-]?\s*([0-9]{2}/[0-9]{2}/[0-9]{4})"),
+        Match(r"([0-9]{2}/[0-9]{2}/[0-9]{4})"),
+        conv=date_any,
+    ),
+    # bloco do prestador (grupo 1 = rótulo encontrado, como sempre foi)
+    "prest_bloco": Match(
+        PRESTADOR_BLOCK + r"(.*?)(?:TOMADOR|DESTINAT[ÁA]RIO|DISCRIM|DESCRI|VALOR\s+DOS\s+SERVI)",
+        flags=re.I | re.S, strip=False, default=None,
+    ),
+
+    # Valores (label -> valor próximo)
+    "valor_deducao":   After(LABELS_DEDUCOES, 350),
+    "valor_descontos": After(LABELS_DESCONTOS, 350),
+    "base_calculo":    After(LABELS_BASE_CALCULO, 350),
+    "iss_valor":       After(LABELS_ISS, 400),
+    "iss_pct":         After(LABELS_ISS, 400, value=RX_PERCENT),
+    "aliquota":        Match(r"Al[ií]quota\s*(?:do\s*ISS|%)\s*[:\(\)]?\s*([\d\.\,]+)", conv=cents, default=0),
+    # Alguns layouts trazem explicitamente "Valor do ISS"
+    "iss_direto":      After(r"(VALOR\s+DO\s+ISS|ISS\s*[:\-])", 350),
+    "iss_retido":      Match(LABELS_ISS_RETIDO + r"\s*[:\-]?\s*([A-ZÇÃÕ]+)"),
+    # Retenções inline (PIS/COFINS/IR/INSS/CSLL)
+    "valor_pis":       _retencao_inline("PIS"),
+    "valor_cofins":    _retencao_inline("COFINS?"),
+    "valor_irrf":      _retencao_inline("IR"),
+    "valor_inss":      _retencao_inline("INSS"),
+    "valor_csll":      _retencao_inline("CSLL"),
+    # Valor dos serviços – aceita várias grafias/posições; alguns layouts repetem totais no fim
+    "valor_servicos":  First(After(LABELS_VALOR_SERVICOS, 350), After(LABELS_VALOR_SERVICOS, 350, tail=1200)),
+}))
 
 def _norm(s: str) -> str:
     s = s or ""
@@ -113,19 +141,34 @@ def _slice_near(label_rx: str, text: str, window: int = 240) -> str:
 
 # ----------------------- Parser -----------------------
 
-def parse_generic(text: str) -> dict:
-    d = {}
-    T = text
-    U = text.upper()
+# emissores recorrentes: campos recortados direto pelo template aprendido
+TEMPLATES = TemplateLearner()
+
+def parse_generic(text: str) -> NfseRecord:
+    T = as_context(text)
+    # mesmo esqueleto de uma nota já parseada (mesmo emissor/modelo)
+    sk = TEMPLATES.skeleton(T)
+    v = TEMPLATES.apply(sk)
+    if v is not None:
+        d = _record(T, v)
+        if record_ok(d):
+            return d
+        TEMPLATES.forget(sk)
+
+    v, located = FIELDS.extract_located(T)
+    d = _record(T, v)
+    if record_ok(d):
+        # número/série que só saíram pelos fallbacks de proximidade
+        overrides = {k: d[k] for k in ("numero_documento", "serie") if d[k] != v[k]}
+        TEMPLATES.learn(sk, v, located, overrides)
+    return d
 
+def _record(T, v: dict) -> NfseRecord:
+    """Registro a partir dos valores dos FIELDS (do parse completo ou do template)."""
+    d = NfseRecord()
 
-    # ---------- Documento (cobre Eusébio, Curitiba, SJP + fallback por proximidade)
-    def _clean(s):
-        s = (s or "").strip()
-        s = re.sub(r'^[\s:–—\-]+', '', s)
-        s = re.sub(r'[\s:–—\-]+$', '', s)
-        return s
 
+    # ---------- Documento (cobre Eusébio, Curitiba, SJP + fallback por proximidade)
     def _pick_first_number(s):
         if not s:
             return ""
@@ -156,43 +199,8 @@ def parse_generic(text: str) -> dict:
         b = min(len(text), m.end() + window)
         return text[a:b]
 
-    numero_documento = ""
-    serie = ""
-
-    # ---- Matches diretos mais flexíveis (acentos e hífens diferentes)
-    padroes_numero = [
-        r'Nota\s*N[ºo°]?\s*[:–—\-]?\s*([0-9]{1,15})',
-        r'N[úu]mero\s+da\s+nota\s*[:–—\-]?\s*([0-9]{1,15})',
-        r'N[úu]mero\s+da\s+NFS[–—\-\s]?e\s*[:–—\-]?\s*([0-9]{1,15})',
-        r'NFS[–—\-\s]?e\s*[:–—\-]?\s*([0-9]{1,15})',
-    ]
-    for pat in padroes_numero:
-        m = re.search(pat, T, flags=re.IGNORECASE)
-        if m:
-            cand = _clean(m.group(1))
-            if re.search(r'\d', cand):
-                numero_documento = cand
-                break
-
-    # ---- Série (ignora falsos positivos como 'da', 'de', 'do')
-    for pat in [r'(?:S[ÉE]RIE|SERIE)\s*[:–—\-]?\s*([A-Za-z0-9\-]+)']:
-        m = re.search(pat, T, flags=re.IGNORECASE)
-        if m:
-            serie_candidate = _clean(m.group(1)).strip()
-            # Ignorar termos genéricos sem número
-            if serie_candidate.lower() in {"da", "de", "do", "das", "dos"}:
-                serie_candidate = ""
-            # preferir tokens numéricos quando possível
-            if serie_candidate and not serie_candidate.isdigit():
-                # tenta extrair primeiro grupo numérico dentro do token (ex: "DPS900" -> 900)
-                mnum = re.search(r"(\d{1,6})", serie_candidate)
-                if mnum:
-                    serie_candidate = mnum.group(1)
-                else:
-                    # se não há dígitos, esvazia para evitar falso positivo
-                    serie_candidate = ""
-            serie = serie_candidate
-            break
+    numero_documento = v["numero_documento"]
+    serie = v["serie"]
 
 
     # ---- Fallback por proximidade do rótulo, caso o número ainda esteja vazio
@@ -212,7 +220,7 @@ def parse_generic(text: str) -> dict:
 
     # --- Fallback universal (só roda se ainda faltou algo; não altera o que já deu certo)
     if not d["numero_documento"] or not d["serie"]:
-        TN = _norm(T)
+        TN = T.norm_text  # mesma normalização de _norm(), memoizada no contexto
 
         # número da nota
         if not d["numero_documento"]:
@@ -248,32 +256,23 @@ def parse_generic(text: str) -> dict:
 
 
     # ---- Data (mantém sua lógica)
-    d["data"]  = _date_any(
-        _m(r"(?:Data\s*(?:da)?\s*Emiss[aã]o|emitid[ao]\s*em)\s*[:\-]?\s*([0-9]{2}/[0-9]{2}/[0-9]{4})", T)
-        or _m(r"([0-9]{2}/[0-9]{2}/[0-9]{4})", T)
-    )
+    d["data"]  = v["data"]
 
 
 
     # ---------- Prestador (mapeado para as colunas 'CLIENTE' do Domínio)
     # Tenta isolar bloco do prestador. Se não achar, usa o texto inteiro (fallback).
-    m_prest = re.search(
-        PRESTADOR_BLOCK + r"(.*?)(?:TOMADOR|DESTINAT[ÁA]RIO|DISCRIM|DESCRI|VALOR\s+DOS\s+SERVI)",
-        T, re.I | re.S
-    )
-    prest_bloco = m_prest.group(1) if m_prest else T
+    prest_bloco = v["prest_bloco"]
+    if prest_bloco is None:
+        prest_bloco, p = T, v
+    else:
+        p = PRESTADOR_FIELDS.extract(prest_bloco)
 
     # heurística para achar a razão social sem pegar "de Serviços"
     def _guess_razao(prest_text: str, full_text: str) -> str:
         # 1) Padrões explícitos
-        for rx in [
-            r"Raz[aã]o\s*Social\s*(?:do\s*Prestador)?\s*[:\-]?\s*(.+)",
-            r"Nome\s*(?:\/\s*Raz[aã]o\s*Social)?\s*(?:do\s*Prestador)?\s*[:\-]?\s*(.+)",
-            r"Denomina[cç][aã]o\s*Social\s*[:\-]?\s*(.+)",
-        ]:
-            v = _m(rx, prest_text)
-            if v:
-                return _first_line(v)
+        if p["razao"]:
+            return p["razao"]
 
         # 2) Linha imediatamente ANTES do CNPJ dentro do bloco (evita rótulos)
         mcn = re.search(r"\bCNPJ\s*[:\-]?\s*[\d\.\-\/]{14,18}", prest_text, re.I)
@@ -285,23 +284,23 @@ def parse_generic(text: str) -> dict:
 
         for ln in reversed(lines):
             if not is_label(ln):
-                return _first_line(ln)
+                return first_line(ln)
         return ""
 
     # CNPJ sempre por rótulo
-    cnpj_prest  = _m(r"\bCNPJ\s*[:\-]?\s*([\d\.\-\/]{14,18})", prest_bloco) or _m(r"\bCNPJ\s*[:\-]?\s*([\d\.\-\/]{14,18})", T)
+    cnpj_prest  = p["cnpj"] or v["cnpj"]
     # Razão social robusta (evita pegar "de Serviços")
     razao_prest = _guess_razao(prest_bloco, T)
 
     # Endereço: apenas a 1ª linha após "Endereço:", sem puxar CEP/Município
-    end_prest   = _m(r"Endere[cç]o\s*[:\-]?\s*([^\r\n]+)", prest_bloco) or _m(r"Endere[cç]o\s*[:\-]?\s*([^\r\n]+)", T)
+    end_prest   = p["endereco"] or v["endereco"]
     if end_prest:
         # corta qualquer coisa depois de "CEP", "Município", "UF"
         end_prest = re.split(r"\b(CEP|Munic[ií]pio|UF)\b", end_prest)[0].strip()
 
     # Município/UF: pode vir como "Município: CIDADE - UF" na mesma linha
-    mun_line    = _m(r"Munic[ií]pio\s*[:\-]?\s*([^\r\n]+)", prest_bloco) or _m(r"Munic[ií]pio\s*[:\-]?\s*([^\r\n]+)", T)
-    uf_prest    = _m(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b", prest_bloco) or _m(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b", T)
+    mun_line    = p["municipio"] or v["municipio"]
+    uf_prest    = p["uf"] or v["uf"]
 
     municipio_prest = ""
     if mun_line:
@@ -322,22 +321,22 @@ def parse_generic(text: str) -> dict:
     d["uf"]           = uf_prest or FALLBACK_CLIENTE.get("uf","")
 
     # ---------- Valores (label -> valor próximo)
-    d["valor_deducao"]    = _find_money_after(LABELS_DEDUCOES, T)
-    d["valor_descontos"]  = _find_money_after(LABELS_DESCONTOS, T)
-    d["base_calculo"]     = _find_money_after(LABELS_BASE_CALCULO, T)
+    d["valor_deducao"]    = v["valor_deducao"]
+    d["valor_descontos"]  = v["valor_descontos"]
+    d["base_calculo"]     = v["base_calculo"]
 
-    iss_val, iss_pct      = _find_money_within(LABELS_ISS, T)
-    d["aliquota_iss"]     = _extract_aliquota(T) if iss_pct == "0,00" else iss_pct
-    d["valor_iss_normal"] = "0,00"
-    d["valor_iss_retido"] = "0,00"
+    iss_val, iss_pct      = v["iss_valor"], v["iss_pct"]
+    d["aliquota_iss"]     = v["aliquota"] if iss_pct == 0 else iss_pct
+    d["valor_iss_normal"] = 0
+    d["valor_iss_retido"] = 0
 
     # Alguns layouts trazem explicitamente "Valor do ISS"
-    valor_iss_direct      = _find_money_after(r"(VALOR\s+DO\s+ISS|ISS\s*[:\-])", T)
-    if valor_iss_direct != "0,00" and iss_val == "0,00":
+    valor_iss_direct      = v["iss_direto"]
+    if valor_iss_direct != 0 and iss_val == 0:
         iss_val = valor_iss_direct
 
     # ISS retido SIM/NÃO (se não houver, assume normal)
-    iss_ret_txt = (_m(LABELS_ISS_RETIDO + r"\s*[:\-]?\s*([A-ZÇÃÕ]+)", T) or "").upper()
+    iss_ret_txt = (v["iss_retido"] or "").upper()
     if iss_ret_txt.startswith("S"):
         d["valor_iss_retido"] = iss_val
     elif iss_ret_txt.startswith("N"):
@@ -346,29 +345,17 @@ def parse_generic(text: str) -> dict:
         d["valor_iss_normal"] = iss_val
 
     # Retenções inline (PIS/COFINS/IR/INSS/CSLL)
-    d["valor_pis"]       = _extract_retencao_inline(T, "PIS")
-    d["valor_cofins"]    = _extract_retencao_inline(T, "COFINS?")
-    d["valor_irrf"]      = _extract_retencao_inline(T, "IR")
-    d["valor_inss"]      = _extract_retencao_inline(T, "INSS")
-    d["valor_csll"]      = _extract_retencao_inline(T, "CSLL")
-
-    # Valor dos serviços – aceita várias grafias/posições
-    d["valor_servicos"]  = _find_money_after(LABELS_VALOR_SERVICOS, T)
-    if d["valor_servicos"] == "0,00":
-        # Alguns layouts repetem totais no fim
-        tail = T[-1200:]
-        alt = _find_money_after(LABELS_VALOR_SERVICOS, tail)
-        if alt != "0,00":
-            d["valor_servicos"] = alt
-
-    # Valor contábil = serviços - descontos - deduções
-    try:
-        vs  = float(d["valor_servicos"].replace(".","").replace(",","."))
-        vd  = float(d["valor_descontos"].replace(".","").replace(",","."))
-        vdd = float(d["valor_deducao"].replace(".","").replace(",","."))
-        d["valor_contabil"] = f"{(vs - vd - vdd):.2f}".replace(".", ",")
-    except Exception:
-        d["valor_contabil"] = d["valor_servicos"]
+    d["valor_pis"]       = v["valor_pis"]
+    d["valor_cofins"]    = v["valor_cofins"]
+    d["valor_irrf"]      = v["valor_irrf"]
+    d["valor_inss"]      = v["valor_inss"]
+    d["valor_csll"]      = v["valor_csll"]
+
+    # Valor dos serviços – aceita várias grafias/posições (fallback no rodapé)
+    d["valor_servicos"]  = v["valor_servicos"]
+
+    # Valor contábil = serviços - descontos - deduções (centavos)
+    d["valor_contabil"] = d["valor_servicos"] - d["valor_descontos"] - d["valor_deducao"]
 
     # ---------- Defaults Domínio
     d["situacao"]   = DEFAULTS["situacao"]
@@ -391,4 +378,6 @@ PARSER = {
     "name": "Genérico",
     "can_parse": can_parse_generic,
     "parse": parse_generic,
+    "version": "2",  # suba ao mudar a lógica: invalida os registros em cache
+    "max_pages": None,  # precisa do documento inteiro (usa o rodapé como fallback)
 }
@@ -2,9 +2,13 @@
 import re
 import unicodedata
 import traceback
-from dateutil import parser as dtp
 from typing import Tuple, Optional
 
+from doc_context import as_context
+from field_engine import FieldSet, After, First, Match, RX_NUMBER, cents, date_any
+from layout_classifier import match_markers
+from record import NfseRecord
+
 try:
     from settings import DEFAULTS, FALLBACK_CLIENTE
 except Exception:
@@ -21,34 +25,37 @@ def _m(rx, text, flags=re.I) -> str:
     m = re.search(rx, text, flags)
     return (m.group(1) or "").strip() if m else ""
 
-def _date_any(s: str) -> str:
-    s = (s or "").strip()
-    if not s:
-        return ""
-    try:
-        d = dtp.parse(s, dayfirst=True, fuzzy=True)
-        return d.strftime("%d/%m/%Y")
-    except Exception:
-        return s
-
-def _money_from_sub(text: str) -> str:
+def _money_from_sub(text: str) -> int:
     m = re.search(r"(?:R\$)?\s*([\d\.\,]+)", text)
-    if not m:
-        return "0,00"
-    s = m.group(1).strip()
-    s = s.replace(".", "").replace(",", ".")
-    try:
-        v = float(s)
-    except:
-        return "0,00"
-    return f"{v:.2f}".replace(".", ",")
-
-def _find_money_after(label_rx: str, text: str, lookahead: int = 400) -> str:
-    m = re.search(label_rx, text, re.I)
-    if not m:
-        return "0,00"
-    sub = text[m.end(): m.end() + lookahead]
-    return _money_from_sub(sub)
+    return cents(m.group(1)) if m else 0
+
+# ---------------- campos declarativos (compilados uma vez; ver field_engine) ----------------
+def _valor(label_rx: str) -> After:
+    # rótulo -> 1º número nos 400 caracteres seguintes
+    return After(label_rx, 400, value=RX_NUMBER)
+
+FIELDS = FieldSet({
+    "data": First(
+        Match(r"Data\s*(?:e Hora)?\s*da\s*Emiss[aã]o\s*[:\-]?\s*([0-9]{2}/[0-9]{2}/[0-9]{4})"),
+        Match(r"([0-3]?\d/[0-1]?\d/[12]\d{3})", head=1500),
+        conv=date_any,
+    ),
+    "endereco":  Match(r"Endere[cç]o\s*[:\-]?\s*([^\r\n]+)"),
+    "municipio": Match(r"Munic[ií]pio\s*[:\-]?\s*([^\r\n]+)"),
+    "uf":        Match(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b"),
+    "valor_servicos":   _valor(r"Valor\s+do\s+Servi[cç]o|VALOR\s+DOS\s+SERVI[CÇ]OS"),
+    "valor_descontos":  _valor(r"Descontos?"),
+    "valor_deducao":    _valor(r"Dedu[cç][ao]es?|Deducoes?"),
+    "base_calculo":     _valor(r"Base\s+de\s+C[áa]lculo|BASE\s+C[ÁA]LCULO"),
+    "aliquota_iss":     Match(r"Al[ií]quota(?:\s+aplicada)?\s*[:\-]?\s*([\d\.\,]+)", conv=cents, default=0),
+    "valor_iss_normal": _valor(r"Valor\s+do\s+ISS|ISS\s*[:\-]"),
+    "valor_iss_retido": _valor(r"ISS(?:QN)?\s*Retid[ao]?"),
+    "valor_irrf":       _valor(r"IRRF|IR"),
+    "valor_pis":        _valor(r"\bPIS\b"),
+    "valor_cofins":     _valor(r"COFINS?"),
+    "valor_csll":       _valor(r"CSLL"),
+    "valor_inss":       _valor(r"INSS"),
+})
 
 # ---------------- CNPJ helpers ----------------
 def _format_cnpj(digs: str) -> str:
@@ -119,8 +126,9 @@ def _clean_razao_from_header(text: str) -> str:
 # substitua _find_cnpj pelo bloco abaixo
 def _find_cnpj(text: str) -> str:
     # usa versão normalizada para localizar rótulos com acentos/espacos bagunçados
-    header = text[:1500]
-    hn = _norm(header)
+    ctx = as_context(text)
+    header = ctx.head(1500)
+    hn = ctx.head_norm(1500)
 
     # 1) procura label "CNPJ" (ou variantes) no header normalizado e pega janela logo depois
     m_label = re.search(r"\bCNPJ(?:\/CPF|\/NIF)?\b", hn, re.I)
@@ -188,8 +196,9 @@ def _find_cnpj(text: str) -> str:
 
 # substitua _find_numero_serie pelo bloco abaixo
 def _find_numero_serie(text: str) -> Tuple[str, str]:
-    header = text[:1500]
-    hn = _norm(header)
+    ctx = as_context(text)
+    header = ctx.head(1500)
+    hn = ctx.head_norm(1500)
 
     # 0) procurar label explícito "NUMERO DA NFS-E" (normalizado) e capturar o número que vem depois
     m = re.search(r"NUMER?O\s*(?:DA\s*)?NFS[- ]?E\b", hn, re.I)
@@ -298,26 +307,30 @@ def debug_findings(text: str) -> dict:
     return findings
 
 # ---------------- parser principal ----------------
+# marcadores do layout (ver layout_classifier): qualquer regra, todos os itens da regra
+MARKERS = [
+    ("DANFSE",),
+    ("DOCUMENTO AUXILIAR DA NFS-E",),
+    ("CHAVE DE ACESSO", "NFS"),
+    ("PRESTADOR DO SERVI", "VALOR DO SERVI"),
+]
+
 def can_parse_nfse_padrao(text: str) -> bool:
-    T = _norm(text)
-    if "DANFSE" in T or "DOCUMENTO AUXILIAR DA NFS-E" in T:
-        return True
-    if ("CHAVE DE ACESSO" in T and "NFS" in T) or ("PRESTADOR DO SERVI" in T and "VALOR DO SERVI" in T):
-        return True
-    return False
+    return match_markers(MARKERS, text)
 
 import traceback  # coloque no topo do arquivo se ainda não importou
 
-def parse_nfse_padrao(text: str) -> dict:
+def parse_nfse_padrao(text: str) -> NfseRecord:
     """
     Parser robusto para DANFSe/NFS-e.
-    Envolve a lógica em try/except para garantir que sempre retorne um dict (mesmo com erro).
+    Envolve a lógica em try/except para garantir que sempre retorne um registro (mesmo com erro).
     """
-    d = {}
+    d = NfseRecord()
     try:
-        T = text or ""
-        U = _norm(T)
-
+        # T é o DocumentContext montado pelo roteador (ou criado aqui): as
+        # visões normalizadas abaixo são calculadas uma vez só
+        T = as_context(text)
+        campos = FIELDS.extract(T)
 
         # --- CNPJ / Razão social (temporário: razão em branco) ---
         raw_cnpj = _find_cnpj(T)
@@ -333,8 +346,8 @@ def parse_nfse_padrao(text: str) -> dict:
         if serie and serie.isdigit():
             d["serie"] = serie
         else:
-            header = T[:1500]
-            hn = _norm(header)
+            header = T.head(1500)
+            hn = T.head_norm(1500)
             m_s_label = re.search(r"\bS(?:ERIE|[ÉE]RIE)\b", hn)
             found_series = ""
             if m_s_label:
@@ -358,23 +371,19 @@ def parse_nfse_padrao(text: str) -> dict:
             d["serie"] = found_series or (serie or "")
 
         # --- Data ---
-        data = _m(r"Data\s*(?:e Hora)?\s*da\s*Emiss[aã]o\s*[:\-]?\s*([0-9]{2}/[0-9]{2}/[0-9]{4})", T)
-        if not data:
-            header = T[:1500]
-            data = _m(r"([0-3]?\d/[0-1]?\d/[12]\d{3})", header)
-        d["data"] = _date_any(data) if data else ""
+        d["data"] = campos["data"]
 
         # --- Endereço / município / uf ---
-        d["endereco"] = _m(r"Endere[cç]o\s*[:\-]?\s*([^\r\n]+)", T) or ""
-        d["municipio"] = _m(r"Munic[ií]pio\s*[:\-]?\s*([^\r\n]+)", T) or ""
-        d["uf"] = _m(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b", T) or ""
+        d["endereco"] = campos["endereco"]
+        d["municipio"] = campos["municipio"]
+        d["uf"] = campos["uf"]
 
         # --- Valores principais ---
-        d["valor_servicos"] = _find_money_after(r"Valor\s+do\s+Servi[cç]o|VALOR\s+DOS\s+SERVI[CÇ]OS", T)
+        d["valor_servicos"] = campos["valor_servicos"]
 
         # Se não encontrou, procurar valor próximo ao bloco "DescriçãodoServiço" / "ServicoPrestado"
             # Se não encontrou, procurar valor próximo ao bloco "DescriçãodoServiço" / "ServicoPrestado"
-        if d["valor_servicos"] == "0,00":
+        if d["valor_servicos"] == 0:
             header = T[:2500]
             # procura o número monetário mais próximo de "DescriçãodoServiço" ou "SERVIÇOPRESTADO"
             m_descr = re.search(r"Descri[cç][aã]o do Servi[cç]o|SERVI[CÇ]OPRESTADO|SERVI[CÇ]OPRESTADO", header, re.I)
@@ -392,14 +401,14 @@ def parse_nfse_padrao(text: str) -> dict:
                         d["valor_servicos"] = _money_from_sub(mval2.group(1))
 
             # 3) se ainda não achou, buscar no documento por qualquer valor com vírgula ou R$
-            if d["valor_servicos"] == "0,00":
+            if d["valor_servicos"] == 0:
                 m_any = re.search(r"(R\$?\s*[\d\.\,]{1,15}\,\d{2})", T)
                 if m_any:
                     d["valor_servicos"] = _money_from_sub(m_any.group(1))
 
             # 4) fallback mais restrito: procurar valores inteiros curtos (ex.: 150) como token isolado,
             # mas ignorar números que fazem parte de blocos muito longos (QR).
-            if d["valor_servicos"] == "0,00":
+            if d["valor_servicos"] == 0:
                 vals = re.findall(r"\b([0-9]{1,6}(?:[,\.]\d{1,2})?)\b", T)
                 for v in vals:
                     digits = re.sub(r"\D", "", v)
@@ -427,44 +436,28 @@ def parse_nfse_padrao(text: str) -> dict:
 
 
         # Esses campos sempre devem ser avaliados (fora do if)
-        d["valor_descontos"] = _find_money_after(r"Descontos?", T)
-        d["valor_deducao"] = _find_money_after(r"Dedu[cç][ao]es?|Deducoes?", T)
-        d["base_calculo"] = _find_money_after(r"Base\s+de\s+C[áa]lculo|BASE\s+C[ÁA]LCULO", T)
-        d["aliquota_iss"] = _m(r"Al[ií]quota(?:\s+aplicada)?\s*[:\-]?\s*([\d\.\,]+)", T) or "0,00"
-        d["valor_iss_normal"] = _find_money_after(r"Valor\s+do\s+ISS|ISS\s*[:\-]", T)
-        d["valor_iss_retido"] = _find_money_after(r"ISS(?:QN)?\s*Retid[ao]?", T)
-        d["valor_irrf"] = _find_money_after(r"IRRF|IR", T)
-        d["valor_pis"] = _find_money_after(r"\bPIS\b", T)
-        d["valor_cofins"] = _find_money_after(r"COFINS?", T)
-        d["valor_csll"] = _find_money_after(r"CSLL", T)
-        d["valor_inss"] = _find_money_after(r"INSS", T)
-
-
-        # --- Valor contábil (serviços - descontos - deduções) ---
-        try:
-            vs = float(d["valor_servicos"].replace(".", "").replace(",", "."))
-            vd = float(d["valor_descontos"].replace(".", "").replace(",", "."))
-            vdd = float(d["valor_deducao"].replace(".", "").replace(",", "."))
-            d["valor_contabil"] = f"{(vs - vd - vdd):.2f}".replace(".", ",")
-        except Exception:
-            d["valor_contabil"] = d.get("valor_servicos", "0,00")
+        for k in ("valor_descontos", "valor_deducao", "base_calculo", "aliquota_iss",
+                  "valor_iss_normal", "valor_iss_retido", "valor_irrf", "valor_pis",
+                  "valor_cofins", "valor_csll", "valor_inss"):
+            d[k] = campos[k]
+
+
+        # --- Valor contábil (serviços - descontos - deduções), em centavos ---
+        d["valor_contabil"] = d["valor_servicos"] - d["valor_descontos"] - d["valor_deducao"]
 
         # --- Defaults do dominio ---
         d["situacao"] = DEFAULTS.get("situacao", "0")
         d["acumulador"] = DEFAULTS.get("acumulador", "1")
         d["cfps"] = DEFAULTS.get("cfps", "9101")
 
-        # --- Campos vazios para compatibilidade downstream ---
-        d.setdefault("codigo_item", "")
-        d.setdefault("quantidade", "")
-        d.setdefault("valor_unitario", "")
+        # --- Itens (codigo_item/quantidade/valor_unitario) ficam vazios: default do registro ---
 
     except Exception:
-        # Em caso de erro, loga o traceback e devolve o dicionário parcial (não retorna None)
+        # Em caso de erro, loga o traceback e devolve o registro parcial (não retorna None)
         print("Erro em parse_nfse_padrao():")
         traceback.print_exc()
     finally:
-        # garante retorno sempre como dict
+        # garante retorno sempre como registro
         return d
 
 
@@ -472,5 +465,8 @@ PARSER = {
     "name": "NFS-e PADRÃO (DANFSe) - debuggable",
     "can_parse": can_parse_nfse_padrao,
     "parse": parse_nfse_padrao,
+    "markers": MARKERS,
+    "version": "2",  # suba ao mudar a lógica: invalida os registros em cache
+    "max_pages": 1,  # layout de uma página: anexos seguintes não são lidos
     "debug_findings": debug_findings,  # util extra para diagnosticar
 }
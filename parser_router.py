@@ -2,7 +2,19 @@
 from typing import Callable, Tuple
 import logging
 
+from doc_context import DocumentContext, as_context
+from layout_classifier import LayoutClassifier
+from settings import REGION_TEMPLATES, ROUTER_MAX_PAGES
+
 # importe os parsers registrados (cada módulo expõe PARSER = {"name", "can_parse", "parse"})
+# can_parse/parse recebem um doc_context.DocumentContext (é um str, com as visões
+# maiúsculas/sem acento/cabeçalho/linhas memoizadas) montado uma vez aqui
+# opcional: "max_pages" = nº de páginas que o parser precisa ler (None = documento inteiro)
+#           "version"   = versão da lógica do parser (chave do cache de registros)
+#           "markers"   = regras de detecção do layout, usadas pelo classificador de
+#                         uma passada (layout_classifier); sem elas, vale o can_parse
+#           "regions"   = {"page": i, "boxes": {campo: (x0, top, x1, bottom)}}: caixas
+#                         fixas do layout, lidas do PDF e entregues em ctx.regions
 from parser_nfse_padrao import PARSER as PARSER_NFSE
 from parser_cwb import PARSER as PARSER_CWB
 from parser_sp import PARSER as PARSER_SP
@@ -18,6 +30,32 @@ _PARSERS = [
     PARSER_GENERIC,  # sempre por último como fallback
 ]
 
+_BY_NAME = {p["name"]: p for p in _PARSERS}
+
+
+def parser_version(name: str) -> str:
+    p = _BY_NAME.get(name) or {}
+    return str(p.get("version", "0"))
+
+
+# compilado uma vez: uma varredura do texto testa os marcadores de todos os parsers
+_CLASSIFIER = LayoutClassifier(_PARSERS)
+
+
+def _select(text: DocumentContext) -> dict:
+    p, _ = _CLASSIFIER.classify(text)
+    # Fallback universal (garantido existir porque PARSER_GENERIC está na lista)
+    return p or PARSER_GENERIC
+
+
+def classify_layout(text: str) -> Tuple[str, float]:
+    """
+    (nome_do_parser, confiança 0..1) — ver layout_classifier.LayoutClassifier.
+    Confiança 0.0 = nenhum layout reconhecido (caiu no genérico).
+    """
+    p, score = _CLASSIFIER.classify(as_context(text))
+    return (p or PARSER_GENERIC).get("name", "desconhecido"), score
+
 
 def select_parser(text: str) -> Tuple[str, Callable[[str], dict]]:
     """
@@ -26,15 +64,41 @@ def select_parser(text: str) -> Tuple[str, Callable[[str], dict]]:
     Retorna:
         (nome_do_parser, func_parse)
     """
-    for p in _PARSERS:
+    p = _select(as_context(text))
+    return p.get("name", "desconhecido"), p["parse"]
+
+
+def select_parser_context(text: str) -> Tuple[str, Callable[[str], dict], DocumentContext]:
+    """
+    Como select_parser(), devolvendo também o DocumentContext usado no
+    roteamento: passe-o para func_parse, que reaproveita as visões já calculadas.
+    """
+    ctx = as_context(text)
+    p = _select(ctx)
+    return p.get("name", "desconhecido"), p["parse"], ctx
+
+
+def select_parser_lazy(doc) -> Tuple[str, Callable[[str], dict], str]:
+    """
+    Versão para extractor.LazyDocument: roteia olhando só as primeiras
+    ROUTER_MAX_PAGES páginas e devolve também o texto que o parser escolhido
+    precisa (PARSER["max_pages"]), sem extrair páginas que ninguém vai ler.
+
+    Retorna:
+        (nome_do_parser, func_parse, texto_para_o_parser)
+        (o texto é um DocumentContext; o mesmo do roteamento quando o parser
+        lê as mesmas páginas; com as regiões do layout em ctx.regions)
+    """
+    ctx = as_context(doc.text(max_pages=ROUTER_MAX_PAGES))
+    p = _select(ctx)
+    text = doc.text(max_pages=p.get("max_pages"))
+    if text != ctx:
+        ctx = DocumentContext(text)
+    template = p.get("regions")
+    if REGION_TEMPLATES and template:
         try:
-            can = p.get("can_parse")
-            if callable(can) and can(text):
-                return p.get("name", "desconhecido"), p["parse"]
+            ctx.regions = doc.regions(template.get("page", 0), template["boxes"])
         except Exception as e:
-            # loga o erro (ajuda a diagnosticar parsers problemáticos)
-            logger.exception("Erro ao testar can_parse para parser %s: %s", p.get("name"), e)
-            continue
-
-    # Fallback universal (garantido existir porque PARSER_GENERIC está na lista)
-    return PARSER_GENERIC.get("name", "Genérico (fallback)"), PARSER_GENERIC["parse"]
+            # sem regiões o parser segue só com as regex do texto
+            logger.exception("Erro ao ler regiões do layout %s: %s", p.get("name"), e)
+    return p.get("name", "desconhecido"), p["parse"], ctx
@@ -1,75 +1,90 @@
 # parser_sp.py
 import re
-from dateutil import parser as dtp
 from settings import DEFAULTS, FALLBACK_CLIENTE
-
-def _m(rx, text, flags=re.I):
-    m = re.search(rx, text, flags)
-    return (m.group(1) or "").strip() if m else ""
-
-def _first_line(s: str) -> str:
-    s = (s or "").strip()
-    return s.splitlines()[0].strip() if s else ""
-
-def _money(s):
-    s = (s or "").strip()
-    if not s:
-        return "0,00"
-    s = s.replace(".", "").replace(",", ".")
-    try:
-        v = float(s)
-    except ValueError:
-        v = 0.0
-    return f"{v:.2f}".replace(".", ",")
-
-def _date_any(s):
-    s = (s or "").strip()
-    if not s:
-        return s
-    try:
-        d = dtp.parse(s, dayfirst=True, fuzzy=True)
-        return d.strftime("%d/%m/%Y")
-    except Exception:
-        return s
+from field_engine import FieldSet, After, First, Match, RX_MONEY_RS, RX_PERCENT, date_any, first_line
+from layout_classifier import match_markers
+from record import NfseRecord
+
+# marcadores comuns na Nota Paulistana (ver layout_classifier)
+MARKERS = [
+    ("PREFEITURA DO MUNICÍPIO DE SÃO PAULO",),
+    ("PREFEITURA MUNICIPAL DE SÃO PAULO",),
+    ("NOTA FISCAL DE SERVIÇOS ELETRÔNICA", "SÃO PAULO"),
+    ("NOTA PAULISTANA",),
+]
 
 def can_parse_sp(text: str) -> bool:
-    t = text.upper()
-    # marcadores comuns na Nota Paulistana
-    return (
-        "PREFEITURA DO MUNICÍPIO DE SÃO PAULO" in t
-        or "PREFEITURA MUNICIPAL DE SÃO PAULO" in t
-        or "NOTA FISCAL DE SERVIÇOS ELETRÔNICA" in t and "SÃO PAULO" in t
-        or "NOTA PAULISTANA" in t
-    )
-
-def parse_sp(text: str) -> dict:
-    d = {}
+    return match_markers(MARKERS, text)
+
+# ---------- campos do layout (compilados uma vez; ver field_engine)
+# rótulos de valores: pega o 1º "R$" logo depois do rótulo
+def _valor(label_rx: str) -> After:
+    return After(label_rx, 200, value=RX_MONEY_RS)
 
+FIELDS = FieldSet({
     # Documento
-    d["numero_documento"] = _m(r"(?:N[oº]?\s*da\s*NFS-?e|N[oº]?\s*Nota|NFS-?e)\s*[:\-]?\s*([0-9]{1,10})", text)
-    if not d["numero_documento"]:
-        d["numero_documento"] = _m(r"\bNota\s*N[ºo]\s*([0-9]+)", text)
-    d["serie"] = _m(r"S[ée]rie\s*[:\-]?\s*([A-Za-z0-9\-]+)", text)
-    d["data"]  = _date_any(_m(r"(?:Data\s*da\s*Emiss[aã]o|emitid[ao]\s*em)\s*[:\-]?\s*([0-9]{2}/[0-9]{2}/[0-9]{4})", text))
-
-    # PRESTADOR (cliente no layout Domínio)
-    # tenta bloco formal
-    m_prest = re.search(
+    "numero_documento": First(
+        Match(r"(?:N[oº]?\s*da\s*NFS-?e|N[oº]?\s*Nota|NFS-?e)\s*[:\-]?\s*([0-9]{1,10})"),
+        Match(r"\bNota\s*N[ºo]\s*([0-9]+)"),
+    ),
+    "serie": Match(r"S[ée]rie\s*[:\-]?\s*([A-Za-z0-9\-]+)"),
+    "data":  Match(r"(?:Data\s*da\s*Emiss[aã]o|emitid[ao]\s*em)\s*[:\-]?\s*([0-9]{2}/[0-9]{2}/[0-9]{4})", conv=date_any),
+
+    # PRESTADOR (cliente no layout Domínio): bloco formal + fallbacks no texto todo
+    "prest_bloco": Match(
         r"PRESTADOR(?:\s+DE\s+SERVI[ÇC]OS)?(.*?)(?:TOMADOR|DISCRIMINA[ÇC][AÃ]O|DESCRI[ÇC][AÃ]O|VALOR\s+DOS\s+SERVI[ÇC]OS)",
-        text, re.I | re.S
-    )
-    prest_bloco = m_prest.group(1) if m_prest else ""
-
-    cnpj_prest  = _m(r"\bCNPJ\s*[:\-]?\s*([\d\.\-\/]{14,18})", prest_bloco) or _m(r"\bCNPJ\s*[:\-]?\s*([\d\.\-\/]{14,18})", text)
-    razao_prest = _first_line(_m(r"Raz[aã]o\s*Social\s*[:\-]?\s*(.+)", prest_bloco)) or _first_line(_m(r"Nome\s*[:\-]?\s*(.+)", prest_bloco))
-    if not razao_prest:
-        # fallback: linhas “Prestador: NOME ... CNPJ: ...”
-        razao_prest = _first_line(_m(r"Prestador\s*[:\-]?\s*([^C\n\r]+)", text))
-
-    end_prest   = _first_line(_m(r"Endere[cç]o\s*[:\-]?\s*(.+)", prest_bloco)) or _first_line(_m(r"Endere[cç]o\s*[:\-]?\s*(.+)", text))
-    mun_line    = _m(r"Munic[ií]pio\s*[:\-]?\s*(.+)", prest_bloco) or _m(r"Munic[ií]pio\s*[:\-]?\s*(.+)", text)
+        flags=re.I | re.S, strip=False,
+    ),
+    "cnpj":      Match(r"\bCNPJ\s*[:\-]?\s*([\d\.\-\/]{14,18})"),
+    # linhas “Prestador: NOME ... CNPJ: ...”
+    "prestador": Match(r"Prestador\s*[:\-]?\s*([^C\n\r]+)", conv=first_line),
+    "endereco":  Match(r"Endere[cç]o\s*[:\-]?\s*(.+)", conv=first_line),
+    "municipio": Match(r"Munic[ií]pio\s*[:\-]?\s*(.+)"),
+    "uf":        Match(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b"),
+
+    # Valores
+    "valor_deducao":   _valor(r"DEDU[CÇ][ÕO]ES?"),
+    "valor_descontos": _valor(r"DESCONTOS?"),
+    "base_calculo":    _valor(r"BASE\s+DE\s+C[ÁA]LCULO|B\.\s*C[ÁA]LCULO"),
+    "iss_valor":       After(r"\bISS\b", 250, value=RX_MONEY_RS),
+    "iss_pct":         After(r"\bISS\b", 250, value=RX_PERCENT),
+    "iss_retido":      Match(r"ISS\s*RETIDO\s*[:\-]?\s*([A-ZÇÃÕ]+)"),
+    "valor_cofins":    _valor(r"COFINS?"),
+    "valor_pis":       _valor(r"\bPIS\b"),
+    "valor_csll":      _valor(r"\bCSLL\b"),
+    "valor_irrf":      _valor(r"\bIRRF?\b|\bIMPOSTO\s+DE\s+RENDA\b"),
+    "valor_inss":      _valor(r"\bINSS\b"),
+    "valor_servicos":  _valor(r"VALOR\s+DOS\s+SERVI[ÇC]OS|VALOR\s+TOTAL\s+DOS\s+SERVI[ÇC]OS"),
+})
+
+# campos procurados dentro do bloco do PRESTADOR
+PRESTADOR_FIELDS = FieldSet({
+    "cnpj":      Match(r"\bCNPJ\s*[:\-]?\s*([\d\.\-\/]{14,18})"),
+    "razao":     Match(r"Raz[aã]o\s*Social\s*[:\-]?\s*(.+)", conv=first_line),
+    "nome":      Match(r"Nome\s*[:\-]?\s*(.+)", conv=first_line),
+    "endereco":  Match(r"Endere[cç]o\s*[:\-]?\s*(.+)", conv=first_line),
+    "municipio": Match(r"Munic[ií]pio\s*[:\-]?\s*(.+)"),
+    "uf":        Match(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b"),
+})
+
+
+def parse_sp(text: str) -> NfseRecord:
+    v = FIELDS.extract(text)
+    p = PRESTADOR_FIELDS.extract(v["prest_bloco"])
+    d = NfseRecord()
+
+    # Documento
+    d["numero_documento"] = v["numero_documento"]
+    d["serie"] = v["serie"]
+    d["data"]  = v["data"]
+
+    # PRESTADOR (cliente no layout Domínio): bloco formal, depois o texto todo
+    cnpj_prest  = p["cnpj"] or v["cnpj"]
+    razao_prest = p["razao"] or p["nome"] or v["prestador"]
+    end_prest   = p["endereco"] or v["endereco"]
+    mun_line    = p["municipio"] or v["municipio"]
     mun_prest   = (mun_line.split("UF:")[0].strip() if mun_line else "")
-    uf_prest    = _m(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b", prest_bloco) or _m(r"\bUF\s*[:\-]?\s*([A-Z]{2})\b", text)
+    uf_prest    = p["uf"] or v["uf"]
 
     d["cnpj_cpf"]     = cnpj_prest or FALLBACK_CLIENTE.get("cnpj_cpf","")
     d["razao_social"] = razao_prest or FALLBACK_CLIENTE.get("razao_social","")
@@ -77,56 +92,33 @@ def parse_sp(text: str) -> dict:
     d["municipio"]    = mun_prest or "São Paulo"
     d["uf"]           = uf_prest or "SP"
 
-    # ---- Valores: procura rótulo → pega 1º R$ logo depois
-    def find_money_after(label_rx: str, text: str, lookahead: int = 200) -> str:
-        m = re.search(label_rx, text, re.I)
-        if not m:
-            return "0,00"
-        sub = text[m.end(): m.end() + lookahead]
-        m2 = re.search(r"R\$\s*([\d\.\,]+)", sub)
-        return _money(m2.group(1)) if m2 else "0,00"
-
-    def find_money_within(label_rx: str, text: str, window: int = 250):
-        m = re.search(label_rx, text, re.I)
-        if not m:
-            return "0,00", "0,00"
-        sub = text[m.end(): m.end() + window]
-        m_val = re.search(r"R\$\s*([\d\.\,]+)", sub)
-        m_pct = re.search(r"\(([\d\.\,]+)\s*%\)", sub)
-        return (_money(m_val.group(1)) if m_val else "0,00", _money(m_pct.group(1)) if m_pct else "0,00")
-
-    d["valor_deducao"]   = find_money_after(r"DEDU[CÇ][ÕO]ES?", text)
-    d["valor_descontos"] = find_money_after(r"DESCONTOS?", text)
-    d["base_calculo"]    = find_money_after(r"BASE\s+DE\s+C[ÁA]LCULO|B\.\s*C[ÁA]LCULO", text)
-
-    iss_val, iss_pct     = find_money_within(r"\bISS\b", text)
-    d["aliquota_iss"]    = iss_pct
-
-    iss_ret_txt = (_m(r"ISS\s*RETIDO\s*[:\-]?\s*([A-ZÇÃÕ]+)", text) or "").upper()
+    # ---- Valores: rótulo → 1º R$ logo depois
+    d["valor_deducao"]   = v["valor_deducao"]
+    d["valor_descontos"] = v["valor_descontos"]
+    d["base_calculo"]    = v["base_calculo"]
+
+    iss_val              = v["iss_valor"]
+    d["aliquota_iss"]    = v["iss_pct"]
+
+    iss_ret_txt = (v["iss_retido"] or "").upper()
     if iss_ret_txt.startswith("S"):
         d["valor_iss_retido"] = iss_val
-        d["valor_iss_normal"] = "0,00"
+        d["valor_iss_normal"] = 0
     elif iss_ret_txt.startswith("N"):
-        d["valor_iss_retido"] = "0,00"
+        d["valor_iss_retido"] = 0
         d["valor_iss_normal"] = iss_val
     else:
-        d["valor_iss_retido"] = "0,00"; d["valor_iss_normal"] = "0,00"
-
-    d["valor_cofins"] = find_money_after(r"COFINS?", text)
-    d["valor_pis"]    = find_money_after(r"\bPIS\b", text)
-    d["valor_csll"]   = find_money_after(r"\bCSLL\b", text)
-    d["valor_irrf"]   = find_money_after(r"\bIRRF?\b|\bIMPOSTO\s+DE\s+RENDA\b", text)
-    d["valor_inss"]   = find_money_after(r"\bINSS\b", text)
-    d["valor_servicos"] = find_money_after(r"VALOR\s+DOS\s+SERVI[ÇC]OS|VALOR\s+TOTAL\s+DOS\s+SERVI[ÇC]OS", text)
-
-    # Valor contábil
-    try:
-        vs  = float(d["valor_servicos"].replace(".","").replace(",","."))
-        vd  = float(d["valor_descontos"].replace(".","").replace(",","."))
-        vdd = float(d["valor_deducao"].replace(".","").replace(",","."))
-        d["valor_contabil"] = f"{(vs - vd - vdd):.2f}".replace(".", ",")
-    except:
-        d["valor_contabil"] = d["valor_servicos"]
+        d["valor_iss_retido"] = 0; d["valor_iss_normal"] = 0
+
+    d["valor_cofins"] = v["valor_cofins"]
+    d["valor_pis"]    = v["valor_pis"]
+    d["valor_csll"]   = v["valor_csll"]
+    d["valor_irrf"]   = v["valor_irrf"]
+    d["valor_inss"]   = v["valor_inss"]
+    d["valor_servicos"] = v["valor_servicos"]
+
+    # Valor contábil (centavos)
+    d["valor_contabil"] = d["valor_servicos"] - d["valor_descontos"] - d["valor_deducao"]
 
     # Defaults Domínio + Itens
     d["situacao"]   = DEFAULTS["situacao"]
@@ -140,4 +132,7 @@ PARSER = {
     "name": "São Paulo (SP)",
     "can_parse": can_parse_sp,
     "parse": parse_sp,
+    "markers": MARKERS,
+    "version": "2",  # suba ao mudar a lógica: invalida os registros em cache
+    "max_pages": 1,  # layout de uma página: anexos seguintes não são lidos
 }
@@ -0,0 +1,193 @@
+# record.py
+# Registro tipado de uma NFS-e: campos fixos (__slots__), valores em centavos
+# (int) e data como datetime.date. Os parsers montam o registro direto a partir
+# dos campos extraídos; texto no formato do Domínio ("1234,56", "dd/mm/aaaa")
+# só é gerado uma vez, na saída (writer / excel_writer).
+#
+#     r = NfseRecord(numero_documento="123", data="08/07/2025", valor_servicos=123456)
+#     r.valor_servicos          -> 123456
+#     fmt_money(r.valor_servicos) -> "1234,56"
+#     r["serie"] = "1"          # também aceita acesso por chave, como o dict antigo
+#
+# to_dict()/from_dict() levam o registro para JSON (cache, entre processos) e de
+# volta; from_dict também aceita o dict antigo, com valores em texto.
+# dominio_row(r) devolve as 28 colunas do layout já em texto (base do TXT, do
+# XLSX e do CSV).
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Dict, Iterator, Optional
+
+from dates import format_date, to_date
+
+# ordem do layout Domínio (ver writer.build_record / excel_writer.DOMINIO_COLUMNS)
+MONEY_FIELDS = (
+    "valor_servicos", "valor_descontos", "valor_deducao", "valor_contabil",
+    "base_calculo", "aliquota_iss",  # alíquota: centésimos de % ("2,00" -> 200)
+    "valor_iss_normal", "valor_iss_retido", "valor_irrf", "valor_pis",
+    "valor_cofins", "valor_csll", "valor_crf", "valor_inss",
+)
+TEXT_FIELDS = (
+    "cnpj_cpf", "razao_social", "uf", "municipio", "endereco",
+    "numero_documento", "serie", "situacao", "acumulador", "cfps",
+    "codigo_item", "quantidade", "valor_unitario", "origem_parser",
+)
+FIELDS = TEXT_FIELDS + ("data",) + MONEY_FIELDS
+
+_RX_CENTS = re.compile(r"(\d+)(?:\.(\d{1,2}))?")
+
+
+# ---------------- centavos ----------------
+def cents(s: str) -> int:
+    """'1.234,5' -> 123450 (centavos); inválido/vazio -> 0. Sem float no caminho."""
+    s = (s or "").strip().replace(".", "").replace(",", ".")
+    m = _RX_CENTS.fullmatch(s)
+    if m:
+        return int(m.group(1)) * 100 + int((m.group(2) or "0").ljust(2, "0"))
+    try:
+        v = Decimal(s)
+    except (InvalidOperation, ValueError):
+        return 0
+    if not v.is_finite():
+        return 0
+    return int((v * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def fmt_money(c: int) -> str:
+    """123456 -> '1234,56' (texto do layout Domínio)."""
+    sign = "-" if c < 0 else ""
+    q, r = divmod(abs(c), 100)
+    return f"{sign}{q},{r:02d}"
+
+
+def _to_cents(v) -> int:
+    if isinstance(v, int):
+        return v
+    return cents(str(v or ""))
+
+
+# ---------------- registro ----------------
+class NfseRecord:
+    """
+    Uma nota no layout Domínio. Campos de texto são str; MONEY_FIELDS são int
+    (centavos); `data` é datetime.date, ou None — nesse caso `data_texto` guarda
+    o que o parser leu (sai assim no TXT/XLSX, como antes).
+    """
+
+    __slots__ = FIELDS + ("data_texto",)
+
+    def __init__(self, **values):
+        for name in TEXT_FIELDS:
+            setattr(self, name, "")
+        self.situacao = "0"
+        for name in MONEY_FIELDS:
+            setattr(self, name, 0)
+        self.data = None
+        self.data_texto = ""
+        for name, value in values.items():
+            self[name] = value
+
+    # ---- acesso por chave (compatível com o dict que os parsers devolviam)
+    def __getitem__(self, name: str):
+        if name not in FIELDS:
+            raise KeyError(name)
+        if name == "data":
+            return format_date(self.data) if self.data is not None else self.data_texto
+        return getattr(self, name)
+
+    def __setitem__(self, name: str, value) -> None:
+        if name in MONEY_FIELDS:
+            setattr(self, name, _to_cents(value))
+        elif name == "data":
+            self.set_data(value)
+        elif name in TEXT_FIELDS:
+            setattr(self, name, "" if value is None else str(value))
+        else:
+            raise KeyError(name)
+
+    def __contains__(self, name) -> bool:
+        return name in FIELDS
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(FIELDS)
+
+    def keys(self):
+        return FIELDS
+
+    def get(self, name: str, default=None):
+        return self[name] if name in FIELDS else default
+
+    def set_data(self, value) -> None:
+        """date, ou texto (já normalizado pelo parser: dd/mm/aaaa) -> data."""
+        if isinstance(value, date):
+            self.data, self.data_texto = value, ""
+            return
+        text = (value or "").strip()
+        self.data = to_date(text, fuzzy=False)
+        self.data_texto = "" if self.data is not None else text
+
+    # ---- JSON
+    def to_dict(self) -> Dict[str, object]:
+        """Valores em JSON: centavos como int, data ISO (ou o texto lido)."""
+        d = {name: getattr(self, name) for name in TEXT_FIELDS + MONEY_FIELDS}
+        d["data"] = self.data.isoformat() if self.data is not None else self.data_texto
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "NfseRecord":
+        """Inverso de to_dict(); aceita também o dict antigo (valores em texto)."""
+        return cls(**{k: v for k, v in d.items() if k in FIELDS})
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, NfseRecord):
+            return NotImplemented
+        return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"NfseRecord({self.to_dict()!r})"
+
+
+def as_record(obj) -> Optional[NfseRecord]:
+    """NfseRecord a partir de um registro ou dict (antigo ou de to_dict); None passa."""
+    if obj is None or isinstance(obj, NfseRecord):
+        return obj
+    return NfseRecord.from_dict(obj)
+
+
+def fmt_date(r: NfseRecord) -> str:
+    return format_date(r.data) if r.data is not None else r.data_texto
+
+
+def dominio_row(n) -> list:
+    """Registro -> 28 colunas do layout Domínio, em texto (ordem do TXT/XLSX/CSV)."""
+    r = as_record(n)
+    return [
+        r.cnpj_cpf,
+        r.razao_social,
+        r.uf,
+        r.municipio,
+        r.endereco,
+        r.numero_documento.strip(),
+        r.serie.strip(),
+        fmt_date(r),
+        r.situacao.strip(),
+        r.acumulador.strip(),
+        r.cfps.strip(),
+        fmt_money(r.valor_servicos),
+        fmt_money(r.valor_descontos),
+        fmt_money(r.valor_deducao),
+        fmt_money(r.valor_contabil),
+        fmt_money(r.base_calculo),
+        fmt_money(r.aliquota_iss),
+        fmt_money(r.valor_iss_normal),
+        fmt_money(r.valor_iss_retido),
+        fmt_money(r.valor_irrf),
+        fmt_money(r.valor_pis),
+        fmt_money(r.valor_cofins),
+        fmt_money(r.valor_csll),
+        fmt_money(r.valor_crf),
+        fmt_money(r.valor_inss),
+        r.codigo_item,
+        r.quantidade.replace(".", ","),
+        r.valor_unitario.replace(".", ","),
+    ]
@@ -0,0 +1,90 @@
+# segmenter.py
+# Separa PDFs exportados pelos portais das prefeituras com várias NFS-e
+# concatenadas (uma nota por página ou grupo de páginas) em um texto por nota,
+# aproveitando a mesma extração (sem reabrir/re-extrair o PDF).
+import re
+from typing import List, Optional
+
+# Número depois do rótulo: os portais costumam pôr o valor numa coluna ao lado,
+# então entre os dois pode vir outro texto da linha (sem dígitos, até 60 chars).
+_NUMBER = r"[^0-9]{0,60}?([0-9]{1,15})(?![0-9])"
+_CHAVE = r"[^0-9]{0,60}?([0-9]{44,50})(?![0-9])"
+
+# Cabeçalhos que abrem uma nota: (rótulo, [regex da chave da nota]). A chave
+# (grupo 1) é o número da nota ou, no DANFSe, a chave de acesso.
+_HEADERS = [
+    (re.compile(r"Nota\s*N[ºo°](?![a-z])", re.I),
+     [re.compile(r"Nota\s*N[ºo°](?![a-z])\s*[:\-]?" + _NUMBER, re.I)]),
+    (re.compile(r"N[úu]mero\s+da\s+NFS[–—\-\s]?e", re.I),
+     [re.compile(r"N[úu]mero\s+da\s+NFS[–—\-\s]?e" + _NUMBER, re.I)]),
+    (re.compile(r"N[úu]mero\s+da\s+Nota", re.I),
+     [re.compile(r"N[úu]mero\s+da\s+Nota" + _NUMBER, re.I)]),
+    (re.compile(r"DANFSe|Documento\s+Auxiliar\s+da\s+NFS-?e", re.I),
+     [re.compile(r"Chave\s+de\s+Acesso" + _CHAVE, re.I),
+      re.compile(r"N[úu]mero\s+da\s+NFS-?e" + _NUMBER, re.I)]),
+]
+
+# o cabeçalho precisa estar no começo da página (anexos citam "Nota Nº" no meio)
+HEADER_CHARS = 600
+# faixa do topo da página lida para achar o cabeçalho (x0, top, x1, bottom), em pt
+HEADER_BOX = (0, 0, 10000, 220)
+
+
+def _header(page_text: str):
+    """(índice do cabeçalho, chave da nota ou "") do topo da página, ou None."""
+    head = (page_text or "").lstrip()[:HEADER_CHARS]
+    for k, (label, keys) in enumerate(_HEADERS):
+        if label.search(head):
+            for rx in keys:
+                m = rx.search(head)
+                if m:
+                    return k, m.group(1).lstrip("0") or "0"
+            return k, ""
+    return None
+
+
+def split_pages(pages: List[str]) -> List[List[int]]:
+    """
+    Agrupa as páginas por nota. Uma página abre nova nota só quando tem no topo
+    o mesmo cabeçalho da 1ª página e dá para ler nele uma chave (número da nota)
+    diferente da nota atual. Páginas sem cabeçalho ou sem número legível
+    (continuação, anexos) ficam com a nota anterior.
+    """
+    if not pages:
+        return []
+    first = _header(pages[0])
+    if first is None or not first[1]:
+        return [list(range(len(pages)))]
+    groups = [[0]]
+    kind, current = first
+    for i in range(1, len(pages)):
+        h = _header(pages[i])
+        if h is not None and h[0] == kind and h[1] and h[1] != current:
+            groups.append([i])
+            current = h[1]
+        else:
+            groups[-1].append(i)
+    return groups
+
+
+def _heads(doc) -> List[str]:
+    # página já extraída (cache, OCR): usa o texto dela; senão lê só o topo
+    known = doc.snapshot()
+    return [t if t is not None else doc.regions(i, {"topo": HEADER_BOX})["topo"]
+            for i, t in enumerate(known)]
+
+
+def split_notes(doc) -> Optional[List[str]]:
+    """
+    Texto de cada nota de um extractor.LazyDocument. Os cabeçalhos saem só do
+    topo de cada página (doc.regions); as páginas inteiras só são extraídas
+    quando há mais de uma nota. None quando o documento tem uma página só ou
+    uma nota só.
+    """
+    if doc.n_pages < 2:
+        return None
+    groups = split_pages(_heads(doc))
+    if len(groups) < 2:
+        return None
+    pages = list(doc.iter_pages())
+    return ["\n".join(pages[i] for i in g).strip() for g in groups]
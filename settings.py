@@ -5,6 +5,82 @@ PDF_DIR = Path(r"C:\Pedro\Python\Read_NFSe_txt\PDF\cwb_pdfs")
 OUTPUT_TXT = Path(r"C:\Pedro\Python\Read_NFSe_txt\PDF\saida\notas_cwb.txt")
 BLANK_PARTY_FIELDS = True
 
+# Extração de texto: "pdfplumber" (padrão) ou "fitz" (PyMuPDF, bem mais rápido)
+EXTRACTOR_BACKEND = "pdfplumber"
+# Memória na extração: libera o layout de cada página assim que o texto sai, e
+# aborta (ERRO) o documento se o processo passar de EXTRACT_MAX_RSS_MB
+EXTRACT_LOW_MEMORY = True
+EXTRACT_MAX_RSS_MB = None     # ex.: 1500; None = sem limite
+# Prazo por documento: extração + roteamento de cada PDF/XML em até DOC_TIMEOUT_S
+# segundos e cada parse em até PARSE_TIMEOUT_S (o parse também respeita
+# EXTRACT_MAX_RSS_MB). Estourou -> status TIMEOUT e o lote segue. None = sem limite.
+# O OCR de um PDF escaneado tem prazo próprio (OCR_TIMEOUT_S, abaixo).
+DOC_TIMEOUT_S = 120
+PARSE_TIMEOUT_S = 20
+# Worker travado em código nativo (não responde nem ao prazo acima) é morto pelo
+# processo pai depois dos prazos somados dos arquivos do lote + WATCHDOG_GRACE_S
+WATCHDOG_GRACE_S = 600
+
+# Detecção rápida de scan pela 1ª página (fontes/imagens), antes de extrair texto
+FAST_SCAN_DETECTION = True
+SCAN_MIN_IMAGE_COVERAGE = 0.5   # fração mínima da página coberta por imagem
+# OCR local (tesseract) para PDFs escaneados; sem tesseract instalado eles seguem como IMAGEM
+OCR_ENABLED = True
+OCR_LANG = "por"
+OCR_DPI = 300
+OCR_WORKERS = None        # processos do OCR (paralelo por página); None = nº de CPUs
+                          # (dentro do lote, divididos entre os workers: lote de 1 arquivo usa todos)
+OCR_TIMEOUT_S = 600       # prazo do OCR por PDF (-> TIMEOUT); None = sem limite (e sem watchdog)
+OCR_CONFIG = "--psm 6"    # bloco de texto uniforme: preserva melhor as linhas da nota
+OCR_TESSERACT_CMD = None  # ex.: r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+# Páginas lidas para escolher o parser (o cabeçalho da prefeitura fica na 1ª)
+ROUTER_MAX_PAGES = 1
+# Layouts com PARSER["regions"] (caixas fixas na página) leem esses campos direto
+# das coordenadas; False = só as regex sobre o texto da página
+REGION_TEMPLATES = True
+# Parser genérico: aprende o modelo de cada emissor recorrente (esqueleto do texto)
+# e recorta os campos direto nas notas seguintes; TEMPLATE_MAX = modelos em memória
+TEMPLATE_LEARNING = True
+TEMPLATE_MAX = 1000
+
+# Cache em disco (texto extraído + registros parseados), chave = SHA-256 do conteúdo
+CACHE_ENABLED = True
+CACHE_DIR = Path(__file__).resolve().parent / ".cache"
+CACHE_MAX_MB = 512        # acima disso as entradas menos usadas são apagadas
+
+# PDFs com várias NFS-e concatenadas (exportação dos portais): um registro por nota.
+# As notas são detectadas pelo topo de cada página (o PDF só é lido inteiro quando
+# tem mais de uma), mas isso ainda interpreta todas as páginas de todo PDF
+# multipágina: ligue só se a pasta recebe essas exportações.
+SPLIT_MULTI_NOTES = False
+
+# Processamento em lote (main.run)
+BATCH_WORKERS = None      # nº de processos; None = nº de CPUs, 1 = serial
+BATCH_CHUNK_SIZE = 4      # PDFs entregues por vez a cada processo
+# Diário do lote (OUTPUT_TXT -> notas_journal.jsonl): cada arquivo concluído fica
+# gravado; se a execução cair, a próxima pula o que já foi feito e retoma
+BATCH_JOURNAL = True
+# Manifesto (OUTPUT_TXT -> notas_manifest.sqlite3): tamanho/mtime/SHA-256 e
+# resultado de cada arquivo já processado. A execução seguinte só processa o
+# que é novo ou mudou (ou cujo parser subiu de versão) e regera as saídas com tudo
+MANIFEST_ENABLED = True
+
+# Modo contínuo (python main.py --watch): vigia as pastas de entrada, junta os
+# arquivos que chegam em micro-lotes e acrescenta as notas nas saídas do dia.
+# Pasta própria: os arquivos lidos saem dela (WATCH_DONE_SUBDIR), então não use a
+# PDF_DIR do main.run (ela ficaria vazia para a próxima execução em lote).
+WATCH_DIRS = [PDF_DIR.parent / "entrada"]
+WATCH_POLL_S = 0.5          # intervalo entre varreduras das pastas
+WATCH_SETTLE_S = 1.0        # arquivo sem mudar (tamanho/mtime) há esse tempo = cópia terminou
+WATCH_BATCH_MAX = 32        # micro-lote sai ao juntar esse nº de arquivos...
+WATCH_BATCH_WINDOW_S = 1.0  # ...ou esse tempo depois do 1º arquivo pronto
+WATCH_DONE_SUBDIR = "processados"   # lidos vão para <pasta>/processados; None = ficam
+WATCH_ROLL = "%Y-%m-%d"     # saídas por dia (notas_cwb_2025-07-08.txt); None = sempre as mesmas
+
+# Saídas (TXT/XLSX/CSV) gravadas à medida que os registros saem do lote; flush
+# nos arquivos a cada OUTPUT_FLUSH_EVERY notas (None = só no fim)
+OUTPUT_FLUSH_EVERY = 100
+
 # Arquivo TXT
 FILE_ENCODING = "cp1252"
 LINE_ENDING = "\r\n"
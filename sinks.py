@@ -0,0 +1,107 @@
+# sinks.py
+# Saídas incrementais: cada registro vai para o TXT, o XLSX e o CSV assim que é
+# parseado, em vez de acumular o lote inteiro e gravar tudo no fim. A linha do
+# layout Domínio (record.dominio_row) é montada uma vez por registro e repassada
+# a todas as saídas; as do Excel (XLSX/CSV) recebem a mesma lista com os campos
+# do tomador em branco quando BLANK_PARTY_FIELDS (também montada uma vez só).
+#
+#     with FanOut([TxtSink(txt), XlsxSink(xlsx), CsvSink(csv)]) as out:
+#         for rec in registros:      # gerador: nada fica acumulado
+#             out.add(rec)           # ou out.extend(chunk)
+#
+# As implementações ficam junto do formato: writer.TxtSink,
+# excel_writer.XlsxSink / excel_writer.CsvSink.
+from typing import Iterable, List
+
+from record import dominio_row
+from settings import OUTPUT_FLUSH_EVERY
+
+# colunas do tomador na linha do Domínio (razão social, UF, município, endereço)
+PARTY_COLUMNS = slice(1, 5)
+
+
+def blank_party(row: List[str]) -> List[str]:
+    """Cópia da linha com razão social/UF/município/endereço em branco."""
+    out = list(row)
+    out[PARTY_COLUMNS] = [""] * (PARTY_COLUMNS.stop - PARTY_COLUMNS.start)
+    return out
+
+
+class Sink:
+    """
+    Uma saída. Subclasses implementam write_row (e flush/close se houver
+    arquivo); `blank_party` = True recebe a linha já com os campos do tomador
+    em branco.
+    """
+
+    blank_party = False
+
+    def row(self, rec) -> List[str]:
+        row = dominio_row(rec)
+        return blank_party(row) if self.blank_party else row
+
+    def add(self, rec) -> None:
+        self.write_row(self.row(rec))
+
+    def extend(self, recs: Iterable) -> int:
+        n = 0
+        for rec in recs:
+            self.add(rec)
+            n += 1
+        return n
+
+    def write_row(self, row: List[str]) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class FanOut(Sink):
+    """
+    Repassa cada registro a várias saídas (linha montada uma vez só) e dá
+    flush em todas a cada `flush_every` registros (None/0 = só no fim).
+    """
+
+    def __init__(self, sinks: Iterable[Sink], flush_every=OUTPUT_FLUSH_EVERY):
+        self.sinks = list(sinks)
+        self.flush_every = flush_every
+        self.count = 0
+
+    def add(self, rec) -> None:
+        row = dominio_row(rec)
+        blanked = None
+        for sink in self.sinks:
+            if sink.blank_party:
+                if blanked is None:
+                    blanked = blank_party(row)
+                sink.write_row(blanked)
+            else:
+                sink.write_row(row)
+        self.count += 1
+        if self.flush_every and self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self) -> None:
+        # fecha todas, mesmo se alguma falhar (a 1ª exceção sobe no fim)
+        err = None
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                err = err or e
+        if err is not None:
+            raise err
@@ -0,0 +1,187 @@
+# template_learner.py
+# Templates aprendidos por emissor. Notas de um mesmo prestador saem do mesmo
+# modelo: o texto só muda nos números (nº da nota, datas, valores). O esqueleto
+# do texto (cada número trocado por "#") vira a impressão digital do modelo.
+#
+# Depois de um parse completo e válido, o aprendiz guarda onde cada campo foi
+# achado, em posições do esqueleto (que são as mesmas em toda nota do modelo).
+# A próxima nota com o mesmo esqueleto é respondida recortando esses trechos,
+# sem a cadeia de rótulos/fallbacks; se o registro montado não passar na
+# validação, o template é esquecido e vale o parse completo.
+#
+#     sk = TEMPLATES.skeleton(texto)
+#     v = TEMPLATES.apply(sk)                 # {campo: valor} ou None
+#     if v is None:
+#         v, located = FIELDS.extract_located(texto)
+#         ...
+#         TEMPLATES.learn(sk, v, located)     # só se o registro for válido
+#
+# Um esqueleto só é aprendido na 2ª vez que aparece: nota avulsa não paga o
+# custo de aprender. Os templates ficam na memória do processo (LRU).
+import hashlib
+import re
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from record import NfseRecord
+
+from settings import TEMPLATE_LEARNING, TEMPLATE_MAX
+
+# números com pontuação interna ("2.071,26", "12.040.232", "2025"): o que muda
+# entre notas do mesmo modelo. Separadores externos ("/", "-", "(") ficam no esqueleto.
+_RX_NUMBER = re.compile(r"\d(?:[\d\.\,]*\d)?")
+
+
+class Skeleton:
+    """Texto + esqueleto (números -> "#") e a conversão de posições entre os dois."""
+
+    __slots__ = ("text", "masked", "fingerprint", "_starts", "_ends", "_mstarts", "_shift")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.masked = _RX_NUMBER.sub("#", text)
+        self.fingerprint = hashlib.blake2b(
+            self.masked.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        self._starts: Optional[List[int]] = None
+
+    def _index(self) -> None:
+        starts, ends, mstarts, shift = [], [], [], [0]
+        for m in _RX_NUMBER.finditer(self.text):
+            a, b = m.span()
+            mstarts.append(a - shift[-1])
+            starts.append(a)
+            ends.append(b)
+            shift.append(shift[-1] + (b - a - 1))
+        self._starts, self._ends, self._mstarts, self._shift = starts, ends, mstarts, shift
+
+    def to_masked(self, pos: int) -> Optional[int]:
+        """Posição no texto -> no esqueleto; None se cair no meio de um número."""
+        if self._starts is None:
+            self._index()
+        k = bisect_right(self._starts, pos) - 1
+        if k >= 0 and self._starts[k] < pos < self._ends[k]:
+            return None
+        n = k + 1 if k >= 0 and self._ends[k] <= pos else max(k, 0)
+        return pos - self._shift[n]
+
+    def to_text(self, mpos: int) -> int:
+        """Posição no esqueleto -> no texto."""
+        if self._starts is None:
+            self._index()
+        n = bisect_left(self._mstarts, mpos)
+        return mpos + self._shift[n]
+
+
+# mesmos critérios de batch.parse_result_status (CNPJ, número e série)
+def record_ok(d: NfseRecord) -> bool:
+    if not isinstance(d, (NfseRecord, dict)):
+        return False
+    cnpj = re.sub(r"\D", "", d.get("cnpj_cpf", "") or "")
+    numero = str(d.get("numero_documento", "") or "").strip()
+    serie = str(d.get("serie", "") or "").strip()
+    return len(cnpj) == 14 and bool(re.search(r"\d", numero)) and bool(serie)
+
+
+class TemplateLearner:
+    """
+    Templates de um parser: impressão digital do esqueleto -> {campo: fonte},
+    fonte = ("const", valor) ou ("slice", início, fim, conversão) no esqueleto.
+    None = esqueleto que não dá para aprender (algum campo sem trecho único).
+    """
+
+    def __init__(self, max_templates: Optional[int] = None, enabled: Optional[bool] = None):
+        self.max_templates = TEMPLATE_MAX if max_templates is None else max_templates
+        self.enabled = TEMPLATE_LEARNING if enabled is None else enabled
+        self._templates: "OrderedDict[bytes, Optional[dict]]" = OrderedDict()
+        self._seen: "OrderedDict[bytes, None]" = OrderedDict()
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return sum(1 for t in self._templates.values() if t)
+
+    def skeleton(self, text: str) -> Optional[Skeleton]:
+        return Skeleton(text) if self.enabled else None
+
+    def apply(self, sk: Optional[Skeleton]) -> Optional[Dict[str, object]]:
+        """Valores dos campos recortados pelo template do esqueleto (None se não houver)."""
+        if sk is None:
+            return None
+        tpl = self._templates.get(sk.fingerprint)
+        if not tpl:
+            return None
+        self._templates.move_to_end(sk.fingerprint)
+        values = {}
+        for name, src in tpl.items():
+            if src[0] == "const":
+                values[name] = src[1]
+                continue
+            _, a, b, conv = src
+            try:
+                values[name] = conv(sk.text[sk.to_text(a):sk.to_text(b)])
+            except Exception:
+                return None
+        self.hits += 1
+        return values
+
+    def learn(self, sk: Optional[Skeleton], values: Dict[str, object],
+              located: Dict[str, tuple], overrides: Optional[Dict[str, str]] = None) -> None:
+        """
+        Guarda o template de um parse completo e VÁLIDO.
+        values/located: saída de FieldSet.extract_located().
+        overrides: campos cujo valor final veio de outra heurística do parser
+                   ({campo: valor}); precisam aparecer uma única vez no texto.
+        """
+        if sk is None or sk.fingerprint in self._templates:
+            return
+        if sk.fingerprint not in self._seen:
+            self._seen[sk.fingerprint] = None
+            if len(self._seen) > self.max_templates:
+                self._seen.popitem(last=False)
+            return
+        del self._seen[sk.fingerprint]
+        self._store(sk.fingerprint, self._build(sk, values, located, overrides or {}))
+
+    def forget(self, sk: Optional[Skeleton]) -> None:
+        """Descarta o template (o registro recortado não passou na validação)."""
+        if sk is not None:
+            self._templates.pop(sk.fingerprint, None)
+
+    def _store(self, fp: bytes, tpl: Optional[dict]) -> None:
+        self._templates[fp] = tpl
+        if len(self._templates) > self.max_templates:
+            self._templates.popitem(last=False)
+
+    def _build(self, sk: Skeleton, values, located, overrides) -> Optional[dict]:
+        tpl = {}
+        for name, value in values.items():
+            span, conv = located.get(name, (None, None))
+            if name in overrides:
+                value = overrides[name]
+                span, conv = _unique_span(sk.text, value), _identity
+                if span is None:
+                    return None
+            if span is None:
+                # sem match: no mesmo esqueleto também não casa (default)
+                if not isinstance(value, (str, int, type(None))):
+                    return None
+                tpl[name] = ("const", value)
+                continue
+            a, b = sk.to_masked(span[0]), sk.to_masked(span[1])
+            if a is None or b is None:
+                return None  # trecho corta um número ao meio: não é estável
+            tpl[name] = ("slice", a, b, conv)
+        return tpl
+
+
+def _identity(s: str) -> str:
+    return s
+
+
+def _unique_span(text: str, value: str) -> Optional[Tuple[int, int]]:
+    if not value:
+        return None
+    i = text.find(value)
+    if i < 0 or text.find(value, i + 1) >= 0:
+        return None
+    return i, i + len(value)
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from doc_context import DocumentContext
+from extractor import LazyDocument
+from parser_cwb import parse_cwb
+from parser_router import select_parser_lazy
+
+ROOT = Path(__file__).resolve().parent.parent
+CWB_PDF = ROOT / "PDF" / "cwb_pdfs" / "NFSe_Curitiba.pdf"
+# mesma nota com a grade de valores 30pt acima (discriminação uma linha menor):
+# as caixas fixas do REGIONS caem nas células vizinhas
+CWB_SHIFTED_PDF = Path(__file__).resolve().parent / "fixtures" / "cwb_shift-30.pdf"
+
+
+def _routed(path):
+    with LazyDocument(str(path)) as doc:
+        name, parse_fn, ctx = select_parser_lazy(doc)
+    assert name == "Curitiba (CWB)"
+    return parse_fn, ctx
+
+
+def test_shifted_grid_keeps_text_values():
+    parse_fn, ctx = _routed(CWB_SHIFTED_PDF)
+    assert ctx.regions   # o template foi lido (e está deslocado)
+    rec = parse_fn(ctx)
+    assert rec.to_dict() == parse_fn(DocumentContext(str(ctx))).to_dict()
+    assert rec["base_calculo"] == 207126
+    assert rec["valor_servicos"] == 207126
+    assert rec["valor_deducao"] == rec["valor_descontos"] == 0
+
+
+def test_regions_fill_what_the_text_missed():
+    _, ctx = _routed(CWB_PDF)
+    # linha de rótulos da grade do ISS quebrada: a regex do texto não casa
+    broken = DocumentContext(str(ctx).replace("B. CÁLCULO", "B. CALC."))
+    assert parse_cwb(broken)["base_calculo"] == 0
+    broken.regions = ctx.regions
+    rec = parse_cwb(broken)
+    assert rec["base_calculo"] == 207126
+    assert rec["valor_iss_normal"] == 10211